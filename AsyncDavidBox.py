@@ -0,0 +1,305 @@
+"""
+My Popcorn Hour Library - Python - AsyncTheDavidBox
+Asynchronous (event loop) TheDavidBox API, see AsyncTheDavidBox
+Kept out of ShuffleThis.py, so shuffles do not load the event loop modules
+Note: this must run form the popcorn hour device itself
+
+Usage example:
+- Copy this file next to ShuffleThis.py
+- api = AsyncTheDavidBox()
+  request = api.getPlayInfo()
+  info = api.wait(request)
+"""
+
+#Imports
+import sys #Connection errors
+import time #Request timeouts
+import socket #Connections
+import asyncore #Event loop
+import asynchat #Connections
+from collections import deque #Pending requests
+from ShuffleThis import TheDavidBox, ApiRequest
+
+#Classes
+class _AsyncConnection(asynchat.async_chat):
+    """AsyncTheDavidBox keep-alive HTTP/1.1 connection, one request at a time"""
+    def __init__(self, owner, address, map):
+        """Connect
+
+        Args:
+            owner: AsyncTheDavidBox owner
+            address: Device (host, port)
+            map: asyncore socket map
+        """
+        asynchat.async_chat.__init__(self, map = map)
+        self._owner = owner
+        self._host = '%s:%d' % address
+        self.request = None
+        self.isOpen = True
+        self._reset()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(address)
+
+    def sendRequest(self, request):
+        """Send request, connection must be idle"""
+        self.request = request
+        self._reset()
+        self.set_terminator('\r\n\r\n')
+        self.push('GET /%s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\n\r\n' %
+                  (request.getParamString(), self._host))
+
+    def collect_incoming_data(self, data):
+        """Collect response data"""
+        self._buffer.append(data)
+
+    def found_terminator(self):
+        """Handle response part"""
+        data = ''.join(self._buffer)
+        self._buffer = []
+        if self._state == 'headers':
+            lines = data.split('\r\n')
+            status = lines[0].split(None, 2)
+            self._status = int(status[1])
+            headers = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            connection = headers.get('connection', '').lower()
+            self._keepAlive = connection == 'keep-alive' or \
+                              (status[0] == 'HTTP/1.1' and not connection == 'close')
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                self._state = 'size'
+                self.set_terminator('\r\n')
+            elif headers.has_key('content-length'):
+                length = int(headers.get('content-length'))
+                self._state = 'body'
+                if length == 0: self.__finish('')
+                else: self.set_terminator(length)
+            else:
+                #Body ends when connection closes
+                self._state = 'close'
+                self._keepAlive = False
+                self.set_terminator(None)
+        elif self._state == 'body':
+            self.__finish(data)
+        elif self._state == 'size':
+            size = int(data.split(';')[0], 16)
+            if size == 0:
+                self._state = 'trailer'
+            else:
+                self._state = 'chunk'
+                self.set_terminator(size + 2) #Chunk and its CRLF
+        elif self._state == 'chunk':
+            self._chunks.append(data[:-2])
+            self._state = 'size'
+            self.set_terminator('\r\n')
+        elif self._state == 'trailer':
+            if data == '': self.__finish(''.join(self._chunks))
+
+    def _reset(self):
+        """Reset response state"""
+        self._state = 'headers'
+        self._buffer = []
+        self._chunks = []
+        self._status = None
+        self._keepAlive = True
+
+    def __finish(self, data):
+        """Complete current request and return connection to owner"""
+        request = self.request
+        self.request = None
+        if not self._status == 200: data = None
+        if not self._keepAlive: self.close()
+        self._owner._release(self)
+        request.complete(data)
+
+    def abort(self, error):
+        """Close connection and fail current request"""
+        request = self.request
+        self.request = None
+        self.close()
+        self._owner._release(self)
+        if not request == None: request.complete(None, error)
+
+    def close(self):
+        """Close connection"""
+        self.isOpen = False
+        asynchat.async_chat.close(self)
+
+    def handle_connect(self):
+        """Connected, queued request is sent by async_chat"""
+        pass
+
+    def handle_close(self):
+        """Connection closed by device"""
+        if self._state == 'close' and not self.request == None:
+            self._buffer.append(self.ac_in_buffer)
+            self.ac_in_buffer = ''
+            self._keepAlive = False
+            self.__finish(''.join(self._buffer))
+        else:
+            self.abort(IOError('Connection closed'))
+
+    def handle_error(self):
+        """Socket error, fail current request"""
+        self.abort(sys.exc_info()[1])
+
+class AsyncTheDavidBox(TheDavidBox):
+    """Asynchronous TheDavidBox API
+       Same methods as TheDavidBox, each returns an ApiRequest which result is
+       set by the event loop (asyncore) once the reply arrives. Requests are sent
+       over a limited number of keep-alive connections, others wait in order.
+       The loop is driven by poll/run/wait, a shared asyncore map allows driving
+       other dispatchers from the same loop
+    """
+    def __init__(self, host = '127.0.0.1', port = '8008', connections = 2, timeout = 10.0, map = None):
+        """Initialize API
+
+        Args:
+            host: Device host
+            port: Device API port
+            connections: Maximum concurrent connections (requests in flight)
+            timeout: Request timeout in seconds
+            map: Optional asyncore socket map shared with other dispatchers
+        """
+        self._host = host
+        self._port = port
+        self._conn = None
+        self._address = (host, int(port))
+        self._connections = max(1, connections)
+        self._timeout = timeout
+        if map == None: map = {}
+        self._map = map
+        self._idle = []
+        self._busy = []
+        self._pending = deque()
+        self._held = None #Requests held back by ordered enqueueMany
+        self._closed = False
+
+    def close(self):
+        """Close connections, pending requests fail"""
+        self._closed = True
+        for connection in self._idle + self._busy:
+            connection.abort(IOError('API closed'))
+        while len(self._pending) > 0:
+            self._pending.popleft().complete(None, IOError('API closed'))
+
+    def getMap(self):
+        """Get asyncore socket map"""
+        return self._map
+
+    def _invoke(self, paramString, decoder):
+        """Queue API call
+
+        Args:
+            paramString: Parameters string
+            decoder: Response decoder
+
+        Returns: ApiRequest
+        """
+        request = ApiRequest(paramString, decoder)
+        if not self._held == None:
+            self._held.append(request)
+            return request
+        self._pending.append(request)
+        self.__dispatch()
+        return request
+
+    def _release(self, connection):
+        """Connection finished its request"""
+        if connection in self._busy: self._busy.remove(connection)
+        if connection in self._idle: self._idle.remove(connection)
+        if connection.isOpen and connection.request == None: self._idle.append(connection)
+        self.__dispatch()
+
+    def __dispatch(self):
+        """Send pending requests on idle or new connections"""
+        if self._closed:
+            while len(self._pending) > 0:
+                self._pending.popleft().complete(None, IOError('API closed'))
+            return
+        while len(self._pending) > 0:
+            if len(self._idle) > 0:
+                connection = self._idle.pop()
+            elif len(self._busy) < self._connections:
+                connection = _AsyncConnection(self, self._address, self._map)
+            else:
+                return
+            request = self._pending.popleft()
+            request.deadline = time.time() + self._timeout
+            self._busy.append(connection)
+            connection.sendRequest(request)
+
+    def poll(self, timeout = 0.1):
+        """Run a single event loop iteration
+
+        Args:
+            timeout: Maximum seconds to wait for socket events
+        """
+        if len(self._map) > 0:
+            asyncore.loop(timeout, False, self._map, 1)
+        elif timeout > 0:
+            time.sleep(timeout)
+        now = time.time()
+        for connection in list(self._busy):
+            request = connection.request
+            if not request == None and request.deadline < now:
+                connection.abort(socket.timeout('Request timed out'))
+
+    def isBusy(self):
+        """Get whether requests are pending or in flight"""
+        return len(self._pending) > 0 or len(self._busy) > 0
+
+    def run(self, until = None, timeout = 0.1):
+        """Run event loop
+
+        Args:
+            until: Optional function, loop stops once it returns True.
+                   By default loop stops when no request is pending
+            timeout: Maximum seconds of each loop iteration
+        """
+        while True:
+            if until == None:
+                if not self.isBusy(): return
+            elif until(): return
+            self.poll(timeout)
+
+    def wait(self, request):
+        """Run event loop until request is done
+
+        Returns: Request result
+        """
+        self.run(request.isDone)
+        return request.getResult()
+
+    def enqueueMany(self, paths, titles = None, connections = None, ordered = True):
+        """Enqueue many video files
+
+        Args:
+            paths: Video files full paths to enqueue
+            titles: Optional titles list, same length as paths
+            connections: Ignored, requests share the API connections limit
+            ordered: Keep device queue in paths order, each request is sent
+                     once the previous one is done
+
+        Returns: List of ApiRequest (same order as paths)
+        """
+        count = len(paths)
+        if titles == None: titles = [None] * count
+        if not ordered:
+            return [self.enqueue(paths[i], titles[i]) for i in range(count)]
+        #Hold requests back, each is released when the previous is done
+        held = deque()
+        self._held = held
+        try:
+            requests = [self.enqueue(paths[i], titles[i]) for i in range(count)]
+        finally:
+            self._held = None
+        def release(previous = None):
+            if len(held) == 0: return
+            request = held.popleft()
+            request.addCallback(release)
+            self._pending.append(request)
+            self.__dispatch()
+        release()
+        return requests
@@ -0,0 +1,252 @@
+"""
+My Popcorn Hour Library - Python - Benchmark suite
+Measures the scripts off-device against a fake TheDavidBox (see FakeDavidBox.py)
+and a synthetic media tree (see MediaTree.py):
+- ShuffleThis directory scan (getFiles), with and without media index
+- ShuffleThis main, scan, shuffle and queue building on the device
+- TheDavidBox reply decoding
+- LittleServer request throughput, a connection per request (configured mode) and
+  keep-alive connections (async mode)
+
+Run example:
+- run 'python BenchmarkSuite.py'
+- run 'python BenchmarkSuite.py --save base.json' before a change and
+  'python BenchmarkSuite.py --baseline base.json' after it, exits with 1 on regressions
+- run 'python BenchmarkSuite.py --help' for tree size, latency and load options
+Note: main is measured only if port 8008 is free, as ShuffleThis uses the default device port
+"""
+
+#Imports
+import os #Paths
+import sys #Arguments
+import time #Timing
+import json #Results
+import socket #Fake device port
+import shutil #Temporary files
+import httplib #Server clients
+import tempfile #Temporary files
+import threading #Server clients
+from optparse import OptionParser #Arguments
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'LittleServer'))
+import ShuffleThis
+from ShuffleThis import ApiReply, fileRetriver
+from FakeDavidBox import FakeDevice, FakeServer
+from MediaTree import createTree, VIDEO
+from LittleServer import ConfigFile, JobRunner, StaticCache, createServer, webServerCreator
+
+SERVER_CONFIG = '''<configuration>
+  <port>0</port>
+  <server mode="%s" workers="%d" />
+  <dir>%s</dir>
+</configuration>'''
+
+#Functions
+def best(repeat, action):
+    """Run action repeat times, returns shortest duration in seconds"""
+    result = None
+    for i in range(repeat):
+        start = time.time()
+        action()
+        elapsed = time.time() - start
+        if result == None or elapsed < result: result = elapsed
+    return result
+
+def benchScan(tree, workers, repeat):
+    """Time full directory scan"""
+    return best(repeat, lambda: fileRetriver(VIDEO, workers = workers).getFiles(tree))
+
+def benchIndex(tree, workers, repeat, work):
+    """Time directory scan with an up to date media index"""
+    indexDir = os.path.join(work, 'index')
+    os.mkdir(indexDir)
+    fileRetriver(VIDEO, indexDir, workers = workers).getFiles(tree)
+    return best(repeat, lambda: fileRetriver(VIDEO, indexDir, workers = workers).getFiles(tree))
+
+def benchMain(tree, device, repeat):
+    """Time ShuffleThis main (scan, shuffle, play and enqueue all files)
+
+    Returns: Tuple of seconds and device calls per run
+    """
+    calls = device.calls
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        seconds = best(repeat, lambda: ShuffleThis.main([tree]))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return (seconds, (device.calls - calls) / repeat)
+
+def benchDecode(keys, payload, iterations):
+    """Time reply decoding
+
+    Returns: Tuple of play info and keys reply microseconds per decode
+    """
+    device = FakeDevice(0, keys, payload)
+    device.playing = '/share/Video/video.mkv'
+    playInfo = device.handle('playback', 'get_current_vod_info', [])
+    keyList = device.handle('system', 'list_key', [])
+    results = []
+    for data in (playInfo, keyList):
+        start = time.time()
+        for i in xrange(iterations):
+            ApiReply(data).getItems()
+        results.append((time.time() - start) * 1000000.0 / iterations)
+    return tuple(results)
+
+def benchServer(requests, clients, work, mode = 'threaded', keepAlive = False):
+    """Measure LittleServer requests per second of html and status requests
+
+    Args:
+        requests: Number of requests
+        clients: Number of concurrent clients
+        work: Work directory
+        mode: Server mode
+        keepAlive: Clients send all requests on one connection, otherwise a connection per request
+    """
+    html = os.path.join(work, 'html')
+    if not os.path.isdir(html): os.mkdir(html)
+    f = open(os.path.join(html, 'index.html'), 'w')
+    f.write('<html><body>' + 'Popcorn Hour Commander ' * 200 + '</body></html>')
+    f.close()
+    path = os.path.join(work, 'config.xml')
+    f = open(path, 'w')
+    f.write(SERVER_CONFIG % (mode, clients, html))
+    f.close()
+    configFile = ConfigFile(path)
+    configFile.load()
+    server = createServer(configFile.get(), webServerCreator(configFile, JobRunner(), StaticCache()))
+    thread = threading.Thread(target = server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    port = server.server_address[1]
+    def client(count):
+        conn = httplib.HTTPConnection('127.0.0.1', port)
+        for i in range(count):
+            if i % 2 == 0: conn.request('GET', '/index.html')
+            else: conn.request('GET', '/jobs')
+            conn.getresponse().read()
+            if not keepAlive: conn.close()
+        conn.close()
+    threads = [threading.Thread(target = client, args = (requests / clients,))
+               for i in range(clients)]
+    start = time.time()
+    for item in threads:
+        item.start()
+    for item in threads:
+        item.join()
+    elapsed = time.time() - start
+    server.shutdown()
+    server.drain()
+    server.server_close()
+    return (requests / clients) * clients / elapsed
+
+def compare(results, baseline, tolerance):
+    """Print results and changes from baseline
+
+    Args:
+        results: List of (name, value, unit, lower is better)
+        baseline: Dictionary of name to value or None
+        tolerance: Allowed relative change before a result is a regression
+
+    Returns: Number of regressions
+    """
+    regressions = 0
+    for name, value, unit, lower in results:
+        line = '%-24s %12.3f %-6s' % (name, value, unit)
+        if not baseline == None and baseline.get(name):
+            change = value / baseline[name] - 1
+            worse = (lower and change > tolerance) or (not lower and change < -tolerance)
+            line += ' %+7.1f%%' % (change * 100)
+            if worse:
+                line += ' REGRESSION'
+                regressions += 1
+        print line
+    return regressions
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    parser = OptionParser(usage = 'Usage: BenchmarkSuite [options]')
+    parser.add_option('--files', dest = 'files', type = 'int', default = 5000,
+                      help = 'number of files of synthetic media tree')
+    parser.add_option('--depth', dest = 'depth', type = 'int', default = 3,
+                      help = 'sub directory levels of synthetic media tree')
+    parser.add_option('--breadth', dest = 'breadth', type = 'int', default = 4,
+                      help = 'sub directories of each synthetic media tree directory')
+    parser.add_option('--workers', dest = 'workers', type = 'int', default = 4,
+                      help = 'number of directory listing threads')
+    parser.add_option('--latency', dest = 'latency', type = 'float', default = 0.0,
+                      help = 'fake device response delay in seconds')
+    parser.add_option('--keys', dest = 'keys', type = 'int', default = 60,
+                      help = 'fake device number of system keys')
+    parser.add_option('--payload', dest = 'payload', type = 'int', default = 0,
+                      help = 'fake device number of extra play info items')
+    parser.add_option('--iterations', dest = 'iterations', type = 'int', default = 5000,
+                      help = 'reply decoding iterations')
+    parser.add_option('--requests', dest = 'requests', type = 'int', default = 2000,
+                      help = 'LittleServer requests')
+    parser.add_option('--clients', dest = 'clients', type = 'int', default = 4,
+                      help = 'LittleServer concurrent clients')
+    parser.add_option('--mode', dest = 'mode', default = 'threaded',
+                      help = 'LittleServer mode of a connection per request measurement')
+    parser.add_option('--repeat', dest = 'repeat', type = 'int', default = 3,
+                      help = 'runs of each measurement, shortest is kept')
+    parser.add_option('--save', dest = 'save', default = None,
+                      help = 'save results as json baseline file')
+    parser.add_option('--baseline', dest = 'baseline', default = None,
+                      help = 'compare results with json baseline file')
+    parser.add_option('--tolerance', dest = 'tolerance', type = 'float', default = 0.2,
+                      help = 'relative change allowed before a result is a regression')
+    options, args = parser.parse_args()
+    work = tempfile.mkdtemp(prefix = 'benchmark')
+    results = []
+    try:
+        tree = os.path.join(work, 'media')
+        dirs, videos = createTree(tree, options.files, options.depth, options.breadth)
+        print 'Media tree: %d directories, %d files (%d videos)' % (dirs, options.files, videos)
+        results.append(('scan', benchScan(tree, options.workers, options.repeat), 's', True))
+        results.append(('scan indexed', benchIndex(tree, options.workers, options.repeat, work),
+                        's', True))
+        try:
+            device = FakeServer(8008, options.latency, options.keys, options.payload)
+        except socket.error:
+            device = None
+            print 'Port 8008 is in use, main is not measured'
+        if not device == None:
+            device.start()
+            try:
+                seconds, calls = benchMain(tree, device.device, options.repeat)
+            finally:
+                device.stop()
+            print 'main: %d device calls per run' % calls
+            results.append(('main', seconds, 's', True))
+        playInfo, keys = benchDecode(options.keys, options.payload, options.iterations)
+        results.append(('decode play info', playInfo, 'us', True))
+        results.append(('decode keys', keys, 'us', True))
+        results.append(('server', benchServer(options.requests, options.clients, work, options.mode),
+                        'req/s', False))
+        results.append(('server keep-alive', benchServer(options.requests, options.clients, work,
+                                                          'async', True), 'req/s', False))
+    finally:
+        shutil.rmtree(work, True)
+    baseline = None
+    if not options.baseline == None:
+        f = open(options.baseline, 'r')
+        baseline = json.load(f)
+        f.close()
+    regressions = compare(results, baseline, options.tolerance)
+    if not options.save == None:
+        f = open(options.save, 'w')
+        json.dump(dict([(name, value) for name, value, unit, lower in results]), f, indent = 1)
+        f.close()
+    if regressions > 0:
+        print '%d regressions' % regressions
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
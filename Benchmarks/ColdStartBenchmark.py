@@ -0,0 +1,160 @@
+"""
+My Popcorn Hour Library - Python - Cold start benchmark
+Measures cold start of each entry point in a new interpreter, as run by a
+LittleServer command:
+- ShuffleThis: import time and first action (main, scan, shuffle and queue a
+  small synthetic media tree on a fake TheDavidBox, see FakeDavidBox.py),
+  also as a script run ('python ShuffleThis.py'), which compiles the script
+  on every run instead of using its compiled (.pyc) module
+- LittleServer: import time and first action (load configuration, start
+  server and answer a first page request)
+Each run is measured in its own process, the shortest of several runs is kept
+
+Run example:
+- run 'python ColdStartBenchmark.py'
+- run 'python ColdStartBenchmark.py --import-budget 30 --start-budget 150'
+  exits with 1 if an entry point import or start (process start to first
+  action done) takes longer than its budget in milliseconds
+Note: ShuffleThis is measured only if port 8008 is free, as ShuffleThis uses the default device port
+"""
+
+#Imports
+import os #Paths
+import sys #Arguments
+import time #Timing
+import json #Measures
+import socket #Fake device port
+import shutil #Temporary files
+import tempfile #Temporary files
+import subprocess #Measure processes
+from optparse import OptionParser #Arguments
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FakeDavidBox import FakeServer
+from MediaTree import createTree
+
+#Measured in the new interpreter, only time is imported before the entry point
+SHUFFLE = '''import time; start = time.time()
+import ShuffleThis; imported = time.time()
+ShuffleThis.main(%r); done = time.time()
+import sys, json; sys.stderr.write(json.dumps([imported - start, done - imported, len(sys.modules)]))'''
+SERVER = '''import time; start = time.time()
+import LittleServer; imported = time.time()
+configFile = LittleServer.ConfigFile(%r); configFile.load()
+server = LittleServer.createServer(configFile.get(),
+    LittleServer.webServerCreator(configFile, LittleServer.JobRunner(), LittleServer.StaticCache()))
+import threading, socket; thread = threading.Thread(target = server.serve_forever)
+thread.setDaemon(True); thread.start()
+conn = socket.create_connection(('127.0.0.1', server.server_address[1]))
+conn.sendall('GET /index.html HTTP/1.0\\r\\n\\r\\n')
+while len(conn.recv(65536)) > 0: pass
+done = time.time()
+import os, sys, json; sys.stderr.write(json.dumps([imported - start, done - imported, len(sys.modules)]))
+sys.stderr.flush(); os._exit(0) #Server thread is not stopped'''
+SERVER_CONFIG = '''<configuration>
+  <port>0</port>
+  <server mode="single" />
+  <dir>%s</dir>
+</configuration>'''
+
+#Functions
+def run(argv, cwd):
+    """Run process
+
+    Returns: Tuple of seconds and error output
+    """
+    start = time.time()
+    process = subprocess.Popen(argv, cwd = cwd, stdout = open(os.devnull, 'w'), stderr = subprocess.PIPE)
+    error = process.communicate()[1]
+    elapsed = time.time() - start
+    if not process.returncode == 0: raise RuntimeError('%s failed: %s' % (argv[1], error))
+    return (elapsed, error)
+
+def measure(code, cwd, repeat):
+    """Measure entry point code in new interpreters
+
+    Returns: Tuple of shortest import, first action and process seconds, and modules count
+    """
+    result = None
+    #First run compiles modules (.pyc), as after an install
+    run([sys.executable, '-c', code], cwd)
+    for i in range(repeat):
+        elapsed, error = run([sys.executable, '-c', code], cwd)
+        imported, action, modules = json.loads(error.strip().splitlines()[-1])
+        if result == None: result = [imported, action, elapsed, modules]
+        else: result = [min(imported, result[0]), min(action, result[1]), min(elapsed, result[2]), modules]
+    return tuple(result)
+
+def measureScript(argv, cwd, repeat):
+    """Measure script run in new interpreters, shortest seconds"""
+    return min([run([sys.executable] + argv, cwd)[0] for i in range(repeat)])
+
+def measureInterpreter(repeat):
+    """Measure empty interpreter run, shortest seconds"""
+    return min([run([sys.executable, '-c', 'pass'], ROOT)[0] for i in range(repeat)])
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    parser = OptionParser(usage = 'Usage: ColdStartBenchmark [options]')
+    parser.add_option('--files', dest = 'files', type = 'int', default = 50,
+                      help = 'number of files of synthetic media tree')
+    parser.add_option('--repeat', dest = 'repeat', type = 'int', default = 5,
+                      help = 'runs of each measurement, shortest is kept')
+    parser.add_option('--import-budget', dest = 'importBudget', type = 'float', default = None,
+                      help = 'milliseconds allowed for each entry point import')
+    parser.add_option('--start-budget', dest = 'startBudget', type = 'float', default = None,
+                      help = 'milliseconds allowed from process start to first action done')
+    options, args = parser.parse_args()
+    work = tempfile.mkdtemp(prefix = 'coldstart')
+    results = []
+    try:
+        tree = os.path.join(work, 'media')
+        createTree(tree, options.files, 2, 4)
+        html = os.path.join(work, 'html')
+        os.mkdir(html)
+        f = open(os.path.join(html, 'index.html'), 'w')
+        f.write('<html><body>Popcorn Hour Commander</body></html>')
+        f.close()
+        config = os.path.join(work, 'config.xml')
+        f = open(config, 'w')
+        f.write(SERVER_CONFIG % html)
+        f.close()
+        print 'interpreter %8.1f ms' % (measureInterpreter(options.repeat) * 1000)
+        try:
+            device = FakeServer(8008)
+        except socket.error:
+            device = None
+            print 'Port 8008 is in use, ShuffleThis is not measured'
+        if not device == None:
+            device.start()
+            try:
+                argv = ['-f', 'avi,mkv,mp4,flv', tree]
+                results.append(('ShuffleThis',) + measure(SHUFFLE % argv, ROOT, options.repeat))
+                script = measureScript(['ShuffleThis.py'] + argv, ROOT, options.repeat)
+            finally:
+                device.stop()
+        results.append(('LittleServer',) +
+                        measure(SERVER % config, os.path.join(ROOT, 'LittleServer'), options.repeat))
+    finally:
+        shutil.rmtree(work, True)
+    failed = 0
+    for name, imported, action, elapsed, modules in results:
+        line = '%-12s import %7.1f ms  first action %7.1f ms  process %7.1f ms  %d modules' % \
+               (name, imported * 1000, action * 1000, elapsed * 1000, modules)
+        if not options.importBudget == None and imported * 1000 > options.importBudget:
+            line += ' IMPORT OVER BUDGET'
+            failed += 1
+        if not options.startBudget == None and elapsed * 1000 > options.startBudget:
+            line += ' START OVER BUDGET'
+            failed += 1
+        print line
+        if name == 'ShuffleThis':
+            print '%-12s script run %7.1f ms (compiles script, no .pyc)' % (name, script * 1000)
+    if failed > 0:
+        print '%d over budget' % failed
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
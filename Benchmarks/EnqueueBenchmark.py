@@ -0,0 +1,68 @@
+"""
+My Popcorn Hour Library - Python - Enqueue benchmark
+Compares the per-file enqueue loop against TheDavidBox.enqueueMany
+
+Run example:
+- run 'python EnqueueBenchmark.py [count] [latency] [connections]'
+  Runs against a local fake device (see FakeDavidBox.py) with [latency] seconds per reply
+- run 'python EnqueueBenchmark.py [count] [latency] [connections] [host] [port]'
+  Runs against a real device, note this replaces the device playback queue
+"""
+
+#Imports
+import os #Paths
+import sys #Arguments
+import time #Timing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ShuffleThis import TheDavidBox
+from FakeDavidBox import FakeServer
+
+#Functions
+def loopEnqueue(api, paths):
+    """Enqueue files one by one (ShuffleThis original loop)"""
+    for path in paths:
+        api.enqueue(path)
+
+def bulkEnqueue(api, paths, connections):
+    """Enqueue files with enqueueMany"""
+    api.enqueueMany(paths, connections = connections, ordered = False)
+
+def measure(name, count, action):
+    """Time action and print throughput"""
+    start = time.time()
+    action()
+    elapsed = time.time() - start
+    print '%-24s %8.3fs %10.1f files/s' % (name, elapsed, count / elapsed)
+    return elapsed
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    count = 1000
+    latency = 0.005
+    connections = 4
+    if len(sys.argv) > 1: count = int(sys.argv[1])
+    if len(sys.argv) > 2: latency = float(sys.argv[2])
+    if len(sys.argv) > 3: connections = int(sys.argv[3])
+    server = None
+    if len(sys.argv) > 5:
+        host, port = sys.argv[4], sys.argv[5]
+    else:
+        server = FakeServer(0, latency)
+        server.start()
+        host, port = '127.0.0.1', str(server.getPort())
+    paths = ['/share/Video/Benchmark/video%06d.mkv' % i for i in range(count)]
+    api = TheDavidBox(host, port)
+    try:
+        loop = measure('enqueue loop', count, lambda: loopEnqueue(api, paths))
+        bulk = measure('enqueueMany (%d conn)' % connections, count,
+                       lambda: bulkEnqueue(api, paths, connections))
+        print 'Speedup: %.2fx' % (loop / bulk)
+    finally:
+        api.close()
+        if not server == None: server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+My Popcorn Hour Library - Python - Fake TheDavidBox
+Local stand-in for the device TheDavidBox API, used to measure scripts off-device
+
+Supports playback start_vod, insert_vod_queue, stop_vod, get_current_vod_info,
+list_vod_supported_format and system send_key, list_key
+
+Run example:
+- run 'python FakeDavidBox.py [port] [latency] [keys] [payload]'
+  where [port] defaults to 8008, [latency] is the response delay in seconds,
+  [keys] is the number of system keys and [payload] the number of extra play info items
+"""
+
+#Imports
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer #Web server
+from SocketServer import ThreadingMixIn #Web server
+import urlparse #Web server
+import threading #Server thread
+import time #Latency
+import sys #Arguments
+
+#Classes
+class FakeDevice(object):
+    """Fake device state"""
+    FORMATS = ['avi', 'mkv', 'mp4', 'flv', 'ts', 'm2ts']
+
+    def __init__(self, latency = 0.0, keys = 60, payload = 0):
+        """Initialize device state
+
+        Args:
+            latency: Response delay in seconds
+            keys: Number of system keys (list_key reply size)
+            payload: Number of extra play info items (get_current_vod_info reply size)
+        """
+        self.latency = latency
+        self.keys = ['key%d' % i for i in range(keys)]
+        self.payload = payload
+        self.calls = 0
+        self.queue = []
+        self.playing = None
+        self._lock = threading.Lock()
+
+    def handle(self, module, function, args):
+        """Handle API call
+
+        Args:
+            module: API module
+            function: API module function
+            args: API function arguments
+
+        Returns: Xml response
+        """
+        response = ''
+        returnValue = 0
+        with self._lock:
+            self.calls += 1
+            if module == 'playback' and function == 'get_current_vod_info':
+                if self.playing == None:
+                    returnValue = 1
+                else:
+                    response = ('<response><currentStatus>play</currentStatus>'
+                                '<currentTime>0</currentTime><fullPath>%s</fullPath>'
+                                '<title>Title</title><totalTime>100</totalTime>%s</response>' %
+                                (self.playing, ''.join(['<extra%d>value%d</extra%d>' % (i, i, i)
+                                                        for i in range(self.payload)])))
+            elif module == 'playback' and function == 'start_vod':
+                self.playing = args[1]
+                self.queue = []
+            elif module == 'playback' and function == 'insert_vod_queue':
+                self.queue.append(args[1])
+            elif module == 'playback' and function == 'stop_vod':
+                self.playing = None
+                self.queue = []
+            elif module == 'playback' and function == 'list_vod_supported_format':
+                response = ('<response>%s</response>' %
+                            ''.join(['<format>%s</format>' % item for item in FakeDevice.FORMATS]))
+            elif module == 'system' and function == 'list_key':
+                response = '<response>%s</response>' % ''.join(['<key>%s</key>' % key
+                                                                for key in self.keys])
+            elif module == 'system' and function == 'send_key':
+                if len(args) == 0 or not args[0] in self.keys: returnValue = 1
+            else:
+                returnValue = 1
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<theDavidBox><request><arg0>%s</arg0><module>%s</module></request>'
+                '%s<returnValue>%d</returnValue></theDavidBox>' %
+                (function, module, response, returnValue))
+
+    def advance(self):
+        """Play next queued file, as when the playing file ends"""
+        with self._lock:
+            if len(self.queue) > 0: self.playing = self.queue.pop(0)
+            else: self.playing = None
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Fake API request handler"""
+    protocol_version = 'HTTP/1.1' #Keep-alive
+    wbufsize = -1 #Single write per response
+
+    def do_GET(self):
+        """Handle get requests"""
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        args = []
+        i = 1
+        while query.has_key('arg' + str(i)):
+            args.append(query.get('arg' + str(i))[0])
+            i += 1
+        function = query.get('arg0', [''])[0]
+        device = self.server.device
+        if device.latency > 0: time.sleep(device.latency)
+        data = device.handle(url.path[1:], function, args)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        """Ignore log messages"""
+        return
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """Fake API server"""
+    daemon_threads = True
+
+    def __init__(self, port = 8008, latency = 0.0, keys = 60, payload = 0):
+        """Initialize server
+
+        Args:
+            port: Server port, 0 for any free port
+            latency: Response delay in seconds
+            keys: Number of system keys, see FakeDevice
+            payload: Number of extra play info items, see FakeDevice
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeHandler)
+        self.device = FakeDevice(latency, keys, payload)
+
+    def getPort(self):
+        """Get bound server port"""
+        return self.server_address[1]
+
+    def start(self):
+        """Serve in background thread"""
+        thread = threading.Thread(target = self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop(self):
+        """Stop background server"""
+        self.shutdown()
+        self.server_close()
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    port = 8008
+    latency = 0.0
+    keys = 60
+    payload = 0
+    if len(sys.argv) > 1: port = int(sys.argv[1])
+    if len(sys.argv) > 2: latency = float(sys.argv[2])
+    if len(sys.argv) > 3: keys = int(sys.argv[3])
+    if len(sys.argv) > 4: payload = int(sys.argv[4])
+    server = FakeServer(port, latency, keys, payload)
+    print 'Fake TheDavidBox on port %d...' % server.getPort()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
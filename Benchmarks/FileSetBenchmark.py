@@ -0,0 +1,62 @@
+"""
+My Popcorn Hour Library - Python - File set memory benchmark
+Compares memory and shuffle time of a files list (getFiles) against
+ShuffleThis.FileSet (getFileSet) for a large synthetic library
+
+Run example:
+- run 'python FileSetBenchmark.py [files]'
+  Each structure is measured in its own process (peak resident memory)
+"""
+
+#Imports
+import os #Paths
+import sys #Arguments
+import time #Timing
+import resource #Memory
+import subprocess #Measure processes
+from random import shuffle #List shuffle
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ShuffleThis import FileSet
+
+#Functions
+def generatePaths(count):
+    """Generate synthetic library paths, 100 files per season directory"""
+    for i in xrange(count):
+        yield '/share/Video/Library/Genre%02d/Show%05d/Season%02d/video%07d.mkv' % \
+              (i % 20, i / 1000, (i / 100) % 10, i)
+
+def measure(kind, count):
+    """Build, shuffle and read structure, prints memory and timings"""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if kind == 'list':
+        files = list(generatePaths(count))
+    else:
+        files = FileSet(generatePaths(count))
+    built = time.time()
+    if kind == 'list': shuffle(files)
+    else: files.shuffle()
+    shuffled = time.time()
+    for file in files:
+        pass
+    done = time.time()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%-8s %9.1f MB %8.2fs build %8.2fs shuffle %8.2fs read' % \
+          (kind, (after - before) / 1024.0, built - start, shuffled - built, done - shuffled)
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    if len(sys.argv) > 2 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], int(sys.argv[3]))
+        return
+    count = 300000
+    if len(sys.argv) > 1: count = int(sys.argv[1])
+    print '%d files' % count
+    for kind in ('list', 'fileset'):
+        subprocess.call([sys.executable, os.path.abspath(__file__), '--measure', kind, str(count)])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+My Popcorn Hour Library - Python - Media probe benchmark
+Measures MediaProbe on a synthetic library of large (sparse) video
+files with synthetic container headers (see MediaTree.py):
+- full probe without index, one thread and a pool of threads
+- full probe with an up to date probe index
+- time budget selection of shuffled files, without and with index
+
+Run example:
+- run 'python MediaProbeBenchmark.py [files] [workers] [budget minutes]'
+"""
+
+#Imports
+import os #Paths
+import sys #Arguments
+import time #Timing
+import shutil #Temporary files
+import tempfile #Temporary files
+from random import Random, shuffle #Durations, shuffle
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from MediaProbe import MediaProbe
+from MediaTree import createVideo, VIDEO
+
+#Functions
+def createLibrary(root, count):
+    """Create videos of 3 to 60 minutes, 1GB each
+
+    Returns: List of files paths
+    """
+    random = Random(count)
+    files = []
+    for i in range(count):
+        dir = os.path.join(root, 'dir%02d' % (i % 20))
+        if not os.path.isdir(dir): os.makedirs(dir)
+        path = os.path.join(dir, 'video%06d.%s' % (i, VIDEO[i % len(VIDEO)]))
+        createVideo(path, random.randint(180, 3600), size = 1024 * 1024 * 1024)
+        files.append(path)
+    return files
+
+def timeProbe(files, workers, indexPath = None):
+    """Probe all files
+
+    Returns: Tuple of seconds and number of files with known duration
+    """
+    probe = MediaProbe(indexPath, workers)
+    probe.load()
+    start = time.time()
+    known = len([file for file, info in probe.iterProbe(files)
+                 if not info == None and not info['duration'] == None])
+    elapsed = time.time() - start
+    probe.save()
+    return (elapsed, known)
+
+def timeBudget(files, workers, budget, indexPath = None):
+    """Select shuffled files for budget
+
+    Returns: Tuple of seconds, selected files and selected seconds
+    """
+    probe = MediaProbe(indexPath, workers)
+    probe.load()
+    files = list(files)
+    shuffle(files)
+    start = time.time()
+    selected = list(probe.selectBudget(files, budget))
+    elapsed = time.time() - start
+    return (elapsed, len(selected), probe.getSelected()[1])
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    count = 2000
+    workers = 4
+    budget = 120
+    if len(sys.argv) > 1: count = int(sys.argv[1])
+    if len(sys.argv) > 2: workers = int(sys.argv[2])
+    if len(sys.argv) > 3: budget = int(sys.argv[3])
+    work = tempfile.mkdtemp(prefix = 'probe')
+    try:
+        files = createLibrary(os.path.join(work, 'media'), count)
+        indexPath = os.path.join(work, 'probe.idx')
+        print '%d files of 1GB' % count
+        for threads in (1, workers):
+            seconds, known = timeProbe(files, threads)
+            print 'probe     %2d threads %8.3fs %7.1f us/file (%d durations)' % \
+                  (threads, seconds, seconds * 1000000 / count, known)
+        timeProbe(files, workers, indexPath)
+        seconds, known = timeProbe(files, workers, indexPath)
+        print 'indexed   %2d threads %8.3fs %7.1f us/file (%d durations)' % \
+              (workers, seconds, seconds * 1000000 / count, known)
+        for name, path in (('budget', None), ('budget indexed', indexPath)):
+            seconds, selected, total = timeBudget(files, workers, budget * 60, path)
+            print '%-14s %d minutes %8.3fs %d files, %.1f minutes' % \
+                  (name, budget, seconds, selected, total / 60)
+    finally:
+        shutil.rmtree(work, True)
+
+if __name__ == '__main__':
+    main()
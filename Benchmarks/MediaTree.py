@@ -0,0 +1,142 @@
+"""
+My Popcorn Hour Library - Python - Synthetic media tree
+Creates a directory tree of empty video files (and some other files, e.g.
+posters and subtitles) to measure directory scans off-device, and video files
+with synthetic container headers to measure metadata probes
+
+Run example:
+- run 'python MediaTree.py [root] [files] [depth] [breadth]'
+  creates [files] files in a tree of [depth] levels with [breadth] sub directories each
+"""
+
+#Imports
+import os #Files
+import sys #Arguments
+import struct #Headers
+
+VIDEO = ['avi', 'mkv', 'mp4', 'flv']
+OTHER = ['jpg', 'srt', 'nfo']
+
+#Functions
+def createTree(root, files = 1000, depth = 3, breadth = 4, other = 0.2):
+    """Create synthetic media tree
+
+    Args:
+        root: Tree root directory, created if missing
+        files: Number of files
+        depth: Number of sub directory levels
+        breadth: Number of sub directories of each directory
+        other: Fraction of non video files
+
+    Returns: Tuple of directories and video files counts
+    """
+    dirs = [root]
+    level = [root]
+    for i in range(depth):
+        next = []
+        for parent in level:
+            for j in range(breadth):
+                next.append(os.path.join(parent, 'dir%02d' % j))
+        dirs += next
+        level = next
+    for dir in dirs:
+        if not os.path.isdir(dir): os.makedirs(dir)
+    videos = 0
+    every = 0
+    if other > 0: every = max(2, int(round(1 / other)))
+    for i in range(files):
+        if every > 0 and i % every == every - 1:
+            name = 'file%06d.%s' % (i, OTHER[i % len(OTHER)])
+        else:
+            name = 'video%06d.%s' % (i, VIDEO[i % len(VIDEO)])
+            videos += 1
+        open(os.path.join(dirs[i % len(dirs)], name), 'w').close()
+    return (len(dirs), videos)
+
+def _box(kind, data):
+    """Encode mp4 box"""
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+def _element(id, data):
+    """Encode EBML element, 8 bytes size"""
+    return id + '\x01' + struct.pack('>Q', len(data))[1:] + data
+
+def _chunk(kind, data, list = None):
+    """Encode RIFF chunk or list"""
+    if not list == None: return struct.pack('<4sI4s', 'LIST', 4 + len(data), list) + data
+    return struct.pack('<4sI', kind, len(data)) + data
+
+def createHeader(format, duration, width, height):
+    """Create synthetic container header
+
+    Args:
+        format: Container (avi, mkv, mp4 or flv)
+        duration: Seconds
+        width: Video width
+        height: Video height
+
+    Returns: Header data, media data may follow it
+    """
+    if format == 'mp4':
+        mvhd = struct.pack('>I8xII', 0, 1000, int(duration * 1000)) + '\0' * 80
+        tkhd = struct.pack('>I72xII', 0, width << 16, height << 16)
+        return _box('ftyp', 'isom\0\0\0\0isommp41') + \
+               _box('moov', _box('mvhd', mvhd) + _box('trak', _box('tkhd', tkhd)))
+    if format == 'mkv':
+        info = _element('\x2a\xd7\xb1', struct.pack('>I', 1000000)) + \
+               _element('\x44\x89', struct.pack('>d', duration * 1000))
+        video = _element('\xb0', struct.pack('>H', width)) + _element('\xba', struct.pack('>H', height))
+        tracks = _element('\xae', _element('\xd7', '\x01') + _element('\xe0', video))
+        segment = _element('\x15\x49\xa9\x66', info) + _element('\x16\x54\xae\x6b', tracks)
+        return _element('\x1a\x45\xdf\xa3', _element('\x42\x82', 'matroska')) + \
+               _element('\x18\x53\x80\x67', segment)
+    if format == 'avi':
+        frames = int(duration * 25)
+        avih = struct.pack('<I12xI12xII16x', 40000, frames, width, height)
+        hdrl = _chunk(None, _chunk('avih', avih), 'hdrl')
+        return struct.pack('<4sI4s', 'RIFF', 4 + len(hdrl), 'AVI ') + hdrl
+    if format == 'flv':
+        meta = '\x02' + struct.pack('>H', 10) + 'onMetaData' + '\x08' + struct.pack('>I', 3)
+        for key, value in (('duration', duration), ('width', width), ('height', height)):
+            meta += struct.pack('>H', len(key)) + key + '\0' + struct.pack('>d', value)
+        meta += '\0\0\x09'
+        tag = struct.pack('>B', 18) + struct.pack('>I', len(meta))[1:] + '\0' * 7 + meta
+        return 'FLV\x01\x05' + struct.pack('>I', 9) + struct.pack('>I', 0) + tag
+    raise ValueError('unknown format ' + format)
+
+def createVideo(path, duration, width = 1280, height = 720, size = 0):
+    """Create video file with synthetic header, format by extension
+
+    Args:
+        path: File path
+        duration: Seconds
+        width: Video width
+        height: Video height
+        size: File size, media data after header is a sparse hole
+    """
+    f = open(path, 'wb')
+    try:
+        f.write(createHeader(os.path.splitext(path)[1][1:].lower(), duration, width, height))
+        if size > f.tell(): f.truncate(size)
+    finally:
+        f.close()
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    if len(sys.argv) < 2:
+        print 'Usage: MediaTree.py root [files] [depth] [breadth]'
+        return
+    files = 1000
+    depth = 3
+    breadth = 4
+    if len(sys.argv) > 2: files = int(sys.argv[2])
+    if len(sys.argv) > 3: depth = int(sys.argv[3])
+    if len(sys.argv) > 4: breadth = int(sys.argv[4])
+    dirs, videos = createTree(sys.argv[1], files, depth, breadth)
+    print 'Created %d directories, %d files (%d videos)' % (dirs, files, videos)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+My Popcorn Hour Library - Python - Now playing load test
+Compares device calls when clients poll the device directly against clients
+of LittleServer '/nowplaying' (polling, long polling and events), which shares
+one device watcher between all clients. The server has the shipped number of
+workers, '/jobs' response time shows whether waiting clients leave it reachable
+
+Run example:
+- run 'python NowPlayingLoadTest.py [seconds] [clients...]'
+  e.g. 'python NowPlayingLoadTest.py 5 1 10 50'
+"""
+
+#Imports
+import os #Paths
+import sys #Arguments
+import socket #Clients
+import time #Timing
+import json #Responses
+import httplib #Clients
+import tempfile #Configuration
+import threading #Clients
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'LittleServer'))
+from FakeDavidBox import FakeServer
+from ShuffleThis import TheDavidBox
+from LittleServer import ConfigFile, JobRunner, StaticCache, NowPlaying, createServer, webServerCreator
+
+CONFIG = '''<config>
+  <port>0</port>
+  <server mode="threaded" workers="%d" />
+  <nowplaying path="%s" host="127.0.0.1" port="%d" fast="1" slow="1" />
+</config>'''
+WORKERS = 4 #Shipped config.xml workers
+INTERVAL = 1.0 #Client polling interval
+CHANGE = 2.0 #Seconds between played files
+
+#Functions
+def directClient(port, devicePort, until, counts):
+    """Client polling the device itself"""
+    api = TheDavidBox('127.0.0.1', str(devicePort))
+    while time.time() < until:
+        api.getPlayInfo()
+        counts.append(1)
+        time.sleep(INTERVAL)
+    api.close()
+
+def pollClient(port, devicePort, until, counts):
+    """Client polling '/nowplaying'"""
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    while time.time() < until:
+        conn.request('GET', '/nowplaying')
+        conn.getresponse().read()
+        counts.append(1)
+        conn.close()
+        time.sleep(INTERVAL)
+
+def longPollClient(port, devicePort, until, counts):
+    """Client long polling '/nowplaying' for changes"""
+    version = None
+    while time.time() < until:
+        conn = httplib.HTTPConnection('127.0.0.1', port)
+        path = '/nowplaying'
+        if not version == None: path += '?timeout=1&version=%d' % version
+        conn.request('GET', path)
+        version = json.loads(conn.getresponse().read())['version']
+        counts.append(1)
+        conn.close()
+
+def eventsClient(port, devicePort, until, counts):
+    """Client reading '/nowplaying/events'"""
+    conn = httplib.HTTPConnection('127.0.0.1', port, timeout = 1)
+    conn.request('GET', '/nowplaying/events')
+    response = conn.getresponse()
+    while time.time() < until:
+        try:
+            line = response.fp.readline()
+        except socket.timeout:
+            continue
+        if len(line) == 0: break
+        if line.startswith('data:'): counts.append(1)
+    conn.close()
+
+def timeRequest(port, path):
+    """Get request milliseconds or None if the server did not answer within 5 seconds"""
+    start = time.time()
+    try:
+        conn = httplib.HTTPConnection('127.0.0.1', port, timeout = 5)
+        conn.request('GET', path)
+        conn.getresponse().read()
+        conn.close()
+    except (IOError, socket.error):
+        return
+    return (time.time() - start) * 1000
+
+def measure(name, client, clients, seconds):
+    """Run clients against a fake device and LittleServer, print device calls"""
+    device = FakeServer(0)
+    device.start()
+    configPath = tempfile.mktemp('.xml')
+    with open(configPath, 'w') as configFile:
+        configFile.write(CONFIG % (WORKERS, ROOT, device.getPort()))
+    configFile = ConfigFile(configPath)
+    configFile.load()
+    os.remove(configPath)
+    config = configFile.get()
+    nowPlaying = NowPlaying(config.getNowPlaying())
+    handler = webServerCreator(configFile, JobRunner(), StaticCache(), nowPlaying)
+    server = createServer(config, handler)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    counts = []
+    until = time.time() + seconds
+    threads = [threading.Thread(target = client,
+                                args = (server.server_address[1], device.getPort(), until, counts))
+               for i in range(clients)]
+    for item in threads:
+        item.start()
+    #Device plays a new file every few seconds
+    index = 0
+    jobs = None
+    while time.time() < until:
+        device.device.playing = '/share/Video/file%d.avi' % index
+        index += 1
+        if index == 2: jobs = timeRequest(server.server_address[1], '/jobs')
+        time.sleep(CHANGE)
+    for item in threads:
+        item.join()
+    server.shutdown()
+    nowPlaying.stop()
+    server.drain()
+    server.server_close()
+    device.stop()
+    if jobs == None: jobs = 'no answer'
+    else: jobs = '%.1f ms' % jobs
+    print '%-9s %4d clients %6d requests %5d device calls (%.1f/s), /jobs %s' % \
+          (name, clients, len(counts), device.device.calls, device.device.calls / float(seconds), jobs)
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    seconds = 5
+    clients = [1, 10, 50]
+    if len(sys.argv) > 1: seconds = float(sys.argv[1])
+    if len(sys.argv) > 2: clients = [int(arg) for arg in sys.argv[2:]]
+    for count in clients:
+        measure('direct', directClient, count, seconds)
+        measure('poll', pollClient, count, seconds)
+        measure('long poll', longPollClient, count, seconds)
+        measure('events', eventsClient, count, seconds)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+My Popcorn Hour Library - Python - Warm start benchmark
+Compares running ShuffleThis.main in a new interpreter (spawn) against a
+LittleServer warm worker (fork of a preloaded process)
+
+Run example:
+- run 'python WarmStartBenchmark.py [runs]'
+  Each run shuffles a missing directory, so the time is mostly startup
+"""
+
+#Imports
+import os #Paths
+import sys #Arguments
+import time #Timing
+import subprocess #Spawn runs
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'LittleServer'))
+from LittleServer import WarmWorker, entryArgs
+
+ENTRY = 'ShuffleThis.main'
+ARGS = ['/nonexistent/benchmark']
+
+#Functions
+def spawnRun():
+    """Run entry point in a new interpreter, same as a LittleServer run path command"""
+    process = subprocess.Popen(entryArgs(ENTRY, ROOT, ARGS), stdout = subprocess.PIPE,
+                               stderr = subprocess.STDOUT, close_fds = True)
+    process.communicate()
+    return process.returncode
+
+def warmRun(warm):
+    """Run entry point in warm worker"""
+    return warm.execute(ENTRY, ROOT, ARGS, lambda line: None)
+
+def measure(name, runs, action):
+    """Time runs, returns milliseconds per run"""
+    start = time.time()
+    for i in range(runs):
+        action()
+    elapsed = (time.time() - start) * 1000.0 / runs
+    print '%-8s %8.1f ms/run' % (name, elapsed)
+    return elapsed
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    runs = 20
+    if len(sys.argv) > 1: runs = int(sys.argv[1])
+    warm = WarmWorker([(ENTRY, ROOT)])
+    if not warm.start():
+        print 'Warm worker is not supported on this platform'
+        return
+    try:
+        warmRun(warm) #Worker ready
+        spawn = measure('spawn', runs, spawnRun)
+        forked = measure('warm', runs, lambda: warmRun(warm))
+        print 'Saved %.1f ms/run (%.1fx)' % (spawn - forked, spawn / forked)
+    finally:
+        warm.stop()
+
+if __name__ == '__main__':
+    main()
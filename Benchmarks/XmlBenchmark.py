@@ -0,0 +1,105 @@
+"""
+My Popcorn Hour Library - Python - Xml decoding benchmark
+Compares the original minidom reply extraction against ShuffleThis.ApiReply
+
+Run example:
+- run 'python XmlBenchmark.py [iterations]'
+"""
+
+#Imports
+import os #Paths
+import sys #Arguments
+import time #Timing
+from xml.dom.minidom import parseString #Original decoder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ShuffleThis import ApiReply
+
+#Sample replies
+RETURN_VALUE = ('<?xml version="1.0" encoding="UTF-8"?><theDavidBox><request>'
+                '<arg0>insert_vod_queue</arg0><arg1>Title</arg1>'
+                '<arg2>file:///share/Video/Music/video.mkv</arg2><arg3>show</arg3>'
+                '<arg4>start_zero</arg4><module>playback</module></request>'
+                '<returnValue>0</returnValue></theDavidBox>')
+PLAY_INFO = ('<?xml version="1.0" encoding="UTF-8"?><theDavidBox><request>'
+             '<arg0>get_current_vod_info</arg0><module>playback</module></request>'
+             '<response><currentStatus>play</currentStatus><currentTime>125</currentTime>'
+             '<downloadSpeed>0</downloadSpeed><fullPath>file:///share/Video/Music/video.mkv</fullPath>'
+             '<lastPacketTime>0</lastPacketTime><mediatype>OTHERS</mediatype><seekEnable>true</seekEnable>'
+             '<title>Title</title><totalTime>245</totalTime></response>'
+             '<returnValue>0</returnValue></theDavidBox>')
+KEYS = ('<?xml version="1.0" encoding="UTF-8"?><theDavidBox><request>'
+        '<arg0>list_key</arg0><module>system</module></request><response>' +
+        ''.join(['<key>key%d</key>' % i for i in range(60)]) +
+        '</response><returnValue>0</returnValue></theDavidBox>')
+
+#Original (minidom) decoders
+def minidomReturnValue(data):
+    """Original TheDavidBox.__extractReturnValue"""
+    root = parseString(data)
+    retValue = root.getElementsByTagName('returnValue')
+    if retValue == None or len(retValue) == 0: return
+    return int(retValue[0].firstChild.data)
+
+def minidomResponse(data):
+    """Original TheDavidBox.__extractResponse"""
+    root = parseString(data)
+    retValue = root.getElementsByTagName('returnValue')
+    if retValue == None or len(retValue) == 0: return
+    if int(retValue[0].firstChild.data) <> 0: return
+    response = root.getElementsByTagName('response')
+    if response == None or len(response) == 0: return
+    return response[0].childNodes
+
+def minidomDictionary(data):
+    """Original TheDavidBox.__extractDictionary"""
+    result = {}
+    for node in minidomResponse(data):
+        result[node.nodeName] = node.firstChild.data
+    return result
+
+def minidomList(data):
+    """Original TheDavidBox.__extractList"""
+    return [node.firstChild.data for node in minidomResponse(data)]
+
+#Single pass decoders
+def replyReturnValue(data):
+    """ApiReply return value"""
+    return ApiReply(data).getReturnValue()
+
+def replyDictionary(data):
+    """ApiReply dictionary"""
+    return dict(ApiReply(data).getItems())
+
+def replyList(data):
+    """ApiReply list"""
+    return [item[1] for item in ApiReply(data).getItems()]
+
+#Functions
+def measure(decoder, data, iterations):
+    """Time decoder, returns microseconds per call"""
+    start = time.time()
+    for i in xrange(iterations):
+        decoder(data)
+    return (time.time() - start) * 1000000.0 / iterations
+
+#Main
+def main():
+    """
+    Main entry point
+    """
+    iterations = 5000
+    if len(sys.argv) > 1: iterations = int(sys.argv[1])
+    cases = [('returnValue', RETURN_VALUE, minidomReturnValue, replyReturnValue),
+             ('dictionary', PLAY_INFO, minidomDictionary, replyDictionary),
+             ('list', KEYS, minidomList, replyList)]
+    print '%-12s %12s %12s %8s' % ('reply', 'minidom us', 'expat us', 'speedup')
+    for name, data, original, decoder in cases:
+        if not original(data) == decoder(data):
+            print '%s: decoders disagree' % name
+            continue
+        before = measure(original, data, iterations)
+        after = measure(decoder, data, iterations)
+        print '%-12s %12.1f %12.1f %7.2fx' % (name, before, after, before / after)
+
+if __name__ == '__main__':
+    main()
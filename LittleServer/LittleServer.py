@@ -2,9 +2,16 @@
 My Popcorn Hour Library - Python - The Little Server That Could alpha
 Display html pages and able to run remote commands via web server.
 'shutdown' is a reserved command which is used to close the server
+Commands run in background (without a shell), '/jobs' shows their status
+Commands can be posted as well, with arguments in a form or text body (long argument lists)
+Images, styles and media files next to the html files are served as well,
+and a media directory (e.g. videos) can be served under '/media' with range requests
+'/nowplaying' shows the device playing file, shared by all clients (see config.xml)
+'/metrics' shows request, job and device API timings when enabled in config.xml
 Note: this must run form the popcorn hour device itself
 
-Configuration: see 'config.xml' for setup of server port and commands
+Configuration: see 'config.xml' for setup of server port, mode and commands
+'config.xml' changes are applied while running (server, jobs and now playing settings on restart)
 
 HTML example:
 - Create file called "index.html' (this is also used as default file)
@@ -23,6 +30,8 @@ HTML example:
   </html>
 - This shows an html with a single link which runs the command 'shuffle' with an argument
 - In 'config.xml' the command should be configured something like:
+  <command id="shuffle" entry="ShuffleThis.main" path="/share/Scripts" args="true" />
+  or with a run path, e.g. for scripts which are not python:
   <command id="shuffle" run="python /share/Scripts/ShuffleThis.py" args="true" />
 
 Run:
@@ -54,26 +63,81 @@ Date:   11/08/2013 (11-AUG-2013)
 """
 
 #Imports
-from xml.dom.minidom import parseString #xml
+#Modules used only by some requests or settings (configuration xml, compression,
+#media types and files, commands, json, metrics, now playing) are imported where used,
+#to start quicker. Modules already loaded by BaseHTTPServer and SocketServer (select,
+#tempfile, traceback, errno) or built in (signal) cost nothing and are imported here
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer #Web server
+from SocketServer import ForkingMixIn #Web server forking mode
+import threading #Web server threaded mode
+import Queue #Web server threaded mode
+import signal #Web server forking mode shutdown
+import os #Web server forking mode shutdown
 from os import curdir, sep #html files
 import urlparse #Web server
-import commands #command processing
+import time #command processing
+import socket #warm worker
+import tempfile #warm worker
+import traceback #warm worker
+from collections import deque #command output
 import sys #shutdown
+import asyncore #Web server async mode
+import asynchat #Web server async mode
+import select #Web server async mode
+import errno #Web server async mode
+
+#Media types missing from system types
+MEDIA_TYPES = [('video/x-matroska', '.mkv'), ('video/x-flv', '.flv'),
+               ('video/mp2t', '.ts'), ('video/mp2t', '.m2ts')]
+_mimetypes = None #Loaded on first guessType
 
 #Classes
 class Command:
     """
     Command data
     """
-    def __init__(self, id, run, allowArgs):
+    def __init__(self, id, run, allowArgs, limit = 1, entry = None, path = None):
         """Initialize command"""
         self._id = id
         self._run = run
+        self._entry = entry
+        self._path = path
         try:
             self._allowArgs = allowArgs.lower() == 'true'
         except:
             self._allowArgs = False
+        self._limit = limit
+        self._head = []
+        self._tail = []
+
+    def compile(self, prefix, suffix):
+        """Prepare process arguments template, run path commands are wrapped by prefix and suffix
+
+        Args:
+            prefix: Commands prefix
+            suffix: Commands suffix
+
+        Raises: ValueError if arguments could not be split (e.g. unbalanced quotes)
+        """
+        if self._entry == None:
+            self._head = splitArgs(prefix) + splitArgs(self._run)
+            self._tail = splitArgs(suffix)
+        #Jobs already run in background, request arguments are never stripped
+        while len(self._tail) > 0 and self._tail[-1] == '&':
+            self._tail.pop()
+        while len(self._tail) == 0 and len(self._head) > 0 and self._head[-1] == '&':
+            self._head.pop()
+
+    def getArgv(self, args = []):
+        """Get process arguments
+
+        Args:
+            args: Request arguments, used only if command allows arguments
+
+        Returns: Arguments list, without a shell
+        """
+        if not self._allowArgs: args = []
+        return self._head + args + self._tail
 
     def getId(self):
         """Get command id"""
@@ -87,6 +151,18 @@ class Command:
         """Get whether command allowArgs"""
         return self._allowArgs
 
+    def getLimit(self):
+        """Get maximum number of concurrent runs"""
+        return self._limit
+
+    def getEntry(self):
+        """Get python entry point (module.function) or None for run path commands"""
+        return self._entry
+
+    def getPath(self):
+        """Get python path of entry point module or None"""
+        return self._path
+
 class Config:
     """
     Configuration class
@@ -95,58 +171,142 @@ class Config:
     def __init__(self):
         """Initialize with default"""
         self._port = 7070
+        self._mode = 'single'
+        self._workers = 4
         self._dir = ''
+        self._mediaPath = '/media'
+        self._mediaDir = None
+        self._nowPlaying = None
+        self._metrics = False
         self._commands = {}
-        self._commandPrefix = 'nohump '
-        self._commandSuffix = ' &'
+        self._commandPrefix = ''
+        self._commandSuffix = ''
+        self._jobWorkers = 2
+        self._jobHistory = 20
+        self._jobTail = 20
+        self._error = None
 
     def load(self, path='config.xml'):
+        """Load configuration xml, a failed load leaves a partial configuration
+        so reloads load into a new Config (see ConfigFile)
+
+        Returns: True if loaded otherwise False, see getError
+        """
         try:
             #read file
             f = open(path, 'r')
             data = f.read()
             f.close()
             #Parse data
+            from xml.dom.minidom import parseString #xml
             root = parseString(data)
             #Extract port
             nodes = root.getElementsByTagName('port')
             if not nodes == None and len(nodes) > 0:
                 self._port = int(nodes[0].firstChild.data)
+            #Extract server mode
+            nodes = root.getElementsByTagName('server')
+            if not nodes == None and len(nodes) > 0:
+                item = nodes[0].attributes.get('mode')
+                if not item == None: self._mode = str(item.firstChild.data).lower()
+                item = nodes[0].attributes.get('workers')
+                if not item == None: self._workers = max(1, int(item.firstChild.data))
+                if not self._mode in ('single', 'threaded', 'forking', 'async'):
+                    raise ValueError('Unknown server mode ' + self._mode)
             #Extract directory
             nodes = root.getElementsByTagName('dir')
             if not nodes == None and len(nodes) > 0:
                 data = nodes[0].firstChild
                 if not data == None:
                     self._dir = str(data.data)
+            #Media files
+            nodes = root.getElementsByTagName('media')
+            if not nodes == None and len(nodes) > 0:
+                item = nodes[0].attributes.get('path')
+                if not item == None: self._mediaPath = '/' + str(item.firstChild.data).strip('/')
+                item = nodes[0].attributes.get('dir')
+                if not item == None: self._mediaDir = str(item.firstChild.data)
+            #Now playing
+            nodes = root.getElementsByTagName('nowplaying')
+            if not nodes == None and len(nodes) > 0:
+                settings = {'path': None, 'host': '127.0.0.1', 'port': '8008',
+                            'fast': '1', 'slow': '5'}
+                for name in settings.keys():
+                    item = nodes[0].attributes.get(name)
+                    if not item == None: settings[name] = str(item.firstChild.data)
+                self._nowPlaying = settings
+            #Metrics
+            nodes = root.getElementsByTagName('metrics')
+            if not nodes == None and len(nodes) > 0:
+                item = nodes[0].attributes.get('enabled')
+                if not item == None: self._metrics = item.value.lower() == 'true'
+            #Jobs
+            nodes = root.getElementsByTagName('jobs')
+            if not nodes == None and len(nodes) > 0:
+                item = nodes[0].attributes.get('workers')
+                if not item == None: self._jobWorkers = max(1, int(item.firstChild.data))
+                item = nodes[0].attributes.get('history')
+                if not item == None: self._jobHistory = max(0, int(item.firstChild.data))
+                item = nodes[0].attributes.get('tail')
+                if not item == None: self._jobTail = max(0, int(item.firstChild.data))
             #Commands
             nodes = root.getElementsByTagName('commands')
             if not nodes == None and len(nodes) > 0:
                 node = nodes[0]
-                self._commandPrefix = node.attributes.get('prefix').firstChild.data
-                self._commandSuffix = node.attributes.get('suffix').firstChild.data
+                item = node.attributes.get('prefix')
+                if not item == None: self._commandPrefix = item.value
+                item = node.attributes.get('suffix')
+                if not item == None: self._commandSuffix = item.value
                 node = node.firstChild
                 while not node == None:
                     if node.nodeName == 'command':
                         id = node.attributes.get('id') #.firstChild.data
                         run = node.attributes.get('run')
-                        if not id == None and not run == None:
+                        entry = node.attributes.get('entry')
+                        if not id == None and (not run == None or not entry == None):
                             id = id.firstChild.data
-                            run = run.firstChild.data
+                            if not run == None: run = run.firstChild.data
+                            if not entry == None: entry = str(entry.firstChild.data)
+                            path = node.attributes.get('path')
+                            if not path == None: path = str(path.firstChild.data)
                             args = node.attributes.get('args')
                             if args == None:
                                 args = 'False'
                             else:
                                 args = args.firstChild.data
-                            self._commands[id] = Command(id, run, args)
+                            limit = node.attributes.get('limit')
+                            if limit == None:
+                                limit = 1
+                            else:
+                                limit = max(1, int(limit.firstChild.data))
+                            command = Command(id, run, args, limit, entry, path)
+                            try:
+                                command.compile(self._commandPrefix, self._commandSuffix)
+                            except ValueError, e:
+                                raise ValueError('Command ' + id + ': ' + str(e))
+                            self._commands[id] = command
                     node = node.nextSibling
             return True
-        except:
+        except Exception, e:
+            self._error = str(e)
             return False
 
+    def getError(self):
+        """Get reason of failed load or None"""
+        return self._error
+
     def getPort(self):
         """Get server port"""
         return self._port
 
+    def getMode(self):
+        """Get server mode: single, threaded, forking or async"""
+        return self._mode
+
+    def getWorkers(self):
+        """Get number of concurrent requests of threaded and forking modes"""
+        return self._workers
+
     def getDir(self):
         """Get server directory"""
         return self._dir
@@ -159,6 +319,39 @@ class Config:
         """Get command suffix"""
         return self._commandSuffix
 
+    def getMediaPath(self):
+        """Get url path of media files"""
+        return self._mediaPath
+
+    def getMediaDir(self):
+        """Get media files directory or None if not served"""
+        return self._mediaDir
+
+    def getNowPlaying(self):
+        """Get now playing settings dictionary (path, host, port, fast, slow) or None if disabled"""
+        return self._nowPlaying
+
+    def getMetrics(self):
+        """Get whether metrics are recorded ('/metrics')"""
+        return self._metrics
+
+    def getJobWorkers(self):
+        """Get maximum number of concurrent command jobs"""
+        return self._jobWorkers
+
+    def getJobHistory(self):
+        """Get number of finished jobs kept for status"""
+        return self._jobHistory
+
+    def getJobTail(self):
+        """Get number of output lines kept per job"""
+        return self._jobTail
+
+    def getEntries(self):
+        """Get (entry, path) of python entry point commands"""
+        return [(command.getEntry(), command.getPath()) for command in
+                self._commands.values() if not command.getEntry() == None]
+
     def isCommand(self, command):
         """Get if command supported"""
         return self._commands.has_key(command)
@@ -172,85 +365,1896 @@ class Config:
             data = None
         return data
 
+class ConfigFile:
+    """
+    Reloadable configuration file
+    Requests use the current Config snapshot, a changed file is loaded into a new
+    snapshot which replaces the current one only if it is valid
+    """
+    #Settings used when the server starts, changes require restart
+    RESTART = ('getPort', 'getMode', 'getWorkers', 'getJobWorkers', 'getJobHistory',
+               'getJobTail', 'getNowPlaying', 'getMetrics')
+
+    def __init__(self, path = 'config.xml', interval = 1.0):
+        """Initialize configuration file
+
+        Args:
+            path: Configuration xml path
+            interval: Seconds between file changes checks
+        """
+        self._path = path
+        self._interval = interval
+        self._config = Config()
+        self._loaded = False
+        self._mtime = None
+        self._checked = 0
+        self._error = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load configuration file
+
+        Returns: True if loaded, otherwise the current configuration is kept (see getError)
+        """
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError, e:
+            self._error = str(e)
+            return False
+        self._mtime = mtime
+        config = Config()
+        if not config.load(self._path):
+            self._error = config.getError()
+            return False
+        for name in ConfigFile.RESTART:
+            if self._loaded and not getattr(config, name)() == getattr(self._config, name)():
+                print 'Configuration %s changed, restart required' % name[3:]
+        self._config = config
+        self._loaded = True
+        self._error = None
+        return True
+
+    def get(self):
+        """Get current configuration, reloaded if file changed"""
+        now = time.time()
+        if now - self._checked >= self._interval and self._lock.acquire(False):
+            #Other requests keep the current configuration while one checks
+            try:
+                self._checked = now
+                try:
+                    changed = not os.stat(self._path).st_mtime == self._mtime
+                except OSError:
+                    changed = False
+                if changed:
+                    if self.load(): print 'Configuration reloaded'
+                    else: print 'Configuration reload failed, keeping previous: ' + self._error
+            finally:
+                self._lock.release()
+        return self._config
+
+    def getError(self):
+        """Get reason of last failed load or None"""
+        return self._error
+
+class Metrics:
+    """
+    Latency histograms and error counts, keyed by name and labels
+    Written in prometheus text format ('/metrics'), also used as the
+    ShuffleThis metrics recorder (see ShuffleThis.setMetrics)
+    """
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        """Initialize empty metrics"""
+        from bisect import bisect_left #metrics
+        self._series = {}
+        self._lock = threading.Lock()
+        self._bisect = bisect_left
+
+    def record(self, name, labels, seconds, error = False):
+        """Record a measurement
+
+        Args:
+            name: Metric name
+            labels: Tuple of (name, value) label pairs
+            seconds: Measured duration
+            error: Whether measured operation failed
+        """
+        with self._lock:
+            series = self._series.get((name, labels))
+            if series == None:
+                series = [0, 0.0, 0, [0] * (len(Metrics.BUCKETS) + 1)]
+                self._series[(name, labels)] = series
+            series[0] += 1
+            series[1] += seconds
+            if error: series[2] += 1
+            series[3][self._bisect(Metrics.BUCKETS, seconds)] += 1
+
+    def getSnapshot(self):
+        """Get metrics as a json serializable list, see merge"""
+        with self._lock:
+            return [[name, labels, series[0], series[1], series[2], list(series[3])]
+                    for (name, labels), series in self._series.items()]
+
+    def merge(self, snapshot):
+        """Add metrics snapshot, e.g. of a worker process
+
+        Args:
+            snapshot: List returned by getSnapshot (possibly through json)
+        """
+        with self._lock:
+            for name, labels, count, total, errors, buckets in snapshot:
+                name = str(name)
+                labels = tuple([(str(key), unicode(value).encode('utf-8')) for key, value in labels])
+                series = self._series.get((name, labels))
+                if series == None:
+                    series = [0, 0.0, 0, [0] * (len(Metrics.BUCKETS) + 1)]
+                    self._series[(name, labels)] = series
+                series[0] += count
+                series[1] += total
+                series[2] += errors
+                for i in range(min(len(buckets), len(series[3]))):
+                    series[3][i] += buckets[i]
+
+    def __labels(self, labels, extra = None):
+        """Format labels"""
+        items = list(labels)
+        if not extra == None: items.append(extra)
+        if len(items) == 0: return ''
+        values = []
+        for key, value in items:
+            if isinstance(value, unicode): value = value.encode('utf-8')
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            values.append('%s="%s"' % (key, value))
+        return '{' + ','.join(values) + '}'
+
+    def getText(self):
+        """Get metrics in prometheus text exposition format"""
+        snapshot = sorted(self.getSnapshot())
+        names = []
+        for item in snapshot:
+            if not item[0] in names: names.append(item[0])
+        lines = []
+        for name in names:
+            series = [item[1:] for item in snapshot if item[0] == name]
+            lines.append('# TYPE %s histogram' % name)
+            for labels, count, total, errors, buckets in series:
+                cumulative = 0
+                for i in range(len(Metrics.BUCKETS)):
+                    cumulative += buckets[i]
+                    lines.append('%s_bucket%s %d' % (name, self.__labels(labels, ('le', repr(Metrics.BUCKETS[i]))),
+                                                     cumulative))
+                lines.append('%s_bucket%s %d' % (name, self.__labels(labels, ('le', '+Inf')), count))
+                lines.append('%s_sum%s %.6f' % (name, self.__labels(labels), total))
+                lines.append('%s_count%s %d' % (name, self.__labels(labels), count))
+            lines.append('# TYPE %s_errors_total counter' % name)
+            for labels, count, total, errors, buckets in series:
+                lines.append('%s_errors_total%s %d' % (name, self.__labels(labels), errors))
+        return ''.join([line + '\n' for line in lines])
+
+def splitArgs(text):
+    """Split text into arguments as the shell would, without running a shell"""
+    if text == None: return []
+    if isinstance(text, unicode): text = text.encode('utf-8')
+    import shlex #command arguments
+    return shlex.split(text)
+
+def loadEntry(entry, path = None):
+    """Import python entry point
+
+    Args:
+        entry: Entry point, module.function
+        path: Optional module directory
+
+    Returns: Entry point function
+    """
+    if not path == None and len(path) > 0 and not path in sys.path:
+        sys.path.insert(0, path)
+    module, function = entry.rsplit('.', 1)
+    return getattr(__import__(module, {}, {}, [function]), function)
+
+def entryArgs(entry, path, argv):
+    """Get process arguments running python entry point in a new interpreter
+
+    Args:
+        entry: Entry point, module.function
+        path: Optional module directory
+        argv: Entry point arguments list
+
+    Returns: Process arguments
+    """
+    if path == None: path = ''
+    return [sys.executable, '-c', WarmWorker.BOOTSTRAP, entry, path] + argv
+
+class WarmWorker:
+    """
+    Warm python worker process
+    Imports python entry point commands once, then runs each entry point in a
+    forked child process, which skips interpreter startup and imports.
+    Entry point functions are called with the arguments list.
+    Output and exit code are sent back over a unix socket per run
+    """
+    EXIT = '\0exit '
+    METRICS = '\0metrics '
+    #Same as a warm run (see loadEntry) in a new interpreter
+    BOOTSTRAP = ('import sys; sys.argv[2] and sys.path.insert(0, sys.argv[2]); '
+                 'module, function = sys.argv[1].rsplit(".", 1); '
+                 'sys.exit(getattr(__import__(module, {}, {}, [function]), function)(sys.argv[3:]))')
+
+    def __init__(self, entries, metrics = None):
+        """Initialize worker
+
+        Args:
+            entries: List of (entry, path) to preload
+            metrics: Optional Metrics, runs of modules with setMetrics (e.g. ShuffleThis) add theirs
+        """
+        self._entries = entries
+        self._metrics = metrics
+        self._pid = None
+        self._dir = None
+        self._address = None
+
+    def start(self):
+        """Fork worker process, must be called before any thread is started
+
+        Returns: True if started otherwise False
+        """
+        if not hasattr(os, 'fork') or not hasattr(socket, 'AF_UNIX'): return False
+        self._dir = tempfile.mkdtemp(prefix = 'littleserver')
+        self._address = os.path.join(self._dir, 'warm.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self._address)
+        listener.listen(8)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.__serve(listener)
+            finally:
+                os._exit(0)
+        self._pid = pid
+        listener.close()
+        return True
+
+    def stop(self):
+        """Stop worker process"""
+        if self._pid == None: return
+        try:
+            os.kill(self._pid, signal.SIGTERM)
+            os.waitpid(self._pid, 0)
+        except OSError:
+            pass
+        self._pid = None
+        try:
+            os.remove(self._address)
+            os.rmdir(self._dir)
+        except OSError:
+            pass
+
+    def __serve(self, listener):
+        """Worker process loop, runs until server process ends"""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN) #Reap runs automatically
+        parent = os.getppid()
+        functions = {}
+        for entry, path in self._entries:
+            try:
+                functions[entry] = loadEntry(entry, path)
+            except Exception, e:
+                print 'Failed to preload %s: %s' % (entry, e)
+        listener.settimeout(1.0)
+        while os.getppid() == parent:
+            try:
+                conn, address = listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                continue
+            if os.fork() == 0:
+                listener.close()
+                self.__run(conn, functions)
+            conn.close()
+
+    def __run(self, conn, functions):
+        """Run entry point in forked child, never returns"""
+        import json #warm worker
+        code = 1
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            conn.settimeout(None)
+            request = json.loads(conn.makefile('r').readline())
+            entry = str(request['entry'])
+            path = request['path']
+            if not path == None: path = str(path)
+            argv = [arg.encode('utf-8') for arg in request['argv']]
+            #Output to socket
+            status = os.dup(conn.fileno())
+            os.dup2(conn.fileno(), 1)
+            os.dup2(conn.fileno(), 2)
+            sys.stdout = os.fdopen(1, 'w', 0)
+            sys.stderr = os.fdopen(2, 'w', 0)
+            sys.argv = [entry] + argv
+            recorder = None
+            try:
+                function = functions.get(entry)
+                if function == None: function = loadEntry(entry, path)
+                module = sys.modules.get(function.__module__)
+                if not self._metrics == None and hasattr(module, 'setMetrics'):
+                    recorder = Metrics()
+                    module.setMetrics(recorder)
+                function(argv)
+                code = 0
+            except SystemExit, e:
+                if e.code == None: code = 0
+                elif isinstance(e.code, int): code = e.code
+                else:
+                    print e.code
+                    code = 1
+            except:
+                traceback.print_exc()
+            if not recorder == None:
+                os.write(status, WarmWorker.METRICS + json.dumps(recorder.getSnapshot()) + '\n')
+            os.write(status, WarmWorker.EXIT + str(code) + '\n')
+        finally:
+            os._exit(code)
+
+    def execute(self, entry, path, argv, output):
+        """Run entry point in worker
+
+        Args:
+            entry: Entry point, module.function
+            path: Optional module directory
+            argv: Arguments list
+            output: Function called with each output line
+
+        Returns: Exit code or None if run ended unexpectedly
+        Raises: socket.error if worker is not available
+        """
+        import json #warm worker
+        if self._pid == None: raise socket.error('Warm worker not started')
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self._address)
+            conn.sendall(json.dumps({'entry': entry, 'path': path, 'argv': argv}) + '\n')
+            f = conn.makefile('r')
+            for line in iter(f.readline, ''):
+                i = line.find(WarmWorker.METRICS)
+                if i >= 0:
+                    if i > 0: output(line[:i])
+                    if not self._metrics == None:
+                        self._metrics.merge(json.loads(line[i + len(WarmWorker.METRICS):]))
+                    continue
+                i = line.find(WarmWorker.EXIT)
+                if i < 0:
+                    output(line)
+                    continue
+                if i > 0: output(line[:i])
+                return int(line[i + len(WarmWorker.EXIT):])
+        finally:
+            conn.close()
+
+class Job:
+    """
+    Command job, a command process and its status
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, id, command, argv, tail, entry = None, path = None):
+        """Initialize job
+
+        Args:
+            id: Job id
+            command: Command id
+            argv: Process arguments, entry point arguments for entry point jobs
+            tail: Number of output lines kept
+            entry: Optional python entry point (see WarmWorker)
+            path: Optional python path of entry point module
+        """
+        self._id = id
+        self._command = command
+        self._argv = argv
+        self._entry = entry
+        self._path = path
+        self._state = Job.QUEUED
+        self._exitCode = None
+        self._created = time.time()
+        self._started = None
+        self._finished = None
+        self._output = deque(maxlen = tail)
+
+    def getId(self):
+        """Get job id"""
+        return self._id
+
+    def getCommand(self):
+        """Get command id"""
+        return self._command
+
+    def getState(self):
+        """Get job state"""
+        return self._state
+
+    def isActive(self):
+        """Get whether job is queued or running"""
+        return self._state == Job.QUEUED or self._state == Job.RUNNING
+
+    def __output(self, line):
+        """Collect output line"""
+        self._output.append(line.rstrip('\r\n').decode('utf-8', 'replace'))
+
+    def __spawn(self, argv):
+        """Run process, returns exit code"""
+        import subprocess #command processing
+        process = subprocess.Popen(argv, stdout = subprocess.PIPE,
+                                   stderr = subprocess.STDOUT, close_fds = True)
+        for line in iter(process.stdout.readline, ''):
+            self.__output(line)
+        return process.wait()
+
+    def run(self, warm = None, metrics = None):
+        """Run process and collect its output, blocks until process ends
+
+        Args:
+            warm: Optional WarmWorker running entry point jobs
+            metrics: Optional Metrics recording job duration
+        """
+        self._state = Job.RUNNING
+        self._started = time.time()
+        try:
+            if self._entry == None:
+                self._exitCode = self.__spawn(self._argv)
+            else:
+                spawn = warm == None
+                if not spawn:
+                    try:
+                        self._exitCode = warm.execute(self._entry, self._path, self._argv,
+                                                      self.__output)
+                    except socket.error:
+                        spawn = True
+                if spawn:
+                    #No warm worker, run in a new interpreter
+                    self._exitCode = self.__spawn(entryArgs(self._entry, self._path, self._argv))
+            if self._exitCode == 0: self._state = Job.DONE
+            else: self._state = Job.FAILED
+        except (OSError, IOError), e:
+            self.__output(str(e))
+            self._state = Job.FAILED
+        self._finished = time.time()
+        if not metrics == None:
+            metrics.record('littleserver_job_seconds',
+                           (('command', self._command), ('exit', str(self._exitCode))),
+                           self._finished - self._started, self._state == Job.FAILED)
+
+    def getStatus(self):
+        """Get job status dictionary"""
+        duration = None
+        if not self._started == None:
+            end = self._finished
+            if end == None: end = time.time()
+            duration = round(end - self._started, 3)
+        return {'id': self._id, 'command': self._command, 'state': self._state,
+                'exitCode': self._exitCode, 'created': self._created,
+                'duration': duration, 'output': list(self._output)}
+
+class _RemoteJob:
+    """Job of the server process, as seen by a forked request handler (see JobRunner.serve)"""
+    def __init__(self, status):
+        """Initialize with job status dictionary"""
+        self._status = status
+
+    def getId(self):
+        """Get job id"""
+        return self._status['id']
+
+    def getStatus(self):
+        """Get job status dictionary"""
+        return self._status
+
+class JobRunner:
+    """
+    Runs command jobs on a limited number of threads, each thread waits for
+    its job process. Jobs of a command are limited by the command limit.
+    In forking mode request handlers (child processes) submit and read jobs
+    of the server process over a unix socket, see serve
+    """
+    def __init__(self, workers = 2, history = 20, tail = 20, warm = None, metrics = None):
+        """Initialize runner
+
+        Args:
+            workers: Maximum number of concurrent jobs, others are queued
+            history: Number of finished jobs kept for status
+            tail: Number of output lines kept per job
+            warm: Optional WarmWorker running entry point jobs
+            metrics: Optional Metrics recording job durations
+        """
+        self._warm = warm
+        self._metrics = metrics
+        self._history = history
+        self._tail = tail
+        self._jobs = [] #Active and recent jobs, oldest first
+        self._nextId = 1
+        self._lock = threading.Lock()
+        self._pending = Queue.Queue()
+        self._pid = os.getpid()
+        self._dir = None
+        self._address = None
+        self._listener = None
+        for i in range(workers):
+            thread = threading.Thread(target = self.__work)
+            thread.setDaemon(True)
+            thread.start()
+
+    def submit(self, command, argv):
+        """Queue command job
+
+        Args:
+            command: Command
+            argv: Process arguments
+
+        Returns: Job or None if command limit is reached
+        """
+        if self.__isRemote():
+            status = self.__request({'action': 'submit', 'command': command.getId(),
+                                     'limit': command.getLimit(), 'entry': command.getEntry(),
+                                     'path': command.getPath(), 'argv': argv})
+            if status == None: return
+            return _RemoteJob(status)
+        with self._lock:
+            active = 0
+            for job in self._jobs:
+                if job.getCommand() == command.getId() and job.isActive(): active += 1
+            if active >= command.getLimit(): return
+            job = Job(self._nextId, command.getId(), argv, self._tail,
+                      command.getEntry(), command.getPath())
+            self._nextId += 1
+            self._jobs.append(job)
+            self.__trim()
+        self._pending.put(job)
+        return job
+
+    def __trim(self):
+        """Drop oldest finished jobs above history size, lock must be held"""
+        finished = [job for job in self._jobs if not job.isActive()]
+        for job in finished[:max(0, len(finished) - self._history)]:
+            self._jobs.remove(job)
+
+    def __work(self):
+        """Job thread loop"""
+        while True:
+            job = self._pending.get()
+            job.run(self._warm, self._metrics)
+            with self._lock:
+                self.__trim()
+
+    def getJob(self, id):
+        """Get job by id or None if unknown"""
+        if self.__isRemote():
+            status = self.__request({'action': 'job', 'id': id})
+            if status == None: return
+            return _RemoteJob(status)
+        with self._lock:
+            for job in self._jobs:
+                if job.getId() == id: return job
+
+    def getJobs(self):
+        """Get active and recent jobs, oldest first"""
+        if self.__isRemote():
+            return [_RemoteJob(status) for status in self.__request({'action': 'jobs'})]
+        with self._lock:
+            return list(self._jobs)
+
+    def serve(self):
+        """Accept jobs of forked request handlers (forking mode), jobs run and are kept
+        in this process so command limits and status are shared by all requests.
+        Must be called before request handlers are forked
+
+        Returns: True if serving otherwise False
+        """
+        if not hasattr(socket, 'AF_UNIX'): return False
+        self._dir = tempfile.mkdtemp(prefix = 'littleserver')
+        self._address = os.path.join(self._dir, 'jobs.sock')
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self._address)
+        self._listener.listen(16)
+        self._listener.settimeout(1.0)
+        thread = threading.Thread(target = self.__serve, args = (self._listener,))
+        thread.setDaemon(True)
+        thread.start()
+        return True
+
+    def stop(self):
+        """Stop accepting jobs of forked request handlers"""
+        if self._listener == None: return
+        self._listener = None
+        try:
+            os.remove(self._address)
+            os.rmdir(self._dir)
+        except OSError:
+            pass
+
+    def __isRemote(self):
+        """Get whether running in a forked request handler, jobs started there would never run"""
+        return not os.getpid() == self._pid
+
+    def __serve(self, listener):
+        """Request handlers loop, a single request and reply line per connection"""
+        import json #command jobs of request processes
+        while self._listener == listener:
+            try:
+                conn, address = listener.accept()
+            except socket.error: #Includes timeout
+                continue
+            try:
+                conn.settimeout(5.0)
+                request = json.loads(conn.makefile('r').readline())
+                conn.sendall(json.dumps(self.__answer(request)) + '\n')
+            except (socket.error, ValueError, KeyError, TypeError):
+                pass
+            finally:
+                conn.close()
+        listener.close()
+
+    def __answer(self, request):
+        """Get reply of request handler request"""
+        action = request['action']
+        if action == 'jobs': return [job.getStatus() for job in self.getJobs()]
+        if action == 'submit':
+            entry = request['entry']
+            if not entry == None: entry = str(entry)
+            path = request['path']
+            if not path == None: path = str(path)
+            command = Command(request['command'], None, 'false', int(request['limit']), entry, path)
+            job = self.submit(command, [arg.encode('utf-8') for arg in request['argv']])
+        else:
+            job = self.getJob(int(request['id']))
+        if job == None: return
+        return job.getStatus()
+
+    def __request(self, request):
+        """Send request to the server process runner, see serve
+
+        Raises: socket.error if server process runner is not available
+        """
+        import json #command jobs of request processes
+        if self._address == None: raise socket.error('Jobs are not served')
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.settimeout(5.0)
+            conn.connect(self._address)
+            conn.sendall(json.dumps(request) + '\n')
+            line = conn.makefile('r').readline()
+        finally:
+            conn.close()
+        if len(line) == 0: raise socket.error('No reply from server process')
+        return json.loads(line)
+
+def isModified(etag, mtime, ifNoneMatch, ifModifiedSince):
+    """Get whether client copy is out of date
+
+    Args:
+        etag: Current entity tag
+        mtime: Current modification time
+        ifNoneMatch: If-None-Match header or None
+        ifModifiedSince: If-Modified-Since header or None
+    """
+    if not ifNoneMatch == None:
+        tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+        return not (etag in tags or '*' in tags)
+    if not ifModifiedSince == None:
+        from email.utils import parsedate_tz, mktime_tz #html files caching
+        try:
+            return mktime_tz(parsedate_tz(ifModifiedSince)) < int(mtime)
+        except (TypeError, ValueError, OverflowError):
+            return True
+    return True
+
+def getHttpDate(seconds):
+    """Get HTTP date (RFC 1123) of time, same as email.utils.formatdate(seconds, usegmt = True)"""
+    year, month, day, hour, minute, second, weekday = time.gmtime(seconds)[:7]
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % \
+           (BaseHTTPRequestHandler.weekdayname[weekday], day, BaseHTTPRequestHandler.monthname[month],
+            year, hour, minute, second)
+
+def guessType(path):
+    """Get mime type of file path or None, media types are loaded on first use"""
+    global _mimetypes
+    if _mimetypes == None:
+        import mimetypes #media files
+        for contentType, extension in MEDIA_TYPES:
+            mimetypes.add_type(contentType, extension)
+        _mimetypes = mimetypes
+    return _mimetypes.guess_type(path)[0]
+
+def getETag(size, mtime):
+    """Get entity tag of file size and modification time"""
+    return '"%x-%x"' % (size, int(mtime * 1000))
+
+class StaticFile:
+    """
+    Cached static file content
+    """
+    def __init__(self, path, contentType):
+        """Read file and prepare its variants
+
+        Args:
+            path: File path
+            contentType: Content mime type
+        """
+        self._path = path
+        self._contentType = contentType
+        info = os.stat(path)
+        self._mtime = info.st_mtime
+        self._checked = time.time()
+        f = open(path, 'rb')
+        try:
+            self._data = f.read()
+        finally:
+            f.close()
+        self._gzip = self.__compress()
+        self._etag = getETag(len(self._data), self._mtime)
+        self._lastModified = getHttpDate(self._mtime)
+
+    def __compress(self):
+        """Get gzip variant, precompressed 'path.gz' file if up to date
+
+        Returns: Gzip data or None if not smaller than file
+        """
+        try:
+            if os.stat(self._path + '.gz').st_mtime >= self._mtime:
+                f = open(self._path + '.gz', 'rb')
+                try:
+                    return f.read()
+                finally:
+                    f.close()
+        except (OSError, IOError):
+            pass
+        import gzip #html files compression
+        from StringIO import StringIO #html files compression
+        buffer = StringIO()
+        f = gzip.GzipFile(fileobj = buffer, mode = 'wb', mtime = self._mtime)
+        f.write(self._data)
+        f.close()
+        data = buffer.getvalue()
+        if len(data) >= len(self._data): return
+        return data
+
+    def isValid(self, interval):
+        """Get whether file did not change, file is checked at most once per interval
+
+        Args:
+            interval: Seconds between file checks
+        """
+        now = time.time()
+        if now - self._checked < interval: return True
+        self._checked = now
+        try:
+            return os.stat(self._path).st_mtime == self._mtime
+        except OSError:
+            return False
+
+    def getContentType(self):
+        """Get content mime type"""
+        return self._contentType
+
+    def getData(self, gzip = False):
+        """Get content
+
+        Args:
+            gzip: Get gzip variant if available
+
+        Returns: Tuple of data and content encoding (None if not compressed)
+        """
+        if gzip and not self._gzip == None: return (self._gzip, 'gzip')
+        return (self._data, None)
+
+    def getETag(self):
+        """Get entity tag"""
+        return self._etag
+
+    def getLastModified(self):
+        """Get last modified http date"""
+        return self._lastModified
+
+    def isModified(self, ifNoneMatch, ifModifiedSince):
+        """Get whether client copy is out of date
+
+        Args:
+            ifNoneMatch: If-None-Match header or None
+            ifModifiedSince: If-Modified-Since header or None
+        """
+        return isModified(self._etag, self._mtime, ifNoneMatch, ifModifiedSince)
+
+class StaticCache:
+    """
+    In memory static files cache, keyed by path and invalidated by file mtime
+    """
+    def __init__(self, interval = 1.0):
+        """Initialize cache
+
+        Args:
+            interval: Seconds between file changes checks
+        """
+        self._interval = interval
+        self._files = {}
+
+    def get(self, path, contentType):
+        """Get cached file
+
+        Args:
+            path: File path
+            contentType: Content mime type
+
+        Returns: StaticFile
+        Raises: IOError or OSError if file could not be read
+        """
+        item = self._files.get(path)
+        if item == None or not item.isValid(self._interval):
+            item = StaticFile(path, contentType)
+            self._files[path] = item
+        return item
+
+class NowPlaying:
+    """
+    Shared now playing state
+    A single ShuffleThis.PlaybackWatcher polls the device for all clients,
+    clients read the last state or wait for its next change. Waiting clients
+    can be parked, they are called back on a single delivery thread so they
+    hold no request thread while waiting
+    """
+    def __init__(self, settings, metrics = None):
+        """Initialize now playing
+
+        Args:
+            settings: Now playing settings, see Config.getNowPlaying
+            metrics: Optional Metrics recording device API calls
+        """
+        self._settings = settings
+        self._metrics = metrics
+        self._apiClass = None
+        self._api = None
+        self._watcher = None
+        self._version = 0
+        self._state = None
+        self._stopped = False
+        self._waiters = [] #Parked clients, (deadline, version, callback)
+        self._delivery = None
+        self._condition = threading.Condition()
+
+    def start(self):
+        """Start device watcher on first use, returns once the device was checked"""
+        with self._condition:
+            if not self._watcher == None: return
+            settings = self._settings
+            self._apiClass = loadEntry('ShuffleThis.TheDavidBox', settings['path'])
+            watcher = loadEntry('ShuffleThis.PlaybackWatcher', settings['path'])
+            if not self._metrics == None:
+                loadEntry('ShuffleThis.setMetrics', settings['path'])(self._metrics)
+            #Watcher polls through getPlayInfo below
+            watcher = watcher(self, float(settings['fast']), float(settings['slow']))
+            watcher.addListener(self.__onChange)
+            #First state is known before any client reads it
+            watcher.start(watcher.check())
+            self._watcher = watcher
+
+    def stop(self):
+        """Stop device watcher and wake up waiting and parked clients"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notifyAll()
+        if not self._watcher == None: self._watcher.stop()
+        if not self._delivery == None: self._delivery.join()
+        if not self._api == None: self._api.close()
+
+    def isStopped(self):
+        """Get whether now playing was stopped (server shutdown)"""
+        return self._stopped
+
+    def getPlayInfo(self):
+        """Get device play info for the watcher, API is not exception safe so reconnect on errors
+
+        Returns: Play info (see TheDavidBox.getPlayInfo) or None if error or no file playing
+        """
+        if self._api == None:
+            self._api = self._apiClass(self._settings['host'], self._settings['port'])
+        import httplib #API errors
+        try:
+            return self._api.getPlayInfo()
+        except (IOError, socket.error, httplib.HTTPException):
+            self.reconnect()
+
+    def reconnect(self):
+        """Drop device API connection, next getPlayInfo opens a new one"""
+        if not self._api == None: self._api.close()
+        self._api = None
+
+    def __onChange(self, change, state, previous):
+        """Watcher listener, wakes up waiting clients"""
+        with self._condition:
+            self._version += 1
+            self._state = state
+            self._condition.notifyAll()
+
+    def get(self, version = None, timeout = 0):
+        """Get now playing state
+
+        Args:
+            version: Optional known version, waits while state has this version
+            timeout: Maximum seconds to wait
+
+        Returns: Tuple of state version and play info (see TheDavidBox.getPlayInfo)
+        """
+        self.start()
+        with self._condition:
+            end = time.time() + timeout
+            while version == self._version and not self._stopped:
+                left = end - time.time()
+                if left <= 0: break
+                self._condition.wait(left)
+            return (self._version, self._state)
+
+    def park(self, version, timeout, callback):
+        """Call back once state is newer than version or timeout passed, same as get
+        without holding the calling thread. Callbacks run on the delivery thread one
+        after another, so they must not block (e.g. a socket timeout)
+
+        Args:
+            version: Known version, None for current state
+            timeout: Maximum seconds to wait
+            callback: Function called with state version and play info
+        """
+        self.start()
+        with self._condition:
+            if not self._stopped:
+                self._waiters.append((time.time() + timeout, version, callback))
+                if self._delivery == None:
+                    self._delivery = threading.Thread(target = self.__deliver)
+                    self._delivery.setDaemon(True)
+                    self._delivery.start()
+                self._condition.notifyAll()
+                return
+            version, state = self._version, self._state
+        callback(version, state)
+
+    def __deliver(self):
+        """Delivery thread loop, calls back parked clients, all of them once stopped"""
+        while True:
+            with self._condition:
+                while True:
+                    now = time.time()
+                    due = [item for item in self._waiters
+                           if self._stopped or item[0] <= now or not item[1] == self._version]
+                    if len(due) > 0 or self._stopped: break
+                    timeout = None
+                    if len(self._waiters) > 0: timeout = min([item[0] for item in self._waiters]) - now
+                    self._condition.wait(timeout)
+                if len(due) == 0: return #Stopped
+                self._waiters = [item for item in self._waiters if not item in due]
+                version, state = self._version, self._state
+            for deadline, known, callback in due:
+                try:
+                    callback(version, state)
+                except:
+                    traceback.print_exc()
+
+class LittleHTTPServer(HTTPServer):
+    """Web server handling one request at a time"""
+    def __init__(self, address, handler):
+        """Initialize server
+
+        Args:
+            address: Server address
+            handler: Request handler class
+        """
+        HTTPServer.__init__(self, address, handler)
+        self._detached = set()
+
+    def detach(self, request):
+        """Keep request connection open once its handler returns, e.g. a client waiting
+        for now playing changes, the caller closes it
+
+        Returns: True if detached otherwise False
+        """
+        self._detached.add(request)
+        return True
+
+    def shutdown_request(self, request):
+        """Close request connection unless detached"""
+        if request in self._detached:
+            self._detached.discard(request)
+            return
+        HTTPServer.shutdown_request(self, request)
+
+    def requestShutdown(self):
+        """Stop serving, can be called from a request handler"""
+        #shutdown waits for serve_forever, so must not block the serving thread
+        thread = threading.Thread(target = self.shutdown)
+        thread.setDaemon(True)
+        thread.start()
+
+    def drain(self):
+        """Wait for in-flight requests once serving stopped"""
+        pass
+
+class PooledHTTPServer(LittleHTTPServer):
+    """Web server handling requests on a bounded pool of threads"""
+    def __init__(self, address, handler, workers = 4):
+        """Initialize server
+
+        Args:
+            address: Server address
+            handler: Request handler class
+            workers: Number of request threads
+        """
+        LittleHTTPServer.__init__(self, address, handler)
+        #Accepting blocks once all threads are busy and backlog is full
+        self._requests = Queue.Queue(workers * 4)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target = self.__work)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        """Queue request for pool threads"""
+        self._requests.put((request, client_address))
+
+    def __work(self):
+        """Request thread loop, stops on None item"""
+        while True:
+            item = self._requests.get()
+            if item == None: return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+    def drain(self):
+        """Handle queued requests and stop pool threads"""
+        for thread in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            if not thread == threading.currentThread(): thread.join()
+
+class ForkingHTTPServer(ForkingMixIn, LittleHTTPServer):
+    """Web server handling each request in a child process"""
+    def __init__(self, address, handler, workers = 4):
+        """Initialize server
+
+        Args:
+            address: Server address
+            handler: Request handler class
+            workers: Maximum number of child processes
+        """
+        LittleHTTPServer.__init__(self, address, handler)
+        self.max_children = workers
+        self._pid = os.getpid()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.requestShutdown())
+
+    def detach(self, request):
+        """Request connections are not detached, the child process ends with its handler"""
+        return False
+
+    def requestShutdown(self):
+        """Stop serving, from a child process the server process is signaled"""
+        if os.getpid() == self._pid:
+            LittleHTTPServer.requestShutdown(self)
+        else:
+            os.kill(self._pid, signal.SIGTERM)
+
+    def drain(self):
+        """Wait for child processes"""
+        while self.active_children:
+            try:
+                pid, status = os.waitpid(0, 0)
+            except OSError:
+                break
+            if pid in self.active_children: self.active_children.remove(pid)
+
+class _ResponseWriter:
+    """Response of a request handled from a buffer (async mode), media files are
+       sent by a producer as the connection drains instead of being written
+    """
+    closed = False
+
+    def __init__(self):
+        """Initialize empty response"""
+        self._data = []
+        self._file = None
+
+    def write(self, data):
+        """Write response data"""
+        self._data.append(str(data))
+
+    def flush(self):
+        """Nothing to flush, data is sent by the connection"""
+        pass
+
+    def close(self):
+        """Keep data, read by the connection once the request is handled"""
+        pass
+
+    def sendFile(self, f, offset, length):
+        """Send file part after written data
+
+        Args:
+            f: Open file, may be closed once this returns
+            offset: First byte
+            length: Number of bytes
+        """
+        self._file = (os.fdopen(os.dup(f.fileno()), 'rb'), offset, length)
+
+    def getData(self):
+        """Get written data"""
+        return ''.join(self._data)
+
+    def getFile(self):
+        """Get (file, offset, length) to send or None"""
+        return self._file
+
+class _BufferedRequest:
+    """Request read by an event loop connection, given to the request handler as its socket"""
+    def __init__(self, data):
+        """Initialize request
+
+        Args:
+            data: Request line, headers and body
+        """
+        self._data = data
+        self._writer = _ResponseWriter()
+
+    def makefile(self, mode, bufsize = -1):
+        """Get request reader or response writer"""
+        if 'r' in mode:
+            from StringIO import StringIO #request data
+            return StringIO(self._data)
+        return self._writer
+
+    def getWriter(self):
+        """Get response writer"""
+        return self._writer
+
+class _FileProducer:
+    """Producer of a file part, read a chunk at a time as the connection drains"""
+    def __init__(self, f, offset, length, chunkSize = 1 << 18):
+        """Initialize producer, file is closed once sent"""
+        self._file = f
+        self._length = length
+        self._chunkSize = chunkSize
+        f.seek(offset)
+
+    def more(self):
+        """Get next chunk, empty once done"""
+        if self._length > 0:
+            data = self._file.read(min(self._length, self._chunkSize))
+            if len(data) > 0:
+                self._length -= len(data)
+                return data
+        self.close()
+        return ''
+
+    def close(self):
+        """Close file"""
+        self._length = 0
+        self._file.close()
+
+class _HTTPChannel(asynchat.async_chat):
+    """Event loop HTTP/1.1 connection
+       Requests are read whole (headers and body) and handled in order by the web server
+       request handler, so pipelined requests get their responses in order. Responses
+       are framed (Content-Length) by the connection and it is kept open between requests
+    """
+    MAX_HEADER = 65536
+    ac_out_buffer_size = 1 << 16 #Whole small responses are sent at once
+
+    def __init__(self, server, sock, address, map):
+        """Initialize connection
+
+        Args:
+            server: AsyncHTTPServer
+            sock: Accepted socket
+            address: Client address
+            map: Event loop socket map
+        """
+        asynchat.async_chat.__init__(self, sock, map)
+        #Responses are written whole, so segments are not held back for acknowledgments
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server.register(self)
+        self._server = server
+        self._address = address
+        self._buffer = []
+        self._size = 0
+        self._header = None #Header of request which body is read
+        self._rejected = False
+        self._active = time.time()
+        self.set_terminator('\r\n\r\n')
+
+    def getActive(self):
+        """Get time of last received data"""
+        return self._active
+
+    def collect_incoming_data(self, data):
+        """Collect request data"""
+        self._active = time.time()
+        if self._rejected: return
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._header == None and self._size > _HTTPChannel.MAX_HEADER:
+            self.__reject(431, 'Request Header Fields Too Large')
+
+    def found_terminator(self):
+        """Request header or body read"""
+        if self._rejected: return
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        if not self._header == None:
+            header = self._header
+            self._header = None
+            self.set_terminator('\r\n\r\n')
+            self.__handle(header, data)
+            return
+        if len(data.strip()) == 0: return #Line breaks between requests
+        header = data + '\r\n\r\n'
+        length = 0
+        for line in header.split('\r\n')[1:]:
+            name, sep, value = line.partition(':')
+            name = name.strip().lower()
+            if name == 'transfer-encoding' and not value.strip().lower() == 'identity':
+                self.__reject(411, 'Length Required')
+                return
+            if name == 'content-length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    length = -1
+        if length < 0:
+            self.__reject(400, 'Bad Request')
+        elif length > WebServer.MAX_BODY:
+            self.__reject(413, 'Request Entity Too Large')
+        elif length > 0:
+            self._header = header
+            self.set_terminator(length)
+        else:
+            self.__handle(header, '')
+
+    def __reject(self, code, message):
+        """Send error and close once sent, further requests are ignored"""
+        self._rejected = True
+        self.push('HTTP/1.1 %d %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n' % (code, message))
+        self.close_when_done()
+        self.set_terminator(None)
+        self._buffer = []
+
+    def __handle(self, header, body):
+        """Handle request with the request handler and send its response"""
+        words = header.split('\r\n', 1)[0].split()
+        version = 'HTTP/0.9'
+        if len(words) == 3: version = words[2].upper()
+        connection = ''
+        for line in header.split('\r\n')[1:]:
+            name, sep, value = line.partition(':')
+            if name.strip().lower() == 'connection': connection = value.strip().lower()
+        keepAlive = (version == 'HTTP/1.1' and not 'close' in connection) or \
+                    (version == 'HTTP/1.0' and 'keep-alive' in connection)
+        request = _BufferedRequest(header + body)
+        try:
+            self._server.RequestHandlerClass(request, self._address, self._server)
+        except:
+            self.__reject(500, 'Internal Server Error')
+            return
+        writer = request.getWriter()
+        data = writer.getData()
+        head, sep, content = data.partition('\r\n\r\n')
+        lines = [line for line in head.split('\r\n') if len(line) > 0]
+        try:
+            code = int(lines[0].split(' ', 2)[1])
+        except (IndexError, ValueError):
+            self.__reject(400, 'Bad Request') #Not parsed by request handler
+            return
+        #Connection is framed here, handler (HTTP/1.0) connection headers are replaced
+        status = lines[0].split(' ', 1)
+        lines = ['HTTP/1.1 ' + status[1]] + \
+                [line for line in lines[1:] if not line.split(':', 1)[0].strip().lower() == 'connection']
+        names = [line.split(':', 1)[0].strip().lower() for line in lines[1:]]
+        noContent = code < 200 or code in (204, 304)
+        if noContent or words[0].upper() == 'HEAD': content = ''
+        if not noContent and not 'content-length' in names:
+            lines.append('Content-Length: %d' % len(content))
+        keepAlive = keepAlive and not code in (400, 408) and code < 500
+        if keepAlive: lines.append('Connection: keep-alive')
+        else: lines.append('Connection: close')
+        self.push('\r\n'.join(lines) + '\r\n\r\n' + content)
+        file = writer.getFile()
+        if not file == None:
+            if content == '' and not words[0].upper() == 'HEAD': self.push_with_producer(_FileProducer(*file))
+            else: file[0].close()
+        if not keepAlive: self.close_when_done()
+
+    def close(self):
+        """Close connection and files of unsent responses"""
+        for item in self.producer_fifo:
+            if isinstance(item, _FileProducer): item.close()
+        self._server.unregister(self)
+        asynchat.async_chat.close(self)
+
+    def handle_error(self):
+        """Close connection on unexpected errors"""
+        self.close()
+
+class AsyncHTTPServer(asyncore.dispatcher):
+    """Web server handling all connections on one thread with an event loop (asyncore)
+       Connections are kept open between requests (HTTP/1.1 keep-alive) and idle
+       connections only cost a socket, so many remotes and browsers can stay connected.
+       Sockets stay registered with epoll where available, so a loop pass does not
+       depend on the number of idle connections (asyncore polls every socket each pass).
+       Requests are handled one at a time, same as single mode
+    """
+    KEEP_ALIVE = 60 #Idle connection seconds
+
+    def __init__(self, address, handler):
+        """Initialize server
+
+        Args:
+            address: Server address
+            handler: Request handler class
+        """
+        self._map = {}
+        asyncore.dispatcher.__init__(self, map = self._map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(64)
+        self.server_address = self.socket.getsockname()
+        self.RequestHandlerClass = handler
+        self._usePoll = hasattr(select, 'poll')
+        self._poller = None
+        if hasattr(select, 'epoll'): self._poller = select.epoll()
+        self._masks = {} #Registered sockets event masks
+        self.register(self)
+        self._checked = time.time() #Last idle connections check
+        self._stopRequested = False
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    def register(self, item):
+        """Register dispatcher socket for events"""
+        if self._poller == None: return
+        self._masks[item._fileno] = select.EPOLLIN
+        self._poller.register(item._fileno, select.EPOLLIN)
+
+    def unregister(self, item):
+        """Unregister dispatcher socket before it is closed"""
+        if self._poller == None or not self._masks.has_key(item._fileno): return
+        del self._masks[item._fileno]
+        self._poller.unregister(item._fileno)
+
+    def __poll(self, timeout):
+        """Wait for socket events and dispatch them"""
+        if self._poller == None:
+            asyncore.loop(timeout, self._usePoll, self._map, 1)
+            return
+        try:
+            events = self._poller.poll(timeout)
+        except IOError, e:
+            if e.errno == errno.EINTR: return
+            raise
+        for fd, flags in events:
+            item = self._map.get(fd)
+            if item == None: continue
+            asyncore.readwrite(item, flags)
+            #Only dispatched sockets may have changed writing state
+            if self._masks.has_key(fd):
+                mask = select.EPOLLIN
+                if item.writable(): mask |= select.EPOLLOUT
+                if not mask == self._masks[fd]:
+                    self._masks[fd] = mask
+                    self._poller.modify(fd, mask)
+
+    def handle_accept(self):
+        """Accept connection"""
+        pair = self.accept()
+        if pair == None: return
+        sock, address = pair
+        _HTTPChannel(self, sock, address, self._map)
+
+    def handle_error(self):
+        """Keep listening on accept errors (e.g. too many open files)"""
+        pass
+
+    def __getChannels(self):
+        """Get open connections"""
+        return [item for item in self._map.values() if isinstance(item, _HTTPChannel)]
+
+    def serve_forever(self):
+        """Handle requests until shutdown"""
+        self._stopRequested = False
+        self._stopped.clear()
+        try:
+            while not self._stopRequested:
+                self.__poll(1.0)
+                #Close idle connections
+                now = time.time()
+                if now - self._checked < 1.0: continue
+                self._checked = now
+                for channel in self.__getChannels():
+                    if now - channel.getActive() > AsyncHTTPServer.KEEP_ALIVE and not channel.writable():
+                        channel.close()
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stop serving and wait for serve_forever to return"""
+        self._stopRequested = True
+        self._stopped.wait()
+
+    def requestShutdown(self):
+        """Stop serving, can be called from a request handler"""
+        self._stopRequested = True
+
+    def detach(self, request):
+        """Request connections are not detached, responses are framed by the event loop"""
+        return False
+
+    def drain(self):
+        """Send pending responses once serving stopped, for a few seconds at most"""
+        until = time.time() + 5
+        while time.time() < until and \
+              len([channel for channel in self.__getChannels() if channel.writable()]) > 0:
+            self.__poll(0.1)
+
+    def server_close(self):
+        """Close listening socket and connections"""
+        for channel in self.__getChannels():
+            channel.close()
+        self.unregister(self)
+        self.close()
+        if not self._poller == None: self._poller.close()
+
+def createServer(config, handler):
+    """Create web server of configured mode
+
+    Args:
+        config: Configuration
+        handler: Request handler
+
+    Returns: Web server
+    """
+    address = ('', config.getPort())
+    if config.getMode() == 'threaded':
+        return PooledHTTPServer(address, handler, config.getWorkers())
+    if config.getMode() == 'forking':
+        return ForkingHTTPServer(address, handler, config.getWorkers())
+    if config.getMode() == 'async':
+        return AsyncHTTPServer(address, handler)
+    return LittleHTTPServer(address, handler)
+
 class WebServer(BaseHTTPRequestHandler):
     """Little web server"""
-    def __init__(self, config, *args):
+    MAX_BODY = 1 << 20 #Posted body bytes
+    MAP_WINDOW = 1 << 24 #Mapped media file bytes at a time
+
+    def __init__(self, config, jobs, cache, nowPlaying, metrics, *args):
         """Initialize web server"""
         self._config = config
+        self._jobs = jobs
+        self._cache = cache
+        self._nowPlaying = nowPlaying
+        self._metrics = metrics
+        self._status = None
         BaseHTTPRequestHandler.__init__(self, *args)
 
+    def handle_one_request(self):
+        """Handle request, recording its duration if metrics are enabled"""
+        if self._metrics == None: return BaseHTTPRequestHandler.handle_one_request(self)
+        self._status = None
+        start = time.time()
+        BaseHTTPRequestHandler.handle_one_request(self)
+        if self._status == None: return #Connection closed without request
+        self._metrics.record('littleserver_request_seconds',
+                             (('route', self.__getRoute()), ('status', str(self._status))),
+                             time.time() - start, self._status >= 500)
+
+    def send_response(self, code, message = None):
+        """Send response status, kept for metrics"""
+        self._status = code
+        BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def __getRoute(self):
+        """Get route of request path, metrics label"""
+        if not hasattr(self, 'path'): return 'other' #Request line not parsed
+        path = urlparse.urlparse(self.path).path
+        if path in ('/command', '/jobs', '/nowplaying', '/nowplaying/events', '/metrics'):
+            return path
+        if path == '/' or path.endswith('.htm') or path.endswith('.html'): return 'html'
+        if path.startswith(self._config.getMediaPath() + '/'): return 'media'
+        if self._isAsset(path): return 'asset'
+        return 'other'
+
     def _runCommand(self, id, query):
-        """Run command"""
-        #Build command path
+        """Queue command job
+
+        Returns: Job or None if command limit is reached
+        """
         command = self._config.getCommand(id)
-        path = ''
-        item = self._config.getPrefix()
-        if not item == None: path += item
-        path += command.getRun()
+        args = []
         if command.getAllowArgs() and query.has_key('arg'):
             for arg in query.get('arg'):
-                path += ' ' + arg
-        item = self._config.getSuffix()
-        if not item == None: path += item
-        #Run command
-        commands.getoutput(path)
+                args += splitArgs(arg)
+        return self._jobs.submit(command, command.getArgv(args))
+
+    def _sendJson(self, data):
+        """Send json response"""
+        import json #command status
+        data = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _getPath(self, path, root = None):
+        """Get file path of url path in directory
+
+        Args:
+            path: Url path relative to directory
+            root: Directory, html files directory by default
+
+        Raises: IOError if path is outside directory
+        """
+        if root == None:
+            root = curdir
+            if not self._config.getDir() == None and len(self._config.getDir()) > 0:
+                root = os.path.join(curdir, self._config.getDir())
+        root = os.path.abspath(root)
+        path = os.path.normpath(os.path.join(root, urlparse.unquote(path).lstrip('/')))
+        if not path == root and not path.startswith(root + sep):
+            raise IOError('Outside directory')
+        return path
+
+    def _getRange(self, size, etag):
+        """Get requested byte range
+
+        Args:
+            size: File size
+            etag: File entity tag
+
+        Returns: Tuple of (first, last) byte, None for whole file or
+                 False if range is not satisfiable
+        """
+        header = self.headers.getheader('Range')
+        if header == None or not header.strip().startswith('bytes='): return
+        ifRange = self.headers.getheader('If-Range')
+        if not ifRange == None and not ifRange.strip() == etag: return
+        ranges = header.strip()[len('bytes='):].split(',')
+        if not len(ranges) == 1: return #Multiple ranges, send whole file
+        first, sep, last = ranges[0].strip().partition('-')
+        try:
+            if first == '':
+                #Suffix range
+                length = int(last)
+                if length <= 0: return False
+                return (max(0, size - length), size - 1)
+            first = int(first)
+            if last == '': last = size - 1
+            else: last = min(int(last), size - 1)
+        except ValueError:
+            return
+        if first >= size or last < first: return False
+        return (first, last)
+
+    def _sendFile(self, f, offset, length):
+        """Write file part without reading it into memory
+
+        Args:
+            f: Open file
+            offset: First byte
+            length: Number of bytes
+        """
+        import mmap #media files
+        if length <= 0: return
+        if hasattr(self.wfile, 'sendFile'):
+            #Event loop connection sends file as it drains
+            self.wfile.sendFile(f, offset, length)
+            return
+        self.wfile.flush()
+        end = offset + length
+        while offset < end:
+            #Map a window at a time, a whole large file does not fit a 32 bit address space
+            start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            size = min(end - start, WebServer.MAP_WINDOW)
+            try:
+                data = mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ, offset = start)
+            except (EnvironmentError, ValueError, OverflowError):
+                break #Not mappable, read the rest
+            try:
+                #Mapped file pages are sent without copies in python
+                while offset < start + size:
+                    chunk = min(start + size - offset, 1 << 18)
+                    self.connection.sendall(buffer(data, offset - start, chunk))
+                    offset += chunk
+            finally:
+                data.close()
+        f.seek(offset)
+        while offset < end:
+            data = f.read(min(end - offset, 1 << 18))
+            if len(data) == 0: break
+            self.connection.sendall(data)
+            offset += len(data)
+
+    def _sendMedia(self, path):
+        """Send media file, supports conditional and range requests"""
+        contentType = guessType(path)
+        if contentType == None: contentType = 'application/octet-stream'
+        f = open(path, 'rb')
+        try:
+            info = os.fstat(f.fileno())
+            size = info.st_size
+            etag = getETag(size, info.st_mtime)
+            if not isModified(etag, info.st_mtime, self.headers.getheader('If-None-Match'),
+                              self.headers.getheader('If-Modified-Since')):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            byteRange = self._getRange(size, etag)
+            if byteRange == False:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byteRange == None:
+                first, last = 0, size - 1
+                self.send_response(200)
+            else:
+                first, last = byteRange
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (first, last, size))
+            self.send_header('Content-Type', contentType)
+            self.send_header('Content-Length', str(last - first + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', getHttpDate(info.st_mtime))
+            self.end_headers()
+            if not self.command == 'HEAD': self._sendFile(f, first, last - first + 1)
+        finally:
+            f.close()
+
+    def _isAsset(self, path):
+        """Get whether file is served from html files directory (images, styles, media)"""
+        contentType = guessType(path)
+        if contentType == None: return False
+        return contentType.split('/')[0] in ('image', 'video', 'audio') or \
+               contentType in ('text/css', 'application/javascript', 'application/x-javascript')
+
+    def _sendStatic(self, path, contentType):
+        """Send cached static file, supports conditional requests and gzip"""
+        item = self._cache.get(path, contentType)
+        headers = self.headers
+        if not item.isModified(headers.getheader('If-None-Match'),
+                               headers.getheader('If-Modified-Since')):
+            self.send_response(304)
+            self.send_header('ETag', item.getETag())
+            self.end_headers()
+            return
+        encoding = headers.getheader('Accept-Encoding', '')
+        data, encoding = item.getData('gzip' in encoding)
+        self.send_response(200)
+        self.send_header('Content-Type', item.getContentType())
+        self.send_header('Content-Length', str(len(data)))
+        if not encoding == None: self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', item.getETag())
+        self.send_header('Last-Modified', item.getLastModified())
+        self.send_header('Cache-Control', 'no-cache') #Revalidate, page may change
+        self.end_headers()
+        if not self.command == 'HEAD': self.wfile.write(data)
+
+    def _startNowPlaying(self):
+        """Start now playing device watcher, before any response header is sent
+
+        Returns: True if started, otherwise an error was sent
+        """
+        if isinstance(self.server, ForkingMixIn):
+            #Each request process would start its own device watcher
+            self.send_error(501, 'Now playing needs threaded mode')
+            return False
+        self._nowPlaying.start()
+        return True
+
+    def _detachWaiting(self, contentType):
+        """Send response headers and detach connection of a client waiting for now playing
+        changes (see NowPlaying.park), the body is sent by the now playing delivery thread
+
+        Returns: Connection, None if the client disconnected (connection closed) or
+                 False if the server mode can not detach connections (nothing sent)
+        """
+        connection = self.connection
+        if not self.server.detach(connection): return False
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', contentType)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.flush()
+        except (IOError, socket.error):
+            connection.close()
+            return
+        #Slow client must not hold other clients deliveries
+        connection.settimeout(5.0)
+        return connection
+
+    def _parkWaiting(self, connection, version, timeout, callback):
+        """Park detached connection (see NowPlaying.park), closes it if it could not be parked"""
+        try:
+            self._nowPlaying.park(version, timeout, callback)
+        except:
+            traceback.print_exc()
+            connection.close()
+
+    def _sendNowPlaying(self, query):
+        """Send now playing state, 'version' query waits (long poll) for a newer state"""
+        import json #now playing
+        if not self._startNowPlaying(): return
+        if query.has_key('version'):
+            version = int(query.get('version')[0])
+            timeout = 30
+            if query.has_key('timeout'): timeout = min(300, float(query.get('timeout')[0]))
+            #Body ends when connection closes (HTTP/1.0)
+            connection = self._detachWaiting('application/json')
+            if connection == None: return
+            if not connection == False:
+                def reply(version, state):
+                    try:
+                        connection.sendall(json.dumps({'version': version, 'state': state}))
+                    except (IOError, socket.error):
+                        pass #Client disconnected
+                    connection.close()
+                self._parkWaiting(connection, version, timeout, reply)
+                return
+        #Waiting is not possible in async mode
+        version, state = self._nowPlaying.get()
+        self._sendJson({'version': version, 'state': state})
+
+    def _sendNowPlayingEvents(self):
+        """Send now playing state changes as server-sent events, until client disconnects"""
+        import json #now playing
+        if not self._startNowPlaying(): return
+        connection = self._detachWaiting('text/event-stream')
+        if connection == None: return
+        if connection == False:
+            self.send_error(501, 'Events need threaded mode')
+            return
+        nowPlaying = self._nowPlaying
+        def send(known):
+            """Get callback sending the next event or keep-alive"""
+            def event(version, state):
+                try:
+                    if nowPlaying.isStopped(): raise IOError('Server shutdown')
+                    if version == known: connection.sendall(': keep-alive\n\n')
+                    else: connection.sendall('id: %d\ndata: %s\n\n' % (version, json.dumps(state)))
+                except (IOError, socket.error):
+                    connection.close() #Client disconnected
+                    return
+                nowPlaying.park(version, 15, send(version))
+            return event
+        self._parkWaiting(connection, None, 0, send(None))
+
+    def _sendCommand(self, query):
+        """Run command of query ('id' and 'arg' values) and send its job"""
+        if not query.has_key('id'):
+            self.send_response(400, 'No command id')
+            return
+        id = query.get('id')[0]
+        if id == 'shutdown':
+            self.send_response(204)
+            print 'shutdown requested...'
+            self.server.requestShutdown()
+            return
+        if not self._config.isCommand(id):
+            self.send_response(405, id + ' is not supported')
+            return
+        #Handle command
+        try:
+            job = self._runCommand(id, query)
+        except:
+            self.send_response(424)
+            return
+        if job == None:
+            self.send_response(409, id + ' is already running')
+            return
+        self.send_response(204)
+        self.send_header('X-Job-Id', str(job.getId()))
+        self.send_header('Location', '/jobs?id=' + str(job.getId()))
+        self.end_headers()
 
     def do_GET(self):
         """Handle get requests"""
         try:
             url = urlparse.urlparse(self.path)
             if url.path == '/command':
-                query = urlparse.parse_qs(url.query)
-                if not query.has_key('id'):
-                    self.send_response(400, 'No command id')
-                    return
-                id = query.get('id')[0]
-                if id == 'shutdown':
-                    self.send_response(204)
-                    print 'shutdown requested...'
-                    self.server.server_close()
-                    return
-                if not self._config.isCommand(id):
-                    self.send_response(405, id + ' is not supported')
-                    return
-                #Handle command
-                try:
-                    self._runCommand(id, query)
-                    self.send_response(204)
-                except:
-                    self.send_response(424)
-            elif url.path == '/' or url.path.endswith('.htm') or url.path.endswith('.html'):
-                path = curdir + sep
-                if not self._config.getDir() == None and len(self._config.getDir()) > 0:
-                    path += self._config.getDir() + sep
-                if url.path == '/':
-                    path += 'index.html'
-                else:
-                    path += url.path[1:]
-                f = open(path)
-                #Response and headers
+                self._sendCommand(urlparse.parse_qs(url.query))
+            elif url.path == '/nowplaying' and not self._nowPlaying == None:
+                self._sendNowPlaying(urlparse.parse_qs(url.query))
+            elif url.path == '/nowplaying/events' and not self._nowPlaying == None:
+                self._sendNowPlayingEvents()
+                return
+            elif url.path == '/metrics' and not self._metrics == None:
+                data = self._metrics.getText()
                 self.send_response(200)
-                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
                 self.end_headers()
-                #Write content
-                self.wfile.write(f.read())
-                f.close()
+                self.wfile.write(data)
+            elif url.path == '/jobs':
+                query = urlparse.parse_qs(url.query)
+                if query.has_key('id'):
+                    job = self._jobs.getJob(int(query.get('id')[0]))
+                    if job == None: raise KeyError()
+                    self._sendJson(job.getStatus())
+                else:
+                    self._sendJson([job.getStatus() for job in self._jobs.getJobs()])
+            elif url.path == '/' or url.path.endswith('.htm') or url.path.endswith('.html'):
+                path = url.path
+                if path == '/': path = '/index.html'
+                self._sendStatic(self._getPath(path), 'text/html')
+            elif not self._config.getMediaDir() == None and \
+                 url.path.startswith(self._config.getMediaPath() + '/'):
+                path = url.path[len(self._config.getMediaPath()):]
+                self._sendMedia(self._getPath(path, self._config.getMediaDir()))
+            elif self._isAsset(url.path):
+                self._sendMedia(self._getPath(url.path))
             else:
-                raise NotImplementedError()
+                self.send_error(404)
         except:
             self.send_error(404)
 
+    def do_HEAD(self):
+        """Handle head requests, same as get without content"""
+        self.do_GET()
+
     def do_POST(self):
-        """Handle post requests"""
-        pass
+        """Handle post requests, commands ('/command') take id and arguments from the url query
+        and a form (application/x-www-form-urlencoded) or a text body, which is split into
+        arguments same as an 'arg' value
+        """
+        try:
+            length = int(self.headers.getheader('Content-Length', '0'))
+        except ValueError:
+            self.send_error(400)
+            return
+        if length < 0 or length > WebServer.MAX_BODY:
+            self.send_error(413)
+            return
+        try:
+            body = self.rfile.read(length)
+            url = urlparse.urlparse(self.path)
+            if not url.path == '/command':
+                self.send_error(404)
+                return
+            query = urlparse.parse_qs(url.query)
+            contentType = self.headers.getheader('Content-Type', '').split(';')[0].strip().lower()
+            if contentType == 'application/x-www-form-urlencoded':
+                for name, values in urlparse.parse_qs(body).iteritems():
+                    query.setdefault(name, []).extend(values)
+            elif len(body.strip()) > 0:
+                query.setdefault('arg', []).append(body)
+            self._sendCommand(query)
+        except:
+            self.send_error(404)
 
     def log_message(self, format, *args):
         """Ignore log messages, otherwise written to screen"""
         return
 
-def webServerCreator(config):
-    """Web server with configuration argument creator """
-    return lambda *args: WebServer(config, *args)
+def webServerCreator(configFile, jobs, cache, nowPlaying = None, metrics = None):
+    """Web server with configuration (current of file), jobs, cache, now playing and metrics arguments creator """
+    return lambda *args: WebServer(configFile.get(), jobs, cache, nowPlaying, metrics, *args)
 
 #Main
 def main():
@@ -258,18 +2262,41 @@ def main():
     Main entry point
     """
     #Load configuration
-    config = Config()
-    if not config.load():
-        print 'Failed to load configuration, using default'
+    configFile = ConfigFile()
+    if not configFile.load():
+        print 'Failed to load configuration, using default: ' + configFile.getError()
+    config = configFile.get()
+    metrics = None
+    if config.getMetrics(): metrics = Metrics()
+    #Start warm worker before any thread
+    warm = None
+    if len(config.getEntries()) > 0:
+        warm = WarmWorker(config.getEntries(), metrics)
+        if not warm.start():
+            print 'Failed to start warm worker, entry points run in new processes'
+            warm = None
     #Start server
+    jobs = JobRunner(config.getJobWorkers(), config.getJobHistory(), config.getJobTail(), warm,
+                     metrics)
+    if config.getMode() == 'forking' and not jobs.serve():
+        print 'Failed to share jobs with request processes, commands are not available'
+    nowPlaying = None
+    if not config.getNowPlaying() == None: nowPlaying = NowPlaying(config.getNowPlaying(), metrics)
+    handler = webServerCreator(configFile, jobs, StaticCache(), nowPlaying, metrics)
+    server = createServer(config, handler)
     try:
-        handler = webServerCreator(config)
-        server = HTTPServer(('', config.getPort()), handler)
         print 'Starting server...'
         server.serve_forever()
     except KeyboardInterrupt:
-        print 'Shutting down server...'
-        server.socket.close()
+        pass
+    #Finish in-flight requests
+    print 'Shutting down server...'
+    #Waiting now playing clients must finish before drain
+    if not nowPlaying == None: nowPlaying.stop()
+    server.drain()
+    server.server_close()
+    jobs.stop()
+    if not warm == None: warm.stop()
 
 if __name__ == '__main__':
     main()
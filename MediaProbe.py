@@ -0,0 +1,405 @@
+"""
+My Popcorn Hour Library - Python - MediaProbe
+Reads video durations and resolutions from container headers, see MediaProbe
+Used by ShuffleThis.py time budget shuffles ('--budget'), kept out of it so
+other shuffles do not load it
+Note: copy this file next to ShuffleThis.py
+"""
+
+#Imports
+import os #Files
+import threading #Probing threads
+import Queue #Probing threads
+import marshal #Probe index
+import itertools #Probing chunks
+import mmap #Headers
+import struct #Headers
+
+#Classes
+class _FileView:
+    """Random access reads of a file, used when it can not be mapped
+       (e.g. files larger than the address space)
+    """
+    def __init__(self, f):
+        """Initialize view of opened file"""
+        self._file = f
+        f.seek(0, 2)
+        self._size = f.tell()
+
+    def __len__(self):
+        """Get file size"""
+        return self._size
+
+    def __getitem__(self, i):
+        """Read byte or slice of bytes"""
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._size)
+            if stop <= start: return ''
+            self._file.seek(start)
+            return self._file.read(stop - start)
+        if i < 0: i += self._size
+        self._file.seek(i)
+        data = self._file.read(1)
+        if len(data) == 0: raise IndexError('read beyond end of file')
+        return data
+
+    def close(self):
+        """Nothing to release, file is closed by its owner"""
+        pass
+
+class MediaProbe:
+    """Media metadata probe
+       Reads duration and resolution from container headers (mp4/mov, mkv/webm,
+       avi and flv) without decoding. Files are mapped (mmap) and only the header
+       boxes, chunks or elements are touched, skipping over media data, so a probe
+       costs a few page reads however large the file. Files are probed by a pool
+       of threads and results are cached by path, mtime and size, later runs only
+       probe new or changed files
+    """
+    VERSION = 1
+
+    def __init__(self, indexPath = None, workers = 4):
+        """Initialize probe
+
+        Args:
+            indexPath: Probe index file path, None to disable caching
+            workers: Number of probing threads
+        """
+        self._path = indexPath
+        self._workers = max(1, workers)
+        self._entries = {} #path -> (mtime, size, duration, width, height)
+        self._changed = False
+        self._selected = (0, 0.0)
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load probe index
+
+        Returns: True if loaded otherwise False
+        """
+        if self._path == None: return False
+        try:
+            f = open(self._path, 'rb')
+            try:
+                data = marshal.load(f)
+            finally:
+                f.close()
+            if data[0] <> MediaProbe.VERSION: return False
+            self._entries = data[1]
+            return True
+        except (IOError, EOFError, ValueError, TypeError, IndexError):
+            return False
+
+    def save(self):
+        """Save probe index if files were probed, replacing the previous index atomically
+
+        Returns: True if saved (or nothing changed) otherwise False
+        """
+        if self._path == None or not self._changed: return True
+        temp = self._path + '.tmp'
+        try:
+            indexDir = os.path.dirname(self._path)
+            if len(indexDir) > 0 and not os.path.isdir(indexDir): os.makedirs(indexDir)
+            with self._lock:
+                f = open(temp, 'wb')
+                try:
+                    marshal.dump((MediaProbe.VERSION, self._entries), f)
+                finally:
+                    f.close()
+            os.rename(temp, self._path)
+            self._changed = False
+            return True
+        except (IOError, OSError):
+            return False
+
+    def __len__(self):
+        """Get number of indexed files"""
+        return len(self._entries)
+
+    def probe(self, path):
+        """Get file metadata, from index if the file did not change
+
+        Args:
+            path: Local file path (urls are not probed)
+
+        Returns: Dictionary of size (bytes), duration (seconds), width and height,
+                 unknown values are None, or None if file is missing
+        """
+        if path.startswith('file://'): path = path[len('file://'):]
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError, ValueError):
+            return
+        entry = self._entries.get(path)
+        if entry == None or entry[0] <> stat.st_mtime or entry[1] <> stat.st_size:
+            duration, width, height = self.readHeader(path)
+            entry = (stat.st_mtime, stat.st_size, duration, width, height)
+            with self._lock:
+                self._entries[path] = entry
+                self._changed = True
+        return {'size': entry[1], 'duration': entry[2], 'width': entry[3], 'height': entry[4]}
+
+    def readHeader(self, path):
+        """Read container header
+
+        Args:
+            path: Local file path
+
+        Returns: Tuple of duration (seconds), width and height, unknown values are None
+        """
+        unknown = (None, None, None)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return unknown
+        try:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            except (mmap.error, ValueError, OverflowError):
+                #Empty or too large to map
+                data = _FileView(f)
+            try:
+                magic = data[0:12]
+                if magic.startswith('\x1a\x45\xdf\xa3'): return self.__probeMkv(data)
+                if magic.startswith('RIFF') and magic[8:12] == 'AVI ': return self.__probeAvi(data)
+                if magic.startswith('FLV'): return self.__probeFlv(data)
+                if magic[4:8] in ('ftyp', 'moov', 'mdat', 'free', 'skip', 'wide'):
+                    return self.__probeMp4(data)
+                return unknown
+            finally:
+                data.close()
+        except (IOError, ValueError, IndexError, OverflowError, struct.error):
+            #Truncated or corrupted header
+            return unknown
+        finally:
+            f.close()
+
+    def __boxes(self, data, start, end):
+        """Generate mp4 boxes (kind, data start, data end) between offsets"""
+        pos = start
+        while pos + 8 <= end:
+            size, kind = struct.unpack('>I4s', data[pos:pos + 8])
+            header = 8
+            if size == 1:
+                size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+                header = 16
+            elif size == 0:
+                size = end - pos #Box extends to end of file
+            if size < header: return
+            yield (kind, pos + header, min(pos + size, end))
+            pos += size
+
+    def __findBox(self, data, start, end, kind):
+        """Get (data start, data end) of first box of kind or None"""
+        for current, begin, stop in self.__boxes(data, start, end):
+            if current == kind: return (begin, stop)
+
+    def __probeMp4(self, data):
+        """Read mp4/mov movie header (moov/mvhd) and first visual track header (trak/tkhd)"""
+        duration = width = height = None
+        moov = self.__findBox(data, 0, len(data), 'moov')
+        if moov == None: return (None, None, None)
+        for kind, start, end in self.__boxes(data, moov[0], moov[1]):
+            if kind == 'mvhd':
+                if ord(data[start]) == 1: scale, length = struct.unpack('>IQ', data[start + 20:start + 32])
+                else: scale, length = struct.unpack('>II', data[start + 12:start + 20])
+                if scale > 0: duration = float(length) / scale
+            elif kind == 'trak' and width == None:
+                tkhd = self.__findBox(data, start, end, 'tkhd')
+                if tkhd == None: continue
+                offset = 76 #Width and height (16.16 fixed point) after version 0 times
+                if ord(data[tkhd[0]]) == 1: offset = 88
+                w, h = struct.unpack('>II', data[tkhd[0] + offset:tkhd[0] + offset + 8])
+                if w > 0 and h > 0: width, height = w >> 16, h >> 16
+        return (duration, width, height)
+
+    def __vint(self, data, pos, marker):
+        """Read EBML variable size integer
+
+        Args:
+            data: File data
+            pos: Integer offset
+            marker: Keep length marker bits (element ids) or strip them (sizes)
+
+        Returns: Tuple of value (None for unknown size) and next offset
+        """
+        first = ord(data[pos])
+        mask = 0x80
+        length = 1
+        while length <= 8 and not first & mask:
+            mask >>= 1
+            length += 1
+        if length > 8: raise ValueError('invalid EBML integer')
+        value = first
+        if not marker: value = first & (mask - 1)
+        for byte in data[pos + 1:pos + length]:
+            value = (value << 8) | ord(byte)
+        if not marker and value == (1 << (7 * length)) - 1: value = None
+        return (value, pos + length)
+
+    def __elements(self, data, start, end):
+        """Generate EBML elements (id, data start, data end) between offsets"""
+        pos = start
+        while pos < end:
+            id, pos = self.__vint(data, pos, True)
+            size, pos = self.__vint(data, pos, False)
+            stop = end #Unknown size extends to its parent end
+            if not size == None: stop = min(pos + size, end)
+            yield (id, pos, stop)
+            pos = stop
+
+    def __uint(self, data):
+        """Decode big endian unsigned integer"""
+        value = 0
+        for byte in data:
+            value = (value << 8) | ord(byte)
+        return value
+
+    def __probeMkv(self, data):
+        """Read mkv/webm segment info and first video track, stops at first cluster"""
+        scale = 1000000 #Default timecode scale, nanoseconds
+        length = width = None
+        height = None
+        for id, start, end in self.__elements(data, 0, len(data)):
+            if id == 0x18538067: break #Segment
+        else:
+            return (None, None, None)
+        for id, begin, stop in self.__elements(data, start, end):
+            if id == 0x1549A966: #Info
+                for child, s, e in self.__elements(data, begin, stop):
+                    if child == 0x2AD7B1: scale = self.__uint(data[s:e]) #TimecodeScale
+                    elif child == 0x4489: #Duration
+                        if e - s == 4: length = struct.unpack('>f', data[s:e])[0]
+                        else: length = struct.unpack('>d', data[s:e])[0]
+            elif id == 0x1654AE6B and width == None: #Tracks
+                for entry, s, e in self.__elements(data, begin, stop):
+                    if not entry == 0xAE or not width == None: continue #TrackEntry
+                    for child, vs, ve in self.__elements(data, s, e):
+                        if not child == 0xE0: continue #Video
+                        for item, ps, pe in self.__elements(data, vs, ve):
+                            if item == 0xB0: width = self.__uint(data[ps:pe]) #PixelWidth
+                            elif item == 0xBA: height = self.__uint(data[ps:pe]) #PixelHeight
+            elif id == 0x1F43B675: #Cluster, media data follows headers
+                break
+            if not length == None and not width == None: break
+        duration = None
+        if not length == None: duration = length * scale / 1000000000.0
+        return (duration, width, height)
+
+    def __chunks(self, data, start, end):
+        """Generate RIFF chunks (kind, data start, data end) between offsets, lists are
+        generated by their list type"""
+        pos = start
+        while pos + 8 <= end:
+            kind, size = struct.unpack('<4sI', data[pos:pos + 8])
+            if kind == 'LIST': yield (data[pos + 8:pos + 12], pos + 12, min(pos + 8 + size, end))
+            else: yield (kind, pos + 8, min(pos + 8 + size, end))
+            pos += 8 + size + (size & 1)
+
+    def __probeAvi(self, data):
+        """Read avi main header (hdrl/avih), OpenDML total frames (odml/dmlh) if present"""
+        for kind, start, end in self.__chunks(data, 12, len(data)):
+            if kind == 'movi': break #Media data follows headers
+            if not kind == 'hdrl': continue
+            duration = width = height = None
+            frameTime = frames = 0
+            for child, s, e in self.__chunks(data, start, end):
+                if child == 'avih':
+                    frameTime, frames = struct.unpack('<I12xI', data[s:s + 20])
+                    width, height = struct.unpack('<II', data[s + 32:s + 40])
+                elif child == 'odml':
+                    #Files above 1GB, main header counts only first RIFF frames
+                    dmlh = [(ds, de) for item, ds, de in self.__chunks(data, s, e) if item == 'dmlh']
+                    if len(dmlh) > 0: frames = struct.unpack('<I', data[dmlh[0][0]:dmlh[0][0] + 4])[0]
+            if frameTime > 0 and frames > 0: duration = frames * frameTime / 1000000.0
+            if width == 0 or height == 0: width = height = None
+            return (duration, width, height)
+        return (None, None, None)
+
+    def __probeFlv(self, data):
+        """Read flv onMetaData script tag values"""
+        offset = struct.unpack('>I', data[5:9])[0] + 4 #Header and first previous tag size
+        tag = data[offset:offset + 11]
+        if not ord(tag[0]) == 18: return (None, None, None) #Script data tag
+        size = struct.unpack('>I', '\0' + tag[1:4])[0]
+        meta = data[offset + 11:offset + 11 + size]
+        values = []
+        for key in ('duration', 'width', 'height'):
+            #AMF0 property name followed by number marker
+            name = struct.pack('>H', len(key)) + key + '\0'
+            i = meta.find(name)
+            value = None
+            if i >= 0:
+                value = struct.unpack('>d', meta[i + len(name):i + len(name) + 8])[0]
+                if value <= 0: value = None
+            values.append(value)
+        duration, width, height = values
+        if not width == None: width = int(width)
+        if not height == None: height = int(height)
+        return (duration, width, height)
+
+    def __work(self, pending, files, results):
+        """Probing thread loop, stops when no files are pending"""
+        while True:
+            try:
+                i = pending.get_nowait()
+            except Queue.Empty:
+                return
+            results[i] = self.probe(files[i])
+
+    def iterProbe(self, files, chunkSize = 64):
+        """Probe files in parallel, results are generated in files order
+
+        Args:
+            files: Files iterable
+            chunkSize: Number of files probed together, files are consumed a chunk at a time
+
+        Returns: Generator of (file, metadata or None) tuples, see probe
+        """
+        files = iter(files)
+        while True:
+            chunk = list(itertools.islice(files, chunkSize))
+            if len(chunk) == 0: return
+            results = [None] * len(chunk)
+            pending = Queue.Queue()
+            for i in range(len(chunk)):
+                pending.put(i)
+            threads = []
+            for i in range(min(self._workers, len(chunk))):
+                thread = threading.Thread(target = self.__work, args = (pending, chunk, results))
+                thread.setDaemon(True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            for i in range(len(chunk)):
+                yield (chunk[i], results[i])
+
+    def getSelected(self):
+        """Get files count and total seconds selected by last selectBudget"""
+        return self._selected
+
+    def selectBudget(self, files, seconds, tolerance = None):
+        """Select files in order until their total duration fills a time budget
+        Files which do not fit the remaining time or have an unknown duration are skipped,
+        files are probed only until the budget is filled
+
+        Args:
+            files: Files iterable, already shuffled
+            seconds: Time budget
+            tolerance: Seconds left unfilled to stop at, by default 5% of budget (at least a minute)
+
+        Returns: Generator of selected files
+        """
+        if tolerance == None: tolerance = max(60.0, seconds * 0.05)
+        count = 0
+        total = 0.0
+        self._selected = (0, 0.0)
+        for file, info in self.iterProbe(files):
+            if seconds - total <= tolerance: break
+            if info == None or info['duration'] == None: continue
+            if total + info['duration'] <= seconds:
+                count += 1
+                total += info['duration']
+                self._selected = (count, total)
+                yield file
@@ -4,11 +4,29 @@ Given a local directory, extract videos and plays video in shuffled (random) ord
 Note: this must run form the popcorn hour device itself
 
 Run example: 
-- Copy this file to internal hard-drive/usb stick
+- Copy this file (and MediaProbe.py for '--budget') to internal hard-drive/usb stick
 - telent to the device
 - 'cd' to script directory
 - run 'python ShuffleThis.py [directory]'
   where the [directory] is your video directory on the device
+- run 'python -c "import ShuffleThis; ShuffleThis.main()" [directory]'
+  same as above but starts quicker, the compiled module (.pyc) is loaded instead of
+  compiling the script on every run (LittleServer entry commands run this way)
+- run 'python ShuffleThis.py --exclude "*sample*" --exclude extras --min-size 1000000 [directory]'
+  to skip sample and extras files and directories and files smaller than 1MB
+  (formats default to the device supported video formats, see --formats)
+- run 'python ShuffleThis.py [playlist]'
+  to shuffle the files (and http urls) of a m3u, m3u8 or pls playlist
+- run 'python ShuffleThis.py --index [index directory] [directory]'
+  to keep a media index, rescans only list directories which changed since last run
+  use '--rebuild' to force a full scan
+- run 'python ShuffleThis.py --stream [directory]'
+  to start playing while the directory is still searched
+- run 'python ShuffleThis.py --window 10 [directory]'
+  to keep only 10 files queued, the script keeps running and tops up the queue
+- run 'python ShuffleThis.py --budget 2h --index [index directory] [directory]'
+  to play about 2 hours of shuffled files, durations are read from file headers
+  and cached in the index directory, so later runs only read new files
 
 Disclaimer:
 The code is free to use and modify.
@@ -24,14 +42,100 @@ Date:   03/08/2013 (03-AUG-2013)
 """
 
 # Imports
+#Modules used only by some code paths (device API replies, arguments, shuffles,
+#media index, files filter, play history) are imported where used, so a run loads
+#only what it needs. AsyncTheDavidBox (AsyncDavidBox.py) and MediaProbe (MediaProbe.py)
+#are modules of their own
 import sys #prints
 import os #directory
-import httplib #TheDavidBox
-import urllib  #TheDavidBox
-from xml.dom.minidom import parseString #TheDavidBox
-from random import shuffle #Shuffle
+import threading #TheDavidBox bulk enqueue
+import Queue #TheDavidBox bulk enqueue
+import socket #API errors
+from collections import deque #Rolling queue
+import marshal #Media index
+import time #Media index
+import itertools #Streaming shuffle
+from array import array #Compact file set
+try:
+    from scandir import scandir #Optional faster directory listing (scandir package)
+except ImportError:
+    scandir = None
+
+#Optional metrics recorder, see setMetrics
+_metrics = None
 
 #Classes
+class ApiReply(object):
+    """TheDavidBox API reply
+       Extracts return value and response items of the xml reply in a single
+       (expat) pass, without building a document tree
+    """
+    def __init__(self, data):
+        """Decode reply
+
+        Args:
+            data: Xml response data of API request
+        """
+        self._returnValue = None
+        self._hasResponse = False
+        self._items = [] #Response items (name, text)
+        self._depth = 0
+        self._responseDepth = None #Depth of response node while inside it
+        self._name = None #Collected node name
+        self._text = None #Collected node text
+        from xml.parsers.expat import ParserCreate #Replies only
+        parser = ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.__start
+        parser.EndElementHandler = self.__end
+        parser.CharacterDataHandler = self.__data
+        parser.Parse(data, True)
+
+    def __start(self, name, attributes):
+        """Element start handler"""
+        self._depth += 1
+        if not self._responseDepth == None:
+            if self._depth == self._responseDepth + 1:
+                self._name = name
+                self._text = []
+        elif name == 'response' and not self._hasResponse:
+            self._hasResponse = True
+            self._responseDepth = self._depth
+        elif name == 'returnValue' and self._returnValue == None:
+            self._name = name
+            self._text = []
+
+    def __data(self, data):
+        """Character data handler"""
+        if not self._text == None: self._text.append(data)
+
+    def __end(self, name):
+        """Element end handler"""
+        if not self._text == None and name == self._name:
+            text = ''.join(self._text)
+            self._text = None
+            if self._responseDepth == None:
+                try:
+                    self._returnValue = int(text)
+                except ValueError:
+                    pass
+            else:
+                self._items.append((name, text))
+        if self._depth == self._responseDepth: self._responseDepth = None
+        self._depth -= 1
+
+    def getReturnValue(self):
+        """Get return value or None if missing"""
+        return self._returnValue
+
+    def getItems(self):
+        """Get response items if return value is valid
+
+        Returns: List of (name, text) of response nodes or None if error
+        """
+        if not self._returnValue == 0 or not self._hasResponse: return
+        return self._items
+
 #TODO move TheDavidBox api to file/package (+imports)
 class TheDavidBox(object):
     """TheDavidBox (partial) API python implementation
@@ -41,13 +145,31 @@ class TheDavidBox(object):
 
     def __init__(self, host = '127.0.0.1', port = '8008'):
         """Initialize API"""
+        import httplib #API only
+        self._host = host
+        self._port = port
         self._conn = httplib.HTTPConnection(host + ':' + port)
+        self._poolRequests = None #Enqueue pool requests, created on first use
+        self._poolWorkers = [] #Enqueue pool threads, each on its own keep-alive connection
        
     def close(self):
-        """ Close API connection """
+        """ Close API connection and enqueue pool connections """
         if not self._conn == None:
             self._conn.close()
             self._conn = None
+        if not self._poolRequests == None:
+            for worker in self._poolWorkers:
+                self._poolRequests.put(None) #Stop worker
+            for worker in self._poolWorkers:
+                worker.join()
+            self._poolRequests = None
+            self._poolWorkers = []
+
+    def reconnect(self):
+        """Drop API connection after an error, next call opens a new one"""
+        import httplib #API only
+        if not self._conn == None: self._conn.close()
+        self._conn = httplib.HTTPConnection(self._host + ':' + self._port)
 
     def __api(self, paramString):
         """ Call API with arguments
@@ -66,43 +188,39 @@ class TheDavidBox(object):
             data = response.read()
         return (response.status, response.reason, data);
 
-    def __extractReturnValue(self, data):
-        """Extract return value
+    def _invoke(self, paramString, decoder):
+        """Call API and decode response
 
         Args:
-            data: ml response data of API request
+            paramString: Parameters string
+            decoder: Function of response data (None on error) returning the result
 
-        Returns: Return value of None on error
+        Returns: Decoded result
         """
-        if data == None: return
-        root = parseString(data)
-        #Extract return value
-        retValue = root.getElementsByTagName('returnValue')
-        if retValue == None or len(retValue) == 0: return
-        retValue = retValue[0].firstChild
-        return int(retValue.data)
+        data = self.__api(paramString)
+        if not data == None: data = data[2]
+        return decoder(data)
+
+    def __extractSuccess(self, data):
+        """Extract whether return value is success
+
+        Args:
+            data: Xml response data of API request
+
+        Returns: True if return value is 0 otherwise False
+        """
+        return self.__extractReturnValue(data) == 0
 
-    def __extractResponse(self, data):
-        """Extract response node if return value is valid
+    def __extractReturnValue(self, data):
+        """Extract return value
 
         Args:
             data: Xml response data of API request
 
-        Returns: Response nodes or None if error
+        Returns: Return value of None on error
         """
         if data == None: return
-        root = parseString(data)
-        #Extract return value
-        retValue = root.getElementsByTagName('returnValue')
-        if retValue == None or len(retValue) == 0: return
-        retValue = retValue[0].firstChild
-        retValue = int(retValue.data)
-        if retValue <> 0: return
-        #Extract response
-        response = root.getElementsByTagName('response')
-        if response == None or len(response) == 0: return
-        response = response[0]
-        return response.childNodes
+        return ApiReply(data).getReturnValue()
 
     def __extractDictionary(self, data):
         """Extract API response into a dictionary
@@ -111,12 +229,10 @@ class TheDavidBox(object):
 
         Returns: Response as dictionary or None if error
         """
-        data = self.__extractResponse(data)
         if data == None: return
-        result = {}
-        for node in data:
-            result[node.nodeName] = node.firstChild.data
-        return result
+        items = ApiReply(data).getItems()
+        if items == None: return
+        return dict(items)
 
     def __extractList(self, data):
         """Extract API response into values list
@@ -125,23 +241,23 @@ class TheDavidBox(object):
 
         Returns: Response as list or None if error
         """
-        data = self.__extractResponse(data)
         if data == None: return
-        result = []
-        for node in data:
-            result.append(node.firstChild.data)
-        return result
+        items = ApiReply(data).getItems()
+        if items == None: return
+        return [item[1] for item in items]
 
-    def __call(self, module, function, args = []):
+    def __call(self, module, function, args, decoder):
         """Call API
 
         Args:
             module: API module
             function: API module function
             Args: API module function arguments
+            decoder: Response decoder, see _invoke
 
-        Returns: Same as __call(self, paramString)
+        Returns: Same as _invoke(self, paramString, decoder)
         """
+        import urllib #API only
         params = []
         params.append(module);
         params.append('?arg0=' + urllib.quote(function));
@@ -149,18 +265,44 @@ class TheDavidBox(object):
         for arg in args:
             i += 1
             params.append('&arg' + str(i) + '=' + urllib.quote(arg)); #TODO support better concat
-        return self.__api(''.join(params))
+        if _metrics == None: return self._invoke(''.join(params), decoder)
+        return self.__measure(_metrics, module, function, ''.join(params), decoder)
+
+    def __measure(self, metrics, module, function, paramString, decoder):
+        """Call API and record its latency and errors, see setMetrics.
+           A decoded result of None or False (failed request or return value) is an error
 
-    def __system(self, function, args = []):
+        Returns: Same as _invoke(self, paramString, decoder)
+        """
+        labels = (('module', module), ('function', function))
+        start = time.time()
+        try:
+            result = self._invoke(paramString, decoder)
+        except:
+            metrics.record('shufflethis_api_seconds', labels, time.time() - start, True)
+            raise
+        if isinstance(result, ApiRequest):
+            #Asynchronous call is measured until reply arrives
+            result.addCallback(lambda request: metrics.record(
+                'shufflethis_api_seconds', labels, time.time() - start,
+                not request.getError() == None or request.getResult() == None or
+                request.getResult() is False))
+        else:
+            metrics.record('shufflethis_api_seconds', labels, time.time() - start,
+                           result == None or result is False)
+        return result
+
+    def __system(self, function, args, decoder):
         """Call system module function
 
         Args:
            function: System function
-           Args: System function (optional) arguments 
+           Args: System function arguments
+           decoder: Response decoder, see _invoke
 
-        Returns: Same as __call(self, paramString)
+        Returns: Same as _invoke(self, paramString, decoder)
         """
-        return self.__call('system', function, args)
+        return self.__call('system', function, args, decoder)
 
     def __sendKey(self, key, data = None):
         """Send key to system
@@ -168,23 +310,24 @@ class TheDavidBox(object):
         Args:
            Key to send
 
-        Returns: Same as __call(self, paramString)
+        Returns: True if key sent otherwise False
         """
         args = []
         args.append(key)
         if not data == None: args.append(data)
-        return self.__system('send_key', args)
+        return self.__system('send_key', args, self.__extractSuccess)
 
-    def __playback(self, function, args = []):
+    def __playback(self, function, args, decoder):
         """Call playback module function
 
         Args:
            function: Playback function
-            Args: Playback function (optional) arguments 
+           Args: Playback function arguments
+           decoder: Response decoder, see _invoke
 
-        Returns: Same as __call(self, paramString)
+        Returns: Same as _invoke(self, paramString, decoder)
         """
-        return self.__call('playback', function, args)
+        return self.__call('playback', function, args, decoder)
 
     def getPlayInfo(self):
         """Get currently playing video info
@@ -192,10 +335,7 @@ class TheDavidBox(object):
         Returns: Currently played data (dictionary) or None if error or no file playing
                  Important Keys: 'title', 'fullPath', 'currentStatus', 'currentTime', 'totalTime'
         """
-        data = self.__playback('get_current_vod_info')
-        if not data == None:
-            data = self.__extractDictionary(data[2])
-        return data
+        return self.__playback('get_current_vod_info', [], self.__extractDictionary)
 
     def play(self, path, title = None):
         """Play video file
@@ -224,10 +364,7 @@ class TheDavidBox(object):
         if cache: args.append('enable') 
         else: args.append('disable')
         #Call API
-        data = self.__playback('start_vod', args)
-        if not data == None:
-            data = self.__extractReturnValue(data[2])
-        return data == 0
+        return self.__playback('start_vod', args, self.__extractSuccess)
 
     def enqueue(self, path, title = None):
         """Play video file
@@ -251,60 +388,136 @@ class TheDavidBox(object):
         args.append('show') #Show video
         args.append('start_zero') #No skip
         #Call API
-        data = self.__playback('insert_vod_queue', args)
-        if not data == None:
-            data = self.__extractReturnValue(data[2])
-        return data == 0
+        return self.__playback('insert_vod_queue', args, self.__extractSuccess)
+
+    def enqueueMany(self, paths, titles = None, connections = 4, ordered = True):
+        """Enqueue many video files
+
+        Args:
+            paths: Video files full paths to enqueue
+            titles: Optional titles list, same length as paths
+            connections: Maximum number of concurrent keep-alive connections
+            ordered: Keep device queue in paths order.
+                     The device appends items as requests arrive, so ordered
+                     requests are sent one after the other on this API connection.
+                     Unordered requests (e.g. already shuffled list) are spread
+                     over a pool of connections
+
+        Returns: List of booleans, True for each path enqueued (same order as paths)
+        """
+        import httplib #API only
+        count = len(paths)
+        results = [False] * count
+        if titles == None: titles = [None] * count
+        if ordered or connections <= 1 or count <= 1:
+            for i in range(count):
+                try:
+                    results[i] = self.enqueue(paths[i], titles[i])
+                except (httplib.HTTPException, IOError):
+                    #Connection dropped, reconnect and continue
+                    self.reconnect()
+            return results
+        #Unordered, spread over connections pool
+        for i in range(count):
+            self.enqueueLater(paths[i], titles[i], lambda result, i = i: results.__setitem__(i, result),
+                              connections)
+        self.waitPending()
+        return results
+
+    def enqueueLater(self, path, title = None, done = None, connections = 4):
+        """Enqueue a video file on the enqueue pool without waiting.
+           The pool connections stay open until close, so files can be fed
+           as they are generated. The device appends items as requests arrive,
+           so the queue order of files enqueued this way is not kept
+
+        Args:
+            path: Video file full path to enqueue
+            title: Optional title
+            done: Optional function of the enqueue result, called from a pool thread
+            connections: Number of pool connections, used when the pool is created
+
+        Returns: None
+        """
+        if self._poolRequests == None:
+            self._poolRequests = Queue.Queue()
+            for i in range(max(connections, 1)):
+                worker = threading.Thread(target = self.__enqueueWorker, args = (self._poolRequests,))
+                worker.setDaemon(True)
+                worker.start()
+                self._poolWorkers.append(worker)
+        self._poolRequests.put((path, title, done))
+
+    def waitPending(self):
+        """Wait until all files passed to enqueueLater were sent
+
+        Returns: None
+        """
+        if not self._poolRequests == None:
+            self._poolRequests.join()
+
+    def __enqueueWorker(self, pending):
+        """Enqueue pending files on a dedicated keep-alive connection until stopped
+
+        Args:
+            pending: Queue of (path, title, done) items, None stops the worker
+        """
+        import httplib #API only
+        api = TheDavidBox(self._host, self._port)
+        try:
+            while True:
+                item = pending.get()
+                if item == None:
+                    pending.task_done()
+                    return
+                path, title, done = item
+                result = False
+                try:
+                    result = api.enqueue(path, title)
+                except (httplib.HTTPException, IOError):
+                    #Connection dropped, reconnect and continue
+                    api.close()
+                    api = TheDavidBox(self._host, self._port)
+                try:
+                    if not done == None: done(result)
+                finally:
+                    pending.task_done()
+        finally:
+            api.close()
 
     def resume(self):
         """Resume currently played file
 
         Returns: True if resumed otherwise False
         """
-        data = self.__playback('resume_vod')
-        if not data == None:
-            data = self.__extractReturnValue(data[2])
-        return data == 0
+        return self.__playback('resume_vod', [], self.__extractSuccess)
 
     def pause(self):
         """Pause currently played file
 
         Returns: True if pause otherwise False
         """
-        data = self.__playback('pause_vod')
-        if not data == None:
-            data = self.__extractReturnValue(data[2])
-        return data == 0
+        return self.__playback('pause_vod', [], self.__extractSuccess)
 
     def stop(self):
         """Stop playback
 
         Returns: True if stopped otherwise False
         """
-        data = self.__playback('stop_vod')
-        if not data == None:
-            data = self.__extractReturnValue(data[2])
-        return data == 0
+        return self.__playback('stop_vod', [], self.__extractSuccess)
 
     def next(self):
         """Play next item in queue
 
         Returns: True if playing next otherwise False
         """
-        data = self.__sendKey('next')
-        if not data == None:
-            data = self.__extractReturnValue(data[2])
-        return data == 0
+        return self.__sendKey('next')
 
     def previous(self):
         """Play previous item in queue
 
         Returns: True if playing next otherwise False
         """
-        data = self.__sendKey('prev')
-        if not data == None:
-            data = self.__extractReturnValue(data[2])
-        return data == 0
+        return self.__sendKey('prev')
 
     def getKeys(self):
         """Get list of available system keys
@@ -312,10 +525,7 @@ class TheDavidBox(object):
 
         Returns: List of available keys or None on error
         """
-        data = self.__system('list_key')
-        if not data == None:
-            data = self.__extractList(data[2])
-        return data
+        return self.__system('list_key', [], self.__extractList)
 
     def sendKey(self, key):
         """Send key to system
@@ -325,83 +535,1609 @@ class TheDavidBox(object):
 
         Returns: True if key snet otherwise False
         """
-        data = self.__sendKey(key)
-        if not data == None:
-            data = self.__extractReturnValue(data[2])
-        return data == 0
+        return self.__sendKey(key)
 
     def getSupportedVideoFormats(self):
         """Get supported video formats
 
         Returns: List of supported video formats or None on error
         """
-        data = self.__playback('list_vod_supported_format')
-        if not data == None:
-            data = self.__extractList(data[2])
-        return data
+        return self.__playback('list_vod_supported_format', [], self.__extractList)
+
+class ApiRequest(object):
+    """Pending AsyncTheDavidBox request
+       Result is set once the reply arrives, see AsyncDavidBox.AsyncTheDavidBox
+    """
+    def __init__(self, paramString, decoder):
+        """Initialize request
+
+        Args:
+            paramString: Parameters string
+            decoder: Response decoder, see TheDavidBox._invoke
+        """
+        self._paramString = paramString
+        self._decoder = decoder
+        self._done = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        self.deadline = None #Set when sent
+
+    def getParamString(self):
+        """Get request parameters string"""
+        return self._paramString
+
+    def isDone(self):
+        """Get whether reply (or error) arrived"""
+        return self._done
+
+    def getResult(self):
+        """Get decoded result, same as the TheDavidBox method result"""
+        return self._result
+
+    def getError(self):
+        """Get error (exception) or None if request succeeded"""
+        return self._error
+
+    def addCallback(self, callback):
+        """Add completion callback
+
+        Args:
+            callback: Function called with the request once done
+        """
+        if self._done: callback(self)
+        else: self._callbacks.append(callback)
+
+    def complete(self, data, error = None):
+        """Complete request
+
+        Args:
+            data: Xml response data or None on error
+            error: Optional error
+        """
+        if self._done: return
+        self._done = True
+        self._error = error
+        try:
+            self._result = self._decoder(data)
+        except Exception, e:
+            #Malformed response
+            self._error = e
+            self._result = self._decoder(None)
+        for callback in self._callbacks:
+            callback(self)
+        self._callbacks = None
+
+class MediaIndex:
+    """Persistent media index
+       Caches matching files of every directory under a root, keyed by root
+       directory and files filter. Directories which mtime did not change are
+       not listed again on rescan
+    """
+    VERSION = 1
+
+    def __init__(self, indexDir, root, key = ''):
+        """Initialize index
+
+        Args:
+            indexDir: Directory holding index files
+            root: Indexed root directory
+            key: Files filter key (see FileFilter.getKey), indexes are kept per filter
+        """
+        import hashlib #Index only
+        self._root = os.path.abspath(root)
+        key = self._root + '\0' + key
+        self._path = os.path.join(indexDir, hashlib.md5(key).hexdigest() + '.idx')
+        self._dirs = {} #Loaded entries: path -> (mtime, files, subs)
+        self._scanned = {} #Entries of current scan
+        self._created = 0
+
+    def getPath(self):
+        """Get index file path"""
+        return self._path
+
+    def getAge(self):
+        """Get index age in seconds or None if not loaded"""
+        if self._created == 0: return
+        return time.time() - self._created
+
+    def load(self):
+        """Load index from disk
+
+        Returns: True if loaded otherwise False
+        """
+        try:
+            f = open(self._path, 'rb')
+            try:
+                data = marshal.load(f)
+            finally:
+                f.close()
+            if data[0] <> MediaIndex.VERSION or data[1] <> self._root: return False
+            self._created = data[2]
+            self._dirs = data[3]
+            return True
+        except (IOError, EOFError, ValueError, TypeError, IndexError):
+            return False
+
+    def save(self):
+        """Save current scan to disk, replacing the previous index atomically
+
+        Returns: True if saved otherwise False
+        """
+        temp = self._path + '.tmp'
+        try:
+            indexDir = os.path.dirname(self._path)
+            if not os.path.isdir(indexDir): os.makedirs(indexDir)
+            f = open(temp, 'wb')
+            try:
+                marshal.dump((MediaIndex.VERSION, self._root, time.time(), self._scanned), f)
+            finally:
+                f.close()
+            os.rename(temp, self._path)
+            return True
+        except (IOError, OSError):
+            return False
+
+    def lookup(self, path, mtime):
+        """Get cached directory content if directory did not change
+
+        Args:
+            path: Directory path
+            mtime: Current directory modification time
+
+        Returns: Tuple of (files, subs) names or None if unknown or changed
+        """
+        entry = self._dirs.get(path)
+        if entry == None or entry[0] <> mtime: return
+        return (entry[1], entry[2])
+
+    def update(self, path, mtime, files, subs):
+        """Record directory content for current scan
+
+        Args:
+            path: Directory path
+            mtime: Directory modification time
+            files: Matching file names in directory
+            subs: Sub directory names
+        """
+        self._scanned[path] = (mtime, files, subs)
+
+    def getFiles(self):
+        """Get all files full paths of loaded index"""
+        list = []
+        for path, entry in self._dirs.iteritems():
+            for file in entry[1]:
+                list.append(os.path.join(path, file))
+        return list
+
+class FileFilter:
+    """Compiled files filter
+       Formats are kept as an extensions set and glob patterns are compiled into
+       a single regular expression, so checking a file does not depend on the
+       number of formats and patterns. Excluded directories are pruned by
+       DirectoryCrawler instead of filtering their files afterwards
+    """
+    def __init__(self, formats = None, include = None, exclude = None, minSize = 0):
+        """Initialize filter
+        Patterns are matched case insensitive against names, e.g. '*sample*' or 'extras'
+
+        Args:
+            formats: Formats (extensions) list or None for all files
+            include: Optional glob patterns list, file names must match one of them
+            exclude: Optional glob patterns list, matching files and directories are skipped
+            minSize: Minimum file size in bytes, 0 for any size
+        """
+        self._formats = None
+        if not formats == None:
+            self._formats = frozenset(['.' + format.lower().lstrip('.') for format in formats])
+        self._includePatterns = include or []
+        self._excludePatterns = exclude or []
+        self._include = self.__compile(self._includePatterns)
+        self._exclude = self.__compile(self._excludePatterns)
+        self._minSize = minSize
+
+    def __compile(self, patterns):
+        """Compile glob patterns into a single regular expression or None if empty"""
+        if len(patterns) == 0: return
+        import re, fnmatch #Patterns only
+        return re.compile('|'.join(['(?:%s)' % fnmatch.translate(pattern) for pattern in patterns]),
+                          re.IGNORECASE)
+
+    def getKey(self):
+        """Get filter key, same filters have the same key"""
+        key = '\0'.join(sorted(self._formats or []))
+        if len(self._includePatterns) > 0 or len(self._excludePatterns) > 0 or self._minSize > 0:
+            key += '\0include:%s\0exclude:%s\0size:%d' % ('|'.join(self._includePatterns),
+                                                         '|'.join(self._excludePatterns), self._minSize)
+        return key
+
+    def acceptFile(self, name, dir = None):
+        """Check whether file is accepted
+
+        Args:
+            name: File name
+            dir: File directory, minimum size is checked only if set
+
+        Returns: True if file is accepted otherwise False
+        """
+        if not self._formats == None:
+            i = name.rfind('.')
+            if i < 0 or not name[i:].lower() in self._formats: return False
+        if not self._include == None and self._include.match(name) == None: return False
+        if not self._exclude == None and not self._exclude.match(name) == None: return False
+        if self._minSize > 0 and not dir == None:
+            try:
+                if os.path.getsize(os.path.join(dir, name)) < self._minSize: return False
+            except OSError:
+                return False
+        return True
+
+    def acceptDirectory(self, name):
+        """Check whether directory is searched
+
+        Args:
+            name: Directory name
+
+        Returns: True if directory is not excluded otherwise False
+        """
+        return self._exclude == None or self._exclude.match(name) == None
+
+    def getFileAccept(self):
+        """Get files accept function (see DirectoryCrawler) or None if all files are accepted"""
+        if self._formats == None and self._include == None and self._exclude == None and \
+           self._minSize <= 0:
+            return
+        return self.acceptFile
+
+    def getDirectoryAccept(self):
+        """Get directories accept function (see DirectoryCrawler) or None if none is excluded"""
+        if self._exclude == None: return
+        return self.acceptDirectory
+
+class DirectoryCrawler:
+    """Parallel directory crawler
+       Directories are listed by a pool of threads, which hides per directory
+       latency of slow (usb/network) mounts. Read errors are collected per
+       directory instead of stopping the crawl
+    """
+    def __init__(self, accept = None, workers = 4, maxDepth = None, index = None, acceptDir = None):
+        """Initialize crawler
+
+        Args:
+            accept: Function of file name and directory returning whether file is collected,
+                    None for all files
+            workers: Number of listing threads
+            maxDepth: Maximum sub directory depth (0 for root only) or None for unlimited
+            index: Optional MediaIndex used for unchanged directories
+            acceptDir: Function of sub directory name returning whether it is crawled,
+                       None for all directories
+        """
+        self._accept = accept
+        self._acceptDir = acceptDir
+        self._workers = max(1, workers)
+        self._maxDepth = maxDepth
+        self._index = index
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def getErrors(self):
+        """Get errors of last crawl
+
+        Returns: List of (directory, error message) tuples
+        """
+        return self._errors
+
+    def listDirectory(self, path):
+        """List directory
+
+        Args:
+            path: Directory to list
+
+        Returns: Tuple of (files, subs) names, only accepted files and sub directories
+        """
+        files = []
+        subs = []
+        accept = self._accept
+        acceptDir = self._acceptDir
+        if not scandir == None:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    #Same as os.walk, do not follow linked directories
+                    if not entry.is_symlink() and (acceptDir == None or acceptDir(entry.name)):
+                        subs.append(entry.name)
+                elif accept == None or accept(entry.name, path):
+                    files.append(entry.name)
+        else:
+            for name in os.listdir(path):
+                full = os.path.join(path, name)
+                if os.path.isdir(full):
+                    if not os.path.islink(full) and (acceptDir == None or acceptDir(name)):
+                        subs.append(name)
+                elif accept == None or accept(name, path):
+                    files.append(name)
+        return (files, subs)
+
+    def __visit(self, path, depth, pending, result):
+        """Collect directory files and queue its sub directories
+
+        Args:
+            path: Directory to visit
+            depth: Directory depth
+            pending: Queue of directories to visit
+            result: Queue of accepted files lists
+        """
+        index = self._index
+        try:
+            mtime = os.stat(path).st_mtime
+            entry = None
+            if not index == None: entry = index.lookup(path, mtime)
+            if entry == None: entry = self.listDirectory(path)
+        except (OSError, IOError), e:
+            with self._lock:
+                self._errors.append((path, str(e)))
+            return
+        files, subs = entry
+        if not index == None: index.update(path, mtime, files, subs)
+        if len(files) > 0:
+            result.put([os.path.join(path, file) for file in files])
+        if self._maxDepth == None or depth < self._maxDepth:
+            for sub in subs:
+                pending.put((os.path.join(path, sub), depth + 1))
+
+    def __work(self, pending, result):
+        """Listing thread loop, stops on None item"""
+        while True:
+            item = pending.get()
+            try:
+                if item == None: return
+                self.__visit(item[0], item[1], pending, result)
+            finally:
+                pending.task_done()
+
+    def __wait(self, pending, threads, result):
+        """Wait for all directories, then stop threads and end result"""
+        pending.join()
+        for thread in threads:
+            pending.put(None)
+        for thread in threads:
+            thread.join()
+        result.put(None)
+
+    def iterCrawl(self, root):
+        """Crawl directory tree, files are generated while crawl continues
+
+        Args:
+            root: Root directory
+
+        Returns: Generator of accepted files full paths (in no particular order)
+        """
+        self._errors = []
+        result = Queue.Queue()
+        pending = Queue.Queue()
+        pending.put((root, 0))
+        threads = []
+        for i in range(self._workers):
+            thread = threading.Thread(target = self.__work, args = (pending, result))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        waiter = threading.Thread(target = self.__wait, args = (pending, threads, result))
+        waiter.setDaemon(True)
+        waiter.start()
+        while True:
+            files = result.get()
+            if files == None: break
+            for file in files:
+                yield file
+        waiter.join()
+
+    def crawl(self, root):
+        """Crawl directory tree
+
+        Args:
+            root: Root directory
+
+        Returns: List of accepted files full paths (in no particular order)
+        """
+        return list(self.iterCrawl(root))
+
+class FileSet:
+    """Compact files list for large libraries
+       Files are kept as a directory table and a single names buffer with
+       offsets, instead of a full path string per file. Shuffling shuffles an
+       index permutation and full paths are created only when files are read
+    """
+    def __init__(self, files = None):
+        """Initialize file set
+
+        Args:
+            files: Optional files iterable (e.g. fileRetriver.iterFiles)
+        """
+        self._dirs = [] #Directory table, with trailing separator
+        self._dirIndex = {} #Directory to table index
+        self._names = array('c') #File names buffer
+        self._offsets = array('I', [0]) #Name start offsets, last is buffer end
+        self._parents = array('I') #Directory index per file
+        self._order = None #Index permutation or None for added order
+        if not files == None: self.extend(files)
+
+    def add(self, file):
+        """Add file
+
+        Args:
+            file: File full path (or url), unicode paths are kept utf-8 encoded
+        """
+        if isinstance(file, unicode): file = file.encode('utf-8')
+        i = file.rfind('/') + 1
+        dir = file[:i]
+        parent = self._dirIndex.get(dir)
+        if parent == None:
+            parent = len(self._dirs)
+            self._dirs.append(dir)
+            self._dirIndex[dir] = parent
+        if not self._order == None: self._order.append(len(self._parents))
+        self._names.fromstring(file[i:])
+        self._offsets.append(len(self._names))
+        self._parents.append(parent)
+
+    def extend(self, files):
+        """Add files of iterable"""
+        for file in files:
+            self.add(file)
+
+    def shuffle(self, recent = None, exclude = False):
+        """Shuffle files order
+
+        Args:
+            recent: Optional function of file path returning whether file was
+                    recently played (e.g. PlayHistory.isRecent), such files are
+                    shuffled after all other files
+            exclude: Leave recently played files out, unless all files are recent
+        """
+        from random import shuffle #Shuffles only
+        self._order = array('I', xrange(len(self._parents)))
+        if not recent == None:
+            fresh = array('I')
+            played = array('I')
+            for i in self._order:
+                if recent(self.getFile(i)): played.append(i)
+                else: fresh.append(i)
+            if len(fresh) > 0 or not exclude:
+                shuffle(fresh)
+                if exclude: played = array('I')
+                shuffle(played)
+                self._order = fresh + played
+                return
+        shuffle(self._order)
+
+    def getFile(self, i):
+        """Get file full path
+
+        Args:
+            i: File position (in shuffled order once shuffled)
+        """
+        if not self._order == None: i = self._order[i]
+        name = self._names[self._offsets[i]:self._offsets[i + 1]].tostring()
+        return self._dirs[self._parents[i]] + name
+
+    def __getitem__(self, i):
+        """Get file full path, see getFile"""
+        if i < 0: i += len(self)
+        return self.getFile(i)
+
+    def __len__(self):
+        """Get number of files (without files left out by shuffle)"""
+        if not self._order == None: return len(self._order)
+        return len(self._parents)
+
+    def __iter__(self):
+        """Generate files full paths in order"""
+        for i in xrange(len(self)):
+            yield self.getFile(i)
+
+    def getState(self):
+        """Get compact state of strings and lists (e.g. for marshal), see setState"""
+        order = None
+        if not self._order == None: order = self._order.tostring()
+        return (self._dirs, self._names.tostring(), self._offsets.tostring(),
+                self._parents.tostring(), order)
+
+    def setState(self, state):
+        """Replace files with state of getState
+
+        Raises: ValueError if state is not valid
+        """
+        dirs, names, offsets, parents, order = state
+        self._dirs = list(dirs)
+        self._dirIndex = dict([(self._dirs[i], i) for i in range(len(self._dirs))])
+        self._names = array('c', names)
+        self._offsets = array('I')
+        self._offsets.fromstring(offsets)
+        self._parents = array('I')
+        self._parents.fromstring(parents)
+        self._order = None
+        if not order == None:
+            self._order = array('I')
+            self._order.fromstring(order)
+            if len(self._order) > len(self._parents): raise ValueError('Invalid order')
+        if len(self._offsets) <> len(self._parents) + 1: raise ValueError('Invalid offsets')
 
 class fileRetriver:
-    def __init__(self, supportedFormats = None):
-        """Initialize file retriver"""
-        if not supportedFormats == None:
-            for i in range(len(supportedFormats)):
-                format = supportedFormats[i].lower()
-                if not format.startswith('.'): format = '.' + format
-                supportedFormats[i] = format
-        self._formats = supportedFormats
+    PLAYLISTS = ('.m3u', '.m3u8', '.pls') #Playlist extensions
+
+    def __init__(self, supportedFormats = None, indexDir = None, indexMaxAge = 0, workers = 4,
+                 include = None, exclude = None, minSize = 0):
+        """Initialize file retriver
+
+        Args:
+            supportedFormats: Formats (extensions) list or None for all files
+            indexDir: Optional directory for persistent media index
+            indexMaxAge: Seconds in which a saved index is trusted without rescan
+            workers: Number of directory listing threads
+            include: Optional file name glob patterns, see FileFilter
+            exclude: Optional file and directory name glob patterns, see FileFilter
+            minSize: Minimum file size in bytes
+        """
+        self._filter = FileFilter(supportedFormats, include, exclude, minSize)
+        self._indexDir = indexDir
+        self._indexMaxAge = indexMaxAge
+        self._workers = workers
+        self._errors = []
 
     def shuffleList(self, list):
         """Shuffle list in place"""
+        from random import shuffle #Shuffles only
         shuffle(list)
 
-    def getFiles(self, dir, recursive = True):
+    def shuffleStream(self, files, bufferSize = None):
+        """Shuffle files stream
+
+        Args:
+            files: Files iterable (e.g. iterFiles)
+            bufferSize: Number of files held back for shuffling. When the
+                        buffer is full a random buffered file is generated, so
+                        files are generated while the stream continues but the
+                        order is only approximately random.
+                        None holds back all files for a uniform random order
+
+        Returns: Generator of shuffled files
+        """
+        from random import shuffle, randrange #Shuffles only
+        buffer = []
+        for file in files:
+            if bufferSize == None or len(buffer) < bufferSize:
+                buffer.append(file)
+            else:
+                i = randrange(bufferSize)
+                yield buffer[i]
+                buffer[i] = file
+        shuffle(buffer)
+        for file in buffer:
+            yield file
+
+    def deferRecent(self, files, recent, exclude = False):
+        """Move recently played files of stream to its end
+
+        Args:
+            files: Files iterable (e.g. iterFiles)
+            recent: Function of file path returning whether file was recently played
+            exclude: Leave recently played files out, unless all files are recent
+
+        Returns: Generator of other files, then (shuffled) recently played files
+        """
+        from random import shuffle #Shuffles only
+        played = []
+        generated = False
+        for file in files:
+            if recent(file):
+                played.append(file)
+            else:
+                generated = True
+                yield file
+        if exclude and generated: return
+        shuffle(played)
+        for file in played:
+            yield file
+
+    def sampleFirst(self, files, sampleSize = 16):
+        """Pick a random file from the first files of a stream
+
+        Args:
+            files: Files iterable (e.g. iterFiles)
+            sampleSize: Number of early files to pick from
+
+        Returns: Tuple of picked file (None if stream is empty) and
+                 an iterator of the other files
+        """
+        files = iter(files)
+        sample = []
+        for file in files:
+            sample.append(file)
+            if len(sample) >= sampleSize: break
+        if len(sample) == 0: return (None, files)
+        from random import randrange #Shuffles only
+        first = sample.pop(randrange(len(sample)))
+        return (first, itertools.chain(sample, files))
+
+    def getErrors(self):
+        """Get directories or playlists which could not be read by last getFiles
+
+        Returns: List of (directory or playlist, error message) tuples
+        """
+        return self._errors
+
+    def isPlaylist(self, path):
+        """Check whether path (or url) is of a playlist (m3u, m3u8, pls)"""
+        path = path.split('?')[0].split('#')[0]
+        return os.path.splitext(path)[1].lower() in fileRetriver.PLAYLISTS
+
+    def iterPlaylist(self, path):
+        """Get files of playlist (m3u, m3u8, pls), including nested (local) playlists
+        Playlists are read line by line, files are generated while reading.
+        Duplicate files are skipped and files are filtered by the supported formats.
+        Playlists which could not be read are reported by getErrors
+
+        Args:
+            path: Playlist file path
+
+        Return: Generator of files (local paths and http urls) in playlist order
+        """
+        self._errors = []
+        return self.__iterPlaylist(path, set(), set())
+
+    def __iterPlaylist(self, path, seen, visited):
+        """Get files of playlist
+
+        Args:
+            path: Playlist file path
+            seen: Set of already generated files
+            visited: Set of already read playlists (real paths), avoids cycles
+        """
+        real = os.path.realpath(path)
+        if real in visited: return
+        visited.add(real)
+        try:
+            f = open(path, 'rU')
+        except IOError, e:
+            self._errors.append((path, str(e)))
+            return
+        base = os.path.dirname(os.path.abspath(path))
+        pls = path.lower().endswith('.pls')
+        try:
+            for line in f:
+                if line.startswith('\xef\xbb\xbf'): line = line[3:] #utf-8 byte order mark
+                line = line.strip()
+                if pls:
+                    #'FileN=entry', other keys are titles and lengths
+                    key, separator, line = line.partition('=')
+                    if not key.lower().startswith('file') or not key[4:].isdigit(): continue
+                    line = line.strip()
+                elif line.startswith('#'):
+                    continue #Comment or extended info
+                if len(line) == 0: continue
+                entry = self.__resolve(line, base)
+                if entry == None:
+                    self._errors.append((path, 'Unsupported entry ' + line))
+                elif self.isPlaylist(entry):
+                    if entry.startswith('http://'):
+                        self._errors.append((path, 'Remote playlist ' + entry))
+                        continue
+                    for file in self.__iterPlaylist(entry, seen, visited):
+                        yield file
+                elif not entry in seen and self.__acceptEntry(entry):
+                    seen.add(entry)
+                    yield entry
+        finally:
+            f.close()
+
+    def __acceptEntry(self, entry):
+        """Check whether playlist entry (local path or http url) passes the files filter"""
+        path = entry.split('?')[0].split('#')[0]
+        i = path.rfind('/') + 1
+        dir = None #Size is known for local files only
+        if not entry.startswith('http://'): dir = path[:i]
+        return self._filter.acceptFile(path[i:], dir)
+
+    def __resolve(self, entry, base):
+        """Get playlist entry file
+
+        Args:
+            entry: Playlist entry, path (relative to playlist), file or http url
+            base: Playlist directory
+
+        Returns: Normalized local path, http url or None if not supported
+        """
+        if entry.startswith('http://'): return entry
+        if entry.lower().startswith('file://'):
+            import urllib #File urls only
+            entry = urllib.unquote(entry[7:])
+        elif '://' in entry: return None
+        return os.path.normpath(os.path.join(base, entry))
+
+    def getFiles(self, dir, recursive = True, rebuild = False, maxDepth = None):
         """Get files recursively in directory.
-        Supported formats are from constructor
+        Supported formats and other filters are from constructor, excluded
+        directories are not searched
+        When an index directory is set, unchanged directories are read from index
+        Directories which could not be read are reported by getErrors
 
         Args:
-            dir: Directory to search
+            dir: Directory to search or playlist file (see iterPlaylist)
+            recursive: Search sub directories
+            rebuild: Ignore saved index and rebuild it from a full scan
+            maxDepth: Maximum sub directory depth or None for unlimited
 
         Return: List of files in directory
         """
-        list = []
+        return list(self.iterFiles(dir, recursive, rebuild, maxDepth))
+
+    def getFileSet(self, dir, recursive = True, rebuild = False, maxDepth = None):
+        """Get files recursively in directory as a compact FileSet
+        See getFiles for arguments
+
+        Return: FileSet of files in directory
+        """
+        return FileSet(self.iterFiles(dir, recursive, rebuild, maxDepth))
+
+    def iterFiles(self, dir, recursive = True, rebuild = False, maxDepth = None):
+        """Get files recursively in directory, files are generated while search continues
+        See getFiles for arguments
+
+        Return: Generator of files in directory (in no particular order)
+        """
+        self._errors = []
+        if not recursive: maxDepth = 0
+        start = time.time()
+        if self.isPlaylist(dir) and os.path.isfile(dir):
+            for file in self.iterPlaylist(dir):
+                yield file
+            if not _metrics == None:
+                _metrics.record('shufflethis_scan_seconds', (('source', 'playlist'),),
+                                time.time() - start, len(self._errors) > 0)
+            return
+        index = None
+        #Index holds full trees only
+        if not self._indexDir == None and maxDepth == None:
+            index = MediaIndex(self._indexDir, dir, self._filter.getKey())
+            if not rebuild and index.load():
+                age = index.getAge()
+                if self._indexMaxAge > 0 and age >= 0 and age < self._indexMaxAge:
+                    for file in index.getFiles():
+                        yield file
+                    if not _metrics == None:
+                        _metrics.record('shufflethis_scan_seconds', (('source', 'index'),),
+                                        time.time() - start)
+                    return
+        crawler = DirectoryCrawler(self._filter.getFileAccept(), self._workers, maxDepth, index,
+                                   self._filter.getDirectoryAccept())
+        for file in crawler.iterCrawl(dir):
+            yield file
+        self._errors = crawler.getErrors()
+        #Partial index would hide unread directories on next run
+        if not index == None and len(self._errors) == 0: index.save()
+        if not _metrics == None:
+            _metrics.record('shufflethis_scan_seconds', (('source', 'crawl'),),
+                            time.time() - start, len(self._errors) > 0)
+
+class PlaybackWatcher:
+    """Playback state watcher
+       Polls getPlayInfo with an adaptive interval: fast around state changes
+       and near the end of the playing file, slow during steady playback.
+       Listeners are called only on real changes (new file, status change,
+       stop), so many consumers can share a single polling loop
+    """
+    FILE = 'file' #New file playing
+    STATUS = 'status' #Status changed (e.g. pause/resume)
+    STOP = 'stop' #Nothing playing
+
+    def __init__(self, api, fastInterval = 0.5, slowInterval = 5.0, endWindow = 10.0,
+                 settle = 3, misses = 2):
+        """Initialize watcher
+
+        Args:
+            api: TheDavidBox API, used only by the watcher while it runs
+            fastInterval: Seconds between checks around changes
+            slowInterval: Seconds between checks during steady playback
+            endWindow: Seconds before file end in which checks are fast
+            settle: Number of fast checks after a change
+            misses: Number of checks without playback before stop is reported
+        """
+        self._api = api
+        self._fastInterval = fastInterval
+        self._slowInterval = slowInterval
+        self._endWindow = endWindow
+        self._settle = settle
+        self._misses = misses
+        self._state = None
+        self._version = 0
+        self._fast = settle #Fast checks left
+        self._missed = 0
+        self._listeners = []
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    def addListener(self, listener):
+        """Add change listener
+
+        Args:
+            listener: Function called with (change, state, previous state),
+                      change is FILE, STATUS or STOP, state is the play info
+                      dictionary (None on STOP)
+        """
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def removeListener(self, listener):
+        """Remove change listener"""
+        with self._lock:
+            self._listeners = [item for item in self._listeners if not item == listener]
+
+    def getState(self):
+        """Get last play info (see TheDavidBox.getPlayInfo) or None if nothing plays"""
+        return self._state
+
+    def getVersion(self):
+        """Get state version, incremented on every change"""
+        return self._version
+
+    def __seconds(self, state, key):
+        """Get play info time value in seconds or None"""
         try:
-            for root, subs, files in os.walk(dir):
-                for file in files:
-                    if self._formats == None:
-                        list.append(os.path.join(root, file))
-                    else:
-                        lowerFile = file.lower()
-                        for format in self._formats:
-                            if lowerFile.endswith(format):
-                                list.append(os.path.join(root, file))
-                                break
-        except:
-            pass
-        return list
+            return float(state.get(key))
+        except (TypeError, ValueError):
+            return None
+
+    def __change(self, state):
+        """Get change kind between current and new state or None"""
+        previous = self._state
+        if state == None:
+            if previous == None: return
+            return PlaybackWatcher.STOP
+        if previous == None or not state.get('fullPath') == previous.get('fullPath'):
+            return PlaybackWatcher.FILE
+        if not state.get('currentStatus') == previous.get('currentStatus'):
+            return PlaybackWatcher.STATUS
+
+    def check(self):
+        """Check playback state once and call listeners on change
+
+        Returns: Seconds until next check
+        """
+        import httplib #API errors
+        try:
+            state = self._api.getPlayInfo()
+        except (IOError, socket.error, httplib.HTTPException):
+            #API is not exception safe, reconnect and count as a miss
+            self._api.reconnect()
+            self._missed += 1
+            return self._fastInterval
+        if not state == None and (state.get('fullPath') == None or
+                                  state.get('currentStatus') == 'stop'):
+            state = None
+        if state == None and not self._state == None:
+            #Device may report nothing for a moment between files
+            self._missed += 1
+            if self._missed < self._misses: return self._fastInterval
+        self._missed = 0
+        change = self.__change(state)
+        previous = self._state
+        self._state = state
+        if not change == None:
+            self._version += 1
+            self._fast = self._settle
+            for listener in self._listeners:
+                listener(change, state, previous)
+        return self.__interval(state)
+
+    def __interval(self, state):
+        """Get seconds until next check"""
+        if self._fast > 0:
+            self._fast -= 1
+            return self._fastInterval
+        if state == None: return self._slowInterval
+        if not state.get('currentStatus') == 'play': return self._fastInterval
+        current = self.__seconds(state, 'currentTime')
+        total = self.__seconds(state, 'totalTime')
+        if current == None or total == None or total <= 0: return self._slowInterval
+        #Wake up once file is about to end
+        left = total - current - self._endWindow
+        if left <= 0: return self._fastInterval
+        return max(self._fastInterval, min(self._slowInterval, left))
+
+    def run(self, until = None, wait = 0):
+        """Check playback until stopped
+
+        Args:
+            until: Optional function, watcher stops once it returns True
+            wait: Seconds before first check, e.g. after a check by the caller
+        """
+        self._running = True
+        end = time.time() + wait
+        while self._running and (until == None or not until()):
+            left = end - time.time()
+            if left > 0:
+                #Sleep in short steps to stop promptly
+                time.sleep(min(left, self._fastInterval))
+                continue
+            end = time.time() + self.check()
+
+    def start(self, wait = 0):
+        """Run watcher in background thread, see run"""
+        if not self._thread == None: return
+        self._thread = threading.Thread(target = self.run, args = (None, wait))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watcher"""
+        self._running = False
+        if not self._thread == None and not self._thread == threading.currentThread():
+            self._thread.join()
+        self._thread = None
+
+class RollingQueue:
+    """Rolling device queue
+       Keeps only a window of files queued ahead of the playing file and tops
+       it up as files are played, instead of queuing the whole list up front
+    """
+    def __init__(self, api, files, window = 10, timeout = 30.0):
+        """Initialize rolling queue
+
+        Args:
+            api: TheDavidBox API
+            files: Files iterable (e.g. shuffled list), first file is played
+            window: Number of files queued ahead of the playing file
+            timeout: Seconds to wait for the device to report the first file playing
+        """
+        self._api = api
+        self._files = iter(files)
+        self._window = max(1, window)
+        self._timeout = timeout
+        self._started = None #Time first file was played
+        self._playing = False #Device reported queue playing
+        self._finished = False
+        self._current = None #Playing file
+        self._upcoming = deque() #Queued files, in queue order
+        self._played = 0
+
+    def getPlayed(self):
+        """Get number of files played so far"""
+        return self._played
+
+    def __normalize(self, path):
+        """Get file path as played by device, device paths (unicode) are utf-8 encoded
+           to match listed file paths"""
+        if path.startswith('file://'): path = path[len('file://'):]
+        if isinstance(path, unicode): path = path.encode('utf-8')
+        return path
+
+    def __fill(self):
+        """Enqueue files until window is full
+
+        Returns: False if no file is left to enqueue
+        """
+        while len(self._upcoming) < self._window:
+            try:
+                file = self._files.next()
+            except StopIteration:
+                return False
+            if self._api.enqueue(file):
+                self._upcoming.append(self.__normalize(file))
+        return True
+
+    def start(self):
+        """Play first file and fill window
+
+        Returns: True if playing otherwise False
+        """
+        try:
+            first = self._files.next()
+        except StopIteration:
+            return False
+        if not self._api.play(first): return False
+        self._started = time.time()
+        self._current = self.__normalize(first)
+        self._played = 1
+        self.__fill()
+        return True
+
+    def update(self, info):
+        """Update queue from play info
+
+        Args:
+            info: Play info (see TheDavidBox.getPlayInfo) or None if nothing plays
+
+        Returns: False once the queue is no longer playing (stopped, finished or
+                 a file outside the queue was played) otherwise True
+        """
+        if info == None or info.get('fullPath') == None: return False
+        if info.get('currentStatus') == 'stop': return False
+        path = self.__normalize(info.get('fullPath'))
+        if path == self._current: return True
+        if not path in self._upcoming: return False
+        #Device moved ahead in queue
+        while len(self._upcoming) > 0:
+            self._current = self._upcoming.popleft()
+            self._played += 1
+            if self._current == path: break
+        self.__fill()
+        return True
+
+    def isFinished(self):
+        """Get whether queue is no longer playing, or never started playing within timeout"""
+        if not self._finished and not self._playing and not self._started == None and \
+           time.time() - self._started > self._timeout:
+            self._finished = True
+        return self._finished
+
+    def onChange(self, change, state, previous):
+        """PlaybackWatcher listener, updates queue"""
+        if self.update(state): self._playing = True
+        else: self._finished = True
+
+    def run(self, watcher = None):
+        """Play and keep queue filled until playback ends
+
+        Args:
+            watcher: Optional PlaybackWatcher, by default a watcher is created.
+                     A given (shared) watcher is expected to be running
+        """
+        if not self.start(): return
+        if watcher == None:
+            watcher = PlaybackWatcher(self._api)
+            watcher.addListener(self.onChange)
+            watcher.run(self.isFinished)
+        else:
+            watcher.addListener(self.onChange)
+            #Watcher reports no change if it already saw the first file playing
+            if self.update(watcher.getState()): self._playing = True
+            while not self.isFinished():
+                time.sleep(1)
+            watcher.removeListener(self.onChange)
+
+class Session:
+    """Checkpointed shuffle session
+       Keeps the shuffled files (FileSet) and the playing position in a session
+       file, so a stopped shuffle resumes without a scan or enqueuing all files.
+       Files are written once, the position is a fixed size header rewritten
+       in place as playback advances
+    """
+    VERSION = 1
+    HEADER = 16 #Position header size
+
+    def __init__(self, path):
+        """Initialize session
+
+        Args:
+            path: Session file path
+        """
+        self._path = path
+        self._source = None
+        self._files = None
+        self._position = 0
+
+    def getPath(self):
+        """Get session file path"""
+        return self._path
+
+    def getSource(self):
+        """Get shuffled directory or playlist"""
+        return self._source
+
+    def getFiles(self):
+        """Get shuffled FileSet"""
+        return self._files
+
+    def getPosition(self):
+        """Get position of playing file"""
+        return self._position
+
+    def create(self, source, files):
+        """Start session and save it, replacing a previous session atomically
+
+        Args:
+            source: Shuffled directory or playlist
+            files: Shuffled FileSet, first file is played first
+
+        Returns: True if saved otherwise False
+        """
+        self._source = os.path.abspath(source)
+        self._files = files
+        self._position = 0
+        temp = self._path + '.tmp'
+        try:
+            f = open(temp, 'wb')
+            try:
+                f.write(self.__header())
+                marshal.dump((Session.VERSION, array('I').itemsize, self._source, time.time(),
+                              files.getState()), f)
+            finally:
+                f.close()
+            os.rename(temp, self._path)
+            return True
+        except (IOError, OSError):
+            return False
+
+    def load(self):
+        """Load session file
+
+        Returns: True if loaded otherwise False
+        """
+        try:
+            f = open(self._path, 'rb')
+            try:
+                position = int(f.read(Session.HEADER))
+                data = marshal.load(f)
+            finally:
+                f.close()
+            if data[0] <> Session.VERSION or data[1] <> array('I').itemsize: return False
+            files = FileSet()
+            files.setState(data[4])
+            if position < 0 or position >= len(files): return False
+            self._source = data[2]
+            self._files = files
+            self._position = position
+            return True
+        except (IOError, EOFError, ValueError, TypeError, IndexError):
+            return False
+
+    def __header(self):
+        """Get position header"""
+        return ('%d' % self._position).ljust(Session.HEADER - 1) + '\n'
+
+    def setPosition(self, position):
+        """Set playing position, saved in place
+
+        Returns: True if saved otherwise False
+        """
+        self._position = position
+        try:
+            f = open(self._path, 'r+b')
+            try:
+                f.write(self.__header())
+            finally:
+                f.close()
+            return True
+        except IOError:
+            return False
+
+    def iterFiles(self):
+        """Get files from playing position on"""
+        return itertools.islice(self._files, self._position, None)
+
+    def advance(self, path, lookahead = 256):
+        """Move position to played file
+
+        Args:
+            path: Played file (as reported by device)
+            lookahead: Number of files after position to look for path
+
+        Returns: True if path was found otherwise False
+        """
+        if path.startswith('file://'): path = path[len('file://'):]
+        if isinstance(path, unicode): path = path.encode('utf-8') #Files are utf-8 str
+        end = min(len(self._files), self._position + lookahead + 1)
+        for i in xrange(self._position, end):
+            if self._files[i] == path:
+                if not i == self._position: self.setPosition(i)
+                return True
+        return False
+
+    def onChange(self, change, state, previous):
+        """PlaybackWatcher listener, saves position of new playing file"""
+        if change == PlaybackWatcher.FILE: self.advance(state.get('fullPath'))
+
+class PlayHistory:
+    """Recently played files
+       Hashed (crc32) paths are kept in an open addressing table of arrays with
+       the day and session each file was last played, so checking a file takes
+       constant time and memory does not depend on path lengths. Entries older
+       than the kept days and sessions are dropped when the table is saved or
+       grows, so the history stays small however long it is used.
+       A rare hash collision only makes a file look recently played
+    """
+    VERSION = 1
+    DAY = 24 * 60 * 60
+
+    def __init__(self, path, days = 30, sessions = 0):
+        """Initialize history
+
+        Args:
+            path: History file path
+            days: Files played in the last days are recent, 0 to ignore days
+            sessions: Files played in the last sessions (runs) are recent, 0 to ignore sessions
+        """
+        self._path = path
+        self._days = days
+        self._sessions = sessions
+        self._session = 0
+        self._unsaved = 0 #Files added since last save
+        from zlib import crc32 #Play history only
+        self._crc32 = crc32
+        self.__reset(1024)
+
+    def __reset(self, capacity):
+        """Empty table of capacity (power of 2) slots"""
+        self._keys = array('I', [0]) * capacity
+        self._stampDays = array('H', [0]) * capacity
+        self._stampSessions = array('I', [0]) * capacity
+        self._count = 0
+
+    def __key(self, path):
+        """Get path hash, 0 marks empty slots"""
+        if path.startswith('file://'): path = path[len('file://'):]
+        if isinstance(path, unicode): path = path.encode('utf-8')
+        return (self._crc32(path) & 0xffffffff) or 1
+
+    def __slot(self, key):
+        """Get slot of key or empty slot where it belongs"""
+        keys = self._keys
+        mask = len(keys) - 1
+        i = key & mask
+        while True:
+            current = keys[i]
+            if current == 0 or current == key: return i
+            i = (i + 1) & mask
+
+    def __isKept(self, i):
+        """Check whether slot entry is still recent"""
+        if self._keys[i] == 0: return False
+        today = int(time.time() / PlayHistory.DAY)
+        if self._days > 0 and today - self._stampDays[i] < self._days: return True
+        #Files of the current session (stamped with it) and of the last sessions before it
+        if self._sessions > 0 and self._session - self._stampSessions[i] <= self._sessions: return True
+        return False
+
+    def __rebuild(self):
+        """Drop old entries, table is resized to fit the remaining entries"""
+        kept = [(self._keys[i], self._stampDays[i], self._stampSessions[i])
+                for i in xrange(len(self._keys)) if self.__isKept(i)]
+        capacity = 1024
+        while capacity * 3 < len(kept) * 5: capacity *= 2 #Below 60% full
+        self.__reset(capacity)
+        for key, day, session in kept:
+            i = self.__slot(key)
+            self._keys[i] = key
+            self._stampDays[i] = day
+            self._stampSessions[i] = session
+        self._count = len(kept)
+
+    def load(self):
+        """Load history file
+
+        Returns: True if loaded otherwise False
+        """
+        try:
+            f = open(self._path, 'rb')
+            try:
+                data = marshal.load(f)
+            finally:
+                f.close()
+            if data[0] <> PlayHistory.VERSION or data[1] <> array('I').itemsize: return False
+            keys = array('I')
+            keys.fromstring(data[3])
+            days = array('H')
+            days.fromstring(data[4])
+            sessions = array('I')
+            sessions.fromstring(data[5])
+            if not len(keys) == len(days) == len(sessions) or len(keys) == 0 or \
+               len(keys) & (len(keys) - 1):
+                return False
+            self._session = data[2]
+            self._keys = keys
+            self._stampDays = days
+            self._stampSessions = sessions
+            self._count = len(keys) - keys.count(0)
+            return True
+        except (IOError, EOFError, ValueError, TypeError, IndexError):
+            return False
+
+    def save(self):
+        """Save history without old entries, replacing the previous file atomically
+
+        Returns: True if saved otherwise False
+        """
+        self.__rebuild()
+        self._unsaved = 0
+        temp = self._path + '.tmp'
+        try:
+            f = open(temp, 'wb')
+            try:
+                marshal.dump((PlayHistory.VERSION, array('I').itemsize, self._session,
+                              self._keys.tostring(), self._stampDays.tostring(),
+                              self._stampSessions.tostring()), f)
+            finally:
+                f.close()
+            os.rename(temp, self._path)
+            return True
+        except (IOError, OSError):
+            return False
+
+    def startSession(self):
+        """Start a new session (run), files played before it are one session older"""
+        self._session += 1
+
+    def add(self, path):
+        """Record file as played now
+
+        Args:
+            path: Played file (local path, file or http url)
+        """
+        key = self.__key(path)
+        i = self.__slot(key)
+        if self._keys[i] == 0:
+            self._count += 1
+            self._keys[i] = key
+        self._stampDays[i] = int(time.time() / PlayHistory.DAY)
+        self._stampSessions[i] = self._session
+        if self._count * 4 >= len(self._keys) * 3: self.__rebuild() #Above 75% full
+
+    def isRecent(self, path):
+        """Check whether file was recently played"""
+        return self.__isKept(self.__slot(self.__key(path)))
+
+    def __len__(self):
+        """Get number of recorded files (including not yet dropped old entries)"""
+        return self._count
+
+    def onChange(self, change, state, previous):
+        """PlaybackWatcher listener, records played files, history is saved every few files"""
+        if not change == PlaybackWatcher.FILE: return
+        self.add(state.get('fullPath'))
+        self._unsaved += 1
+        if self._unsaved >= 10: self.save()
+
+#Functions
+def parseDuration(text):
+    """Parse duration text
+
+    Args:
+        text: Minutes (e.g. "90") or hours and minutes (e.g. "2h", "1h30m", "45m")
+
+    Returns: Seconds
+
+    Raises: ValueError on invalid text
+    """
+    import re #Time budget only
+    match = re.match(r'^\s*(?:(\d+(?:\.\d+)?)\s*h)?\s*(?:(\d+(?:\.\d+)?)\s*m?)?\s*$', text, re.IGNORECASE)
+    if match == None or (match.group(1) == None and match.group(2) == None):
+        raise ValueError('invalid duration: ' + text)
+    hours, minutes = match.groups()
+    return float(hours or 0) * 3600 + float(minutes or 0) * 60
+
+def setMetrics(recorder):
+    """Set metrics recorder of API calls and directory scans, disabled (None) by default
+
+    Args:
+        recorder: Object with record(name, labels, seconds, error = False) method,
+                  labels is a tuple of (name, value) pairs, or None to disable
+    """
+    global _metrics
+    _metrics = recorder
+
+def playQueue(api, files, window = 10, listeners = []):
+    """Play files in a rolling queue until playback ends
+
+    Args:
+        api: TheDavidBox API
+        files: Files iterable, first file is played
+        window: Number of files queued ahead of the playing file
+        listeners: PlaybackWatcher listeners called after queue updates (e.g. Session.onChange)
+
+    Returns: Number of files played
+    """
+    queue = RollingQueue(api, files, window)
+    if queue.start():
+        #Same as RollingQueue.run, with more listeners on the same watcher
+        watcher = PlaybackWatcher(api)
+        watcher.addListener(queue.onChange)
+        for listener in listeners:
+            watcher.addListener(listener)
+        watcher.run(queue.isFinished)
+    return queue.getPlayed()
+
+def playSession(api, session, window = 10, listeners = []):
+    """Play session from its position in a rolling queue, position is saved as playback advances
+    See playQueue for arguments
+
+    Returns: Number of files played
+    """
+    played = playQueue(api, session.iterFiles(), window, [session.onChange] + listeners)
+    print 'Played %d files, session position %d of %d' % (played, session.getPosition() + 1,
+                                                           len(session.getFiles()))
+    return played
+
+def enqueueAll(api, files, connections = 4):
+    """Enqueue files as they are generated
+
+    Args:
+        api: TheDavidBox API
+        files: Files iterable, already shuffled
+        connections: Number of enqueue pool connections
+
+    Returns: Tuple of enqueued and failed files count
+    """
+    results = []
+    for file in files:
+        #Files are already shuffled, so queue order does not matter
+        api.enqueueLater(file, None, results.append, connections)
+    api.waitPending()
+    return (len(results), results.count(False))
 
 #Main
-def main():
+def main(argv = None):
     """
     Main entry point
+
+    Args:
+        argv: Optional arguments list, by default command line arguments
     """
-    #Extract directory
-    if len(sys.argv) <> 2:
-        print 'Usage: ShuffleThis [directory]'
+    import httplib #API errors
+    from optparse import OptionParser #Arguments
+    #Extract options and directory
+    parser = OptionParser(usage = 'Usage: ShuffleThis [options] [directory or playlist]')
+    parser.add_option('-i', '--index', dest = 'index', default = None,
+                      help = 'directory of persistent media index (disabled by default)')
+    parser.add_option('--index-max-age', dest = 'indexMaxAge', type = 'int', default = 0,
+                      help = 'seconds in which index is used without checking for changes')
+    parser.add_option('--rebuild', dest = 'rebuild', action = 'store_true', default = False,
+                      help = 'ignore saved index and rebuild it from a full scan')
+    parser.add_option('-w', '--workers', dest = 'workers', type = 'int', default = 4,
+                      help = 'number of directory listing threads')
+    parser.add_option('-d', '--depth', dest = 'depth', type = 'int', default = None,
+                      help = 'maximum sub directory depth (unlimited by default)')
+    parser.add_option('-f', '--formats', dest = 'formats', default = None,
+                      help = 'comma separated formats (extensions), by default the device '
+                             'supported video formats')
+    parser.add_option('--include', dest = 'include', action = 'append', default = None,
+                      help = 'only files which name matches glob pattern (e.g. "*.mkv"), repeatable')
+    parser.add_option('--exclude', dest = 'exclude', action = 'append', default = None,
+                      help = 'skip files and directories which name matches glob pattern '
+                             '(e.g. "*sample*"), repeatable')
+    parser.add_option('--min-size', dest = 'minSize', type = 'int', default = 0,
+                      help = 'skip files smaller than this number of bytes')
+    parser.add_option('-s', '--stream', dest = 'stream', action = 'store_true', default = False,
+                      help = 'start playing a file found early while search continues')
+    parser.add_option('--sample', dest = 'sample', type = 'int', default = 16,
+                      help = 'number of early files the first (streamed) file is picked from')
+    parser.add_option('--buffer', dest = 'buffer', type = 'int', default = None,
+                      help = 'streamed shuffle buffer size, enqueues while searching with '
+                             'approximate order (by default the queue is uniformly shuffled)')
+    parser.add_option('-q', '--window', dest = 'window', type = 'int', default = 0,
+                      help = 'keep only this number of files queued ahead and keep running '
+                             'to top up the queue (by default all files are queued)')
+    parser.add_option('--session', dest = 'session', default = None,
+                      help = 'keep shuffled files and playing position in session file, '
+                             'uses a rolling queue (--window, 10 by default)')
+    parser.add_option('--resume', dest = 'resume', action = 'store_true', default = False,
+                      help = 'resume session (--session) from its playing file, '
+                             'without search and full queue')
+    parser.add_option('--history', dest = 'history', default = None,
+                      help = 'keep played files in history file, recently played files are '
+                             'shuffled last, uses a rolling queue (--window, 10 by default)')
+    parser.add_option('--history-days', dest = 'historyDays', type = 'int', default = 30,
+                      help = 'files played in the last days are recent (0 to ignore days)')
+    parser.add_option('--history-sessions', dest = 'historySessions', type = 'int', default = 0,
+                      help = 'files played in the last runs are recent (0 to ignore runs)')
+    parser.add_option('--skip-recent', dest = 'skipRecent', action = 'store_true', default = False,
+                      help = 'leave recently played files out instead of shuffling them last')
+    parser.add_option('-b', '--budget', dest = 'budget', default = None,
+                      help = 'play shuffled files up to a total duration, minutes or hours and '
+                             'minutes (e.g. "90", "2h", "1h30m"), durations are read from file headers')
+    parser.add_option('--probe-index', dest = 'probeIndex', default = None,
+                      help = 'file of cached durations (--budget), by default "probe.idx" '
+                             'in index directory (--index) if set')
+    options, args = parser.parse_args(argv)
+    budget = None
+    if not options.budget == None:
+        try:
+            budget = parseDuration(options.budget)
+        except ValueError, e:
+            parser.error(str(e))
+        if budget <= 0: parser.error('--budget must be positive')
+    if options.resume and options.session == None: parser.error('--resume requires --session')
+    if options.stream and not options.session == None:
+        parser.error('--stream can not be used with --session')
+    if (not options.session == None or not options.history == None) and options.window <= 0:
+        options.window = 10
+    api = TheDavidBox() #TODO port should be from configuration
+    listeners = []
+    history = None
+    if not options.history == None:
+        history = PlayHistory(options.history, options.historyDays, options.historySessions)
+        history.load()
+        history.startSession()
+        listeners.append(history.onChange)
+    #Resume session
+    if options.resume:
+        session = Session(options.session)
+        if session.load() and (len(args) == 0 or session.getSource() == os.path.abspath(args[0])):
+            api.stop()
+            playSession(api, session, options.window, listeners)
+            if not history == None: history.save()
+            return
+        print 'No session to resume, starting new shuffle'
+    if len(args) <> 1:
+        parser.print_usage()
         return
-    #Get files #TODO support remote (smb/nfs) and playlists (m3u, pls)
-    fr = fileRetriver([ 'avi', 'mkv', 'mp4', 'flv' ]) #TODO from configuration
-    files = fr.getFiles(sys.argv[1])
-    count = len(files)
-    if count == 0:
+    #Get files #TODO support remote (smb/nfs)
+    formats = None
+    if not options.formats == None:
+        formats = [format.strip() for format in options.formats.split(',') if len(format.strip()) > 0]
+    else:
+        try:
+            formats = api.getSupportedVideoFormats()
+        except (IOError, socket.error, httplib.HTTPException):
+            pass
+        if formats == None or len(formats) == 0: formats = [ 'avi', 'mkv', 'mp4', 'flv' ]
+    fr = fileRetriver(formats, options.index, options.indexMaxAge, options.workers,
+                      options.include, options.exclude, options.minSize)
+    files = fr.iterFiles(args[0], rebuild = options.rebuild, maxDepth = options.depth)
+    if options.stream:
+        #Play first file found while search continues
+        #First file is picked from files not recently played
+        if not history == None: files = fr.deferRecent(files, history.isRecent, options.skipRecent)
+        first, files = fr.sampleFirst(files, options.sample)
+        files = fr.shuffleStream(files, options.buffer)
+        #Shuffle mixes recently played files back in
+        if not history == None: files = fr.deferRecent(files, history.isRecent, options.skipRecent)
+    else:
+        #Compact set, paths are created only when enqueued
+        fileSet = FileSet(files)
+        if history == None: fileSet.shuffle()
+        else: fileSet.shuffle(history.isRecent, options.skipRecent)
+        first = None
+        if len(fileSet) > 0: first = fileSet[0]
+        files = itertools.islice(fileSet, 1, None)
+    if not budget == None and not first == None:
+        #Shuffled files which fit the time budget, probed only until it is filled
+        probeIndex = options.probeIndex
+        if probeIndex == None and not options.index == None:
+            probeIndex = os.path.join(options.index, 'probe.idx')
+        from MediaProbe import MediaProbe #Time budget only
+        probe = MediaProbe(probeIndex, options.workers)
+        probe.load()
+        fileSet = FileSet(probe.selectBudget(itertools.chain([first], files), budget))
+        probe.save()
+        count, seconds = probe.getSelected()
+        print 'Selected %d files, %d minutes' % (count, seconds / 60)
+        first = None
+        if len(fileSet) > 0: first = fileSet[0]
+        files = itertools.islice(fileSet, 1, None)
+    if first == None:
+        for error in fr.getErrors():
+            print 'Failed to read %s: %s' % error
         print 'No video files found'
         return
-    fr.shuffleList(files)
     #Play
-    api = TheDavidBox() #TODO port should be from configuration
     api.stop()
-    api.play(files[0])
-    for i in range(1, count):
-        api.enqueue(files[i])
+    if not options.session == None:
+        #Shuffled order with first file at session start
+        session = Session(options.session)
+        if not session.create(args[0], fileSet):
+            print 'Failed to save session ' + options.session
+        else:
+            playSession(api, session, options.window, listeners)
+            if not history == None: history.save()
+            for error in fr.getErrors():
+                print 'Failed to read %s: %s' % error
+            return
+    if options.window > 0:
+        #Rolling queue, runs until playback ends
+        played = playQueue(api, itertools.chain([first], files), options.window, listeners)
+        if not history == None: history.save()
+        for error in fr.getErrors():
+            print 'Failed to read %s: %s' % error
+        print 'Played %d files' % played
+        return
+    api.play(first)
+    count, failed = enqueueAll(api, files)
+    api.close() #Stop enqueue pool
+    for error in fr.getErrors():
+        print 'Failed to read %s: %s' % error
+    if failed > 0:
+        print 'Failed to enqueue %d of %d files' % (failed, count)
 
 if __name__ == '__main__':
     main()